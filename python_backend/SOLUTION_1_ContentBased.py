@@ -14,87 +14,1626 @@
 
 from sklearn.feature_extraction.text import TfidfVectorizer
 from sklearn.metrics.pairwise import cosine_similarity
+from sklearn.decomposition import TruncatedSVD
+from sklearn.cluster import MiniBatchKMeans
+from collections import OrderedDict, namedtuple
+from scipy import sparse
+import copy
+import hashlib
+import heapq
+import json
+import logging
+import os
+import re
+import shutil
+import threading
+import time
+import uuid
 import pandas as pd
 import numpy as np
 
+logger = logging.getLogger(__name__)
+
+
+# CEFR 等级编码
+LEVEL_MAP = {'A1': 0, 'A2': 1, 'B1': 2, 'B2': 3, 'C1': 4, 'C2': 5}
+
+# Level 匹配加分：按等级差查表（差 0 → 0.3，差 1 → 0.15，其余 0）
+LEVEL_BONUS = np.array([0.3, 0.15, 0.0, 0.0, 0.0, 0.0])
+
+# 最终得分权重
+SIMILARITY_WEIGHT = 0.7
+LEVEL_WEIGHT = 0.3
+
+# 协同过滤（物品共现）加分权重：没有共现数据时结果与纯内容推荐完全一致
+COLLABORATIVE_WEIGHT = 0.2
+
+# 共现矩阵每个物品保留的邻居数（内存 ~ 内容数 × K，而不是内容数²）
+COOCCURRENCE_TOP_K = 50
+
+# 每条新完成记录只与该用户最近完成的这么多课程配对，控制单次更新的开销
+COOCCURRENCE_HISTORY = 100
+
+# 共现数据每新增这么多条完成记录算一个新版本（画像指纹包含版本号，协同信号变化后重新生成推荐）
+COOCCURRENCE_GENERATION_STEP = 1000
+
+RESULT_COLUMNS = ['id', 'title', 'category', 'level']
+
+# 推荐结果附带的完整记录字段（内容表中存在时才返回）
+RECORD_COLUMNS = RESULT_COLUMNS + ['description', 'type', 'route']
+
+# 推荐过滤条件：按取值预计算布尔索引的列，以及 recommend(filters=...) 支持的键
+FACET_COLUMNS = ('type', 'category')
+FILTER_KEYS = FACET_COLUMNS + ('level_min', 'level_max', 'include_ids', 'exclude_ids')
+
+# 前端学习目标（LearningGoalsPage）
+KNOWN_GOALS = ['grammar', 'vocabulary', 'speaking', 'listening', 'reading', 'writing']
+
+# 请求时遇到的新 goal / level 也会缓存其分量，上限防止无限增长
+MAX_QUERY_COMPONENTS = 4096
+
+# 近似最近邻（ANN）：内容数达到阈值才启用，默认关闭
+ANN_DIMENSIONS = 128          # TruncatedSVD 降维后的维数
+ANN_PROBES = 128              # 每次查询探测的聚类数（按得分上界选）
+ANN_SAMPLE_SIZE = 100000      # SVD / KMeans 只在这么多行的样本上训练
+
+# 紧凑模式：content_matrix 的存储精度（None = sklearn 默认的 float64）
+# TF-IDF 权重非负，8 位模式用 uint8 + 每行一个 float32 缩放系数
+COMPACT_MODES = (None, 'float32', 'uint8')
+
+# 模型快照格式版本（save / load）
+SNAPSHOT_FORMAT = 1
+SHARDED_SNAPSHOT_FORMAT = 'sharded-1'
+
+
+class RankingCache:
+    """线程安全的 LRU 缓存：画像 key → 排好序的候选 (行号, 得分)"""
+    
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+    
+    def put(self, key, entry):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+    
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+    
+    def info(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+            }
+
+
+class ItemCooccurrence:
+    """
+    物品共现模型（隐式反馈的协同过滤阶段）
+    
+    稀疏的物品-物品共现矩阵按行存成 {物品: {邻居: 共同完成的用户数}}（DOK 形式），
+    用户每完成一门新课程就增量更新，不需要定时全量重建：
+    - 新课程只与该用户最近 history 门已完成课程配对
+    - 每行超过 2K 个邻居时只保留计数最高的 K 个，内存随内容数线性增长
+    
+    相似度 = 共现数 / sqrt(完成 a 的人数 × 完成 b 的人数)（二值用户向量的余弦）。
+    以 id 为键，与内容快照无关，模型重训 / 增量修改后可以继续共用
+    
+    读写分离（read-copy-update）：observe() 只在锁内修改行的副本，改完后整行替换；
+    已发布的行不再修改，scores() 不加锁，推荐线程之间、与 observe() 之间都不互相等待
+    """
+    
+    def __init__(self, top_k=COOCCURRENCE_TOP_K, history=COOCCURRENCE_HISTORY,
+                 generation_step=COOCCURRENCE_GENERATION_STEP):
+        self.top_k = top_k
+        self.history = history
+        self.generation_step = generation_step
+        self.updates = 0
+        self._neighbours = {}    # 物品 → {邻居: 共现数}
+        self._item_users = {}    # 物品 → 完成人数
+        self._user_items = {}    # 用户 → (已记录的课程集合, 按完成顺序的最近课程)
+        self._lock = threading.Lock()
+    
+    def observe(self, user_id, completed_lessons):
+        """
+        记录用户当前的完成列表（userProgress.completedLessons），只处理新增的部分；
+        返回新增条数
+        """
+        with self._lock:
+            seen, recent = self._user_items.get(user_id, (set(), []))
+            new_items = [item for item in dict.fromkeys(completed_lessons) if item not in seen]
+            if not new_items:
+                return 0
+            
+            seen = set(seen)
+            recent = list(recent)
+            rows = {}    # 本次修改的行（副本）
+            for item in new_items:
+                self._item_users[item] = self._item_users.get(item, 0) + 1
+                for other in recent[-self.history:]:
+                    self._bump(rows, item, other)
+                    self._bump(rows, other, item)
+                seen.add(item)
+                recent.append(item)
+            
+            # 人数先更新、行后发布：读到的行里每个邻居都已有完成人数
+            self._neighbours.update(rows)
+            self._user_items[user_id] = (seen, recent[-self.history:])
+            self.updates += len(new_items)
+            return len(new_items)
+    
+    def _bump(self, rows, item, other):
+        row = rows.get(item)
+        if row is None:
+            row = rows[item] = dict(self._neighbours.get(item, ()))
+        row[other] = row.get(other, 0) + 1
+        if len(row) > 2 * self.top_k:
+            kept = heapq.nlargest(self.top_k, row.items(), key=lambda pair: pair[1])
+            row.clear()
+            row.update(kept)
+    
+    def scores(self, completed_lessons):
+        """已完成课程的邻居 → 协同得分（按最大值归一化到 0..1），不含已完成的课程"""
+        completed = set(completed_lessons)
+        totals = {}
+        # 不加锁：行发布后只读（见类说明）
+        neighbours, item_users = self._neighbours, self._item_users
+        for item in completed:
+            row = neighbours.get(item)
+            if not row:
+                continue
+            users = item_users[item]
+            for other, count in row.items():
+                if other in completed:
+                    continue
+                similarity = count / np.sqrt(users * item_users[other])
+                totals[other] = totals.get(other, 0.0) + similarity
+        
+        if not totals:
+            return {}
+        top = max(totals.values())
+        return {item: value / top for item, value in totals.items()}
+    
+    @property
+    def generation(self):
+        """版本号：每 generation_step 条新完成记录加一（用于画像指纹）"""
+        return self.updates // self.generation_step
+    
+    def info(self):
+        with self._lock:
+            return {
+                'items': len(self._neighbours),
+                'pairs': sum(len(row) for row in self._neighbours.values()),
+                'users': len(self._user_items),
+                'updates': self.updates,
+                'generation': self.generation,
+                'top_k': self.top_k,
+            }
+
+
+class AnnIndex:
+    """
+    IVF 近似最近邻索引：TF-IDF → TruncatedSVD 稠密向量 → KMeans 聚类倒排表
+    
+    每个聚类记录各词的最大 TF-IDF 权重和包含的 Level，查询时据此算出该聚类
+    得分的上界，只探测上界最高的 n_probes 个聚类；候选再用原始 TF-IDF 精确打分
+    （相似度 + Level 加分），结果只可能漏召回，不会打错分
+    """
+    
+    def __init__(self, components, centroids, labels, cluster_max, cluster_levels, n_probes=ANN_PROBES):
+        self.components = components          # 维数 × 词表，float32
+        self.centroids = centroids            # 聚类数 × 维数，L2 归一化
+        self.labels = labels                  # 每行所属聚类，int32
+        self.cluster_max = cluster_max        # 聚类数 × 词表：聚类内每个词的最大权重，float32
+        self.cluster_levels = cluster_levels  # 聚类数 × Level 数：聚类里是否有该 Level 的内容
+        self.n_probes = n_probes
+        
+        # 倒排表：按聚类排好的行号 + 每个聚类的起止位置
+        self._order = np.argsort(labels, kind='stable').astype(np.int32)
+        self._offsets = np.searchsorted(labels[self._order], np.arange(len(centroids) + 1))
+    
+    @classmethod
+    def build(cls, content_matrix, level_codes, dimensions=ANN_DIMENSIONS, n_clusters=None,
+              n_probes=ANN_PROBES, sample_size=ANN_SAMPLE_SIZE, random_state=0):
+        size, vocabulary_size = content_matrix.shape
+        rng = np.random.default_rng(random_state)
+        sample = content_matrix
+        if size > sample_size:
+            sample = content_matrix[np.sort(rng.choice(size, sample_size, replace=False))]
+        
+        svd = TruncatedSVD(
+            n_components=max(1, min(dimensions, vocabulary_size - 1, sample.shape[0] - 1)),
+            random_state=random_state
+        )
+        svd.fit(sample)
+        components = svd.components_.astype(np.float32)
+        
+        # 聚类数约 4√n，每个聚类平均 √n / 4 行
+        if n_clusters is None:
+            n_clusters = int(np.clip(4 * np.sqrt(size), 16, 4096))
+        n_clusters = max(1, min(n_clusters, sample.shape[0]))
+        kmeans = MiniBatchKMeans(
+            n_clusters=n_clusters, batch_size=4096, n_init=1, random_state=random_state
+        )
+        kmeans.fit(_normalize_rows(sample @ components.T))
+        centroids = _normalize_rows(kmeans.cluster_centers_.astype(np.float32))
+        
+        index = cls(
+            components, centroids, np.zeros(size, dtype=np.int32),
+            np.zeros((n_clusters, vocabulary_size), dtype=np.float32),
+            np.zeros((n_clusters, len(LEVEL_BONUS)), dtype=bool),
+            n_probes
+        )
+        labels = index.assign(content_matrix)
+        return index.with_labels(labels, content_matrix, labels, level_codes)
+    
+    def embed(self, matrix):
+        """稀疏 TF-IDF 行 → L2 归一化的稠密向量"""
+        return _normalize_rows(np.asarray(matrix @ self.components.T, dtype=np.float32))
+    
+    def assign(self, matrix, chunk_size=65536):
+        """每行最近的聚类（分块计算，避免一次生成 n × 维数 的稠密矩阵）"""
+        labels = np.empty(matrix.shape[0], dtype=np.int32)
+        for start in range(0, matrix.shape[0], chunk_size):
+            embedded = self.embed(matrix[start:start + chunk_size])
+            labels[start:start + chunk_size] = np.argmax(embedded @ self.centroids.T, axis=1)
+        return labels
+    
+    def with_labels(self, labels, added_matrix=None, added_labels=None, added_levels=None):
+        """
+        同一组 SVD / 聚类中心、新的行 → 聚类分配（增量修改后使用）
+        
+        新增的行把各自聚类的上界抬高；删除的行不降低上界（上界仍然成立，只是偏松），
+        下次 fit() 重建时收紧
+        """
+        cluster_max = self.cluster_max
+        cluster_levels = self.cluster_levels
+        if added_matrix is not None and added_matrix.shape[0]:
+            cluster_max = cluster_max.copy()
+            cluster_levels = cluster_levels.copy()
+            added = added_matrix.tocoo()
+            np.maximum.at(cluster_max, (added_labels[added.row], added.col), added.data.astype(np.float32))
+            cluster_levels[added_labels, added_levels] = True
+        return AnnIndex(
+            self.components, self.centroids, labels.astype(np.int32),
+            cluster_max, cluster_levels, self.n_probes
+        )
+    
+    def search(self, query_vector, user_level_num):
+        """候选行号（升序）；查询向量为零时返回 None（交给精确打分）"""
+        if not query_vector.nnz:
+            return None
+        
+        # 聚类得分上界：每个查询词取聚类内最大权重，Level 加分取聚类内最好的 Level
+        level_bonus = LEVEL_BONUS[np.abs(np.arange(len(LEVEL_BONUS)) - user_level_num)]
+        bounds = self.cluster_max[:, query_vector.indices] @ query_vector.data * SIMILARITY_WEIGHT
+        bounds += np.where(self.cluster_levels, level_bonus, 0).max(axis=1) * LEVEL_WEIGHT
+        
+        n_probes = min(self.n_probes, len(bounds))
+        probes = np.argpartition(-bounds, n_probes - 1)[:n_probes]
+        rows = np.concatenate([self._order[self._offsets[c]:self._offsets[c + 1]] for c in probes])
+        rows.sort()
+        return rows
+    
+    def info(self):
+        return {
+            'clusters': len(self.centroids),
+            'dimensions': self.components.shape[0],
+            'n_probes': self.n_probes,
+        }
+
+
+def _facet_value(value):
+    """过滤取值规范化：大小写和空白不影响"""
+    return ' '.join(str(value).lower().split())
+
+
+def filters_from_request(payload):
+    """
+    API 请求里的 filters 对象（camelCase）→ recommend(filters=...)；格式不对时抛 ValueError
+    
+    {"type": "video", "category": ["grammar"], "levelMin": "A2", "levelMax": "B1",
+     "includeIds": [...], "excludeIds": [...]}
+    """
+    if not payload:
+        return None
+    if not isinstance(payload, dict):
+        raise ValueError('filters must be an object')
+    
+    names = {
+        'type': 'type', 'category': 'category', 'levelMin': 'level_min', 'levelMax': 'level_max',
+        'includeIds': 'include_ids', 'excludeIds': 'exclude_ids',
+    }
+    unknown = set(payload) - set(names)
+    if unknown:
+        raise ValueError(f"Unknown filters: {sorted(unknown)}")
+    
+    # 类型不对的取值在这里拒绝，否则后面会抛 TypeError（API 返回 500）
+    def is_strings(value):
+        return isinstance(value, list) and all(isinstance(item, str) for item in value)
+    
+    for name in ('type', 'category'):
+        value = payload.get(name)
+        if value is not None and not isinstance(value, str) and not is_strings(value):
+            raise ValueError(f'{name} must be a string or a list of strings')
+    for name in ('levelMin', 'levelMax'):
+        if payload.get(name) is not None and not isinstance(payload[name], str):
+            raise ValueError(f'{name} must be a level string, e.g. "A2"')
+    for name in ('includeIds', 'excludeIds'):
+        if payload.get(name) is not None and not is_strings(payload[name]):
+            raise ValueError(f'{name} must be a list of ids')
+    
+    filters = {names[name]: value for name, value in payload.items() if value not in (None, '', [])}
+    if 'includeIds' in payload and payload['includeIds'] == []:
+        filters['include_ids'] = []
+    ContentBasedRecommender._filter_key(filters)   # 校验取值
+    return filters or None
+
+
+def drop_duplicate_ids(content_df):
+    """检测 lessonContent 和 videos 之间重复的 id，保留第一条"""
+    duplicated = content_df['id'].duplicated()
+    if duplicated.any():
+        ids = sorted(set(content_df.loc[duplicated, 'id']))
+        logger.warning("⚠️  Duplicate content ids (keeping the first record): %s", ', '.join(ids))
+        content_df = content_df[~duplicated].reset_index(drop=True)
+    return content_df
+
+
+def get_user_documents(db, user_id):
+    """一次批量读取 users/{id}、userProgress/{id} 和 recommendations/{id}（一次往返）；不存在的文档可能为 None"""
+    refs = [
+        db.collection('users').document(user_id),
+        db.collection('userProgress').document(user_id),
+        db.collection('recommendations').document(user_id),
+    ]
+    
+    docs = {doc.reference.path: doc for doc in db.get_all(refs)}
+    return tuple(docs.get(ref.path) for ref in refs)
+
+
+def profile_fingerprint(user_level, learning_goals, completed_lessons, model_version, filters=None, n=10,
+                        cooccurrence=None):
+    """
+    推荐输入的指纹：quizLevel、learningGoals（排序）、completedLessons（集合）、模型版本、过滤条件、n
+    和共现数据的版本号（ItemCooccurrence.generation，没有协同阶段时为 None）
+    指纹没变 → 推荐结果不变，API 可以跳过打分和写入
+    """
+    def as_set(values):
+        return sorted({str(value) for value in values or []})
+    
+    payload = {
+        'level': user_level,
+        'goals': sorted(str(goal) for goal in learning_goals or []),
+        'completed': as_set(completed_lessons),
+        'model': model_version,
+        'filters': {
+            key: as_set(value) if isinstance(value, (list, tuple, set)) else value
+            for key, value in (filters or {}).items()
+        },
+        'n': n,
+        'cooccurrence': cooccurrence,
+    }
+    return hashlib.sha1(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def _normalize_rows(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return matrix / norms
+
 
 class ContentBasedRecommender:
     """纯内容推荐系统"""
     
-    def __init__(self):
-        self.vectorizer = TfidfVectorizer(
-            max_features=1000,
-            stop_words='english',
-            ngram_range=(1, 2)
-        )
+    def __init__(self, cache_size=256, cache_depth=200, cooccurrence=None,
+                 collaborative_weight=COLLABORATIVE_WEIGHT, ann_min_items=None, ann_probes=ANN_PROBES,
+                 compact=None):
+        if compact not in COMPACT_MODES:
+            raise ValueError(f"compact must be one of {COMPACT_MODES}, got {compact!r}")
+        
+        self.vectorizer = self._new_vectorizer()
         self.content_matrix = None
+        self._row_scales = None   # uint8 模式：每行的缩放系数
         self.content_df = None
+        self._level_codes = None
+        self._id_to_row = None
+        self._record_columns = RESULT_COLUMNS
+        self._query_components = {}
+        
+        # 上次 fit() 之后增量修改的条数（词表和 IDF 冻结期间的漂移）
+        self.drift = 0
+        
+        # 排名缓存：每个画像只缓存前 cache_depth 名
+        self.cache_depth = cache_depth
+        self.ranking_cache = RankingCache(cache_size)
+        
+        # 协同阶段（可选）：得分依赖用户的完成列表，不进排名缓存，在缓存结果上叠加
+        self.cooccurrence = cooccurrence
+        self.collaborative_weight = collaborative_weight
+        
+        # ANN 模式：内容数 ≥ ann_min_items 时在 fit() 里建索引（None 表示关闭）
+        self.ann_min_items = ann_min_items
+        self.ann_probes = ann_probes
+        self.ann_index = None
+        
+        # 紧凑模式：矩阵降精度，训练文本 fit 后丢弃
+        self.compact = compact
         
     def fit(self, content_df):
         """训练模型"""
-        print("🔧 Training Content-Based Model...")
+        logger.info("🔧 Training Content-Based Model...")
         
-        self.content_df = content_df.copy()
+        duplicated = content_df['id'][content_df['id'].duplicated()]
+        if not duplicated.empty:
+            raise ValueError(f"Duplicate content ids: {sorted(set(duplicated))}")
+        
+        self.content_df = content_df.copy().reset_index(drop=True)
+        self._record_columns = [c for c in RECORD_COLUMNS if c in self.content_df.columns]
         
         # 组合特征
-        self.content_df['features'] = (
-            self.content_df['title'] + ' ' +
-            self.content_df['title'] + ' ' +  # 标题重复（加权）
-            self.content_df['category'] + ' ' +
-            self.content_df['level'] + ' ' +
-            self.content_df.get('description', '').fillna('')
-        )
+        self.content_df['features'] = self._features(self.content_df)
         
         # TF-IDF 向量化
         self.content_matrix = self.vectorizer.fit_transform(
             self.content_df['features']
         )
         
-        print(f"✅ Trained with {len(content_df)} items")
-        print(f"📊 Features: {self.content_matrix.shape[1]}")
+        # 预计算：等级编码 + id → 行号索引
+        self._build_indexes()
+        
+        # 预计算查询分量：每个 CEFR level、每个已知 goal / category
+        self._prepare_query_components()
+        
+        # 大内容库：建 ANN 索引，查询只对候选精确打分
+        self.ann_index = None
+        if self.ann_min_items is not None and len(self.content_df) >= self.ann_min_items:
+            self.ann_index = AnnIndex.build(self.content_matrix, self._level_codes, n_probes=self.ann_probes)
+        
+        # 紧凑模式：降精度，丢掉训练文本和 sklearn 记录的被截掉的词（只用于调试）
+        self.content_matrix, self._row_scales = self._compact_matrix(self.content_matrix)
+        if self.compact is not None:
+            self.content_df = self.content_df.drop(columns='features')
+            if hasattr(self.vectorizer, 'stop_words_'):
+                del self.vectorizer.stop_words_
+        
+        # 模型已变化，旧排名全部失效
+        self.ranking_cache.clear()
+        self.drift = 0
+        
+        logger.info("✅ Trained with %d items, %d features", len(content_df), self.content_matrix.shape[1])
+        
+    def save(self, path, **metadata):
+        """
+        保存模型快照：词表、IDF、content_matrix 的 CSR 数组、等级编码和按列存储的内容表
+        
+        先写到临时目录再整体替换，其他进程正在 mmap 的旧文件不受影响。
+        metadata 原样写入 meta.json（例如模型版本号）
+        """
+        tmp_path = f"{path}.tmp-{os.getpid()}"
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+        
+        matrix = self.content_matrix
+        np.save(os.path.join(tmp_path, 'matrix_data.npy'), matrix.data)
+        np.save(os.path.join(tmp_path, 'matrix_indices.npy'), matrix.indices)
+        np.save(os.path.join(tmp_path, 'matrix_indptr.npy'), matrix.indptr)
+        np.save(os.path.join(tmp_path, 'idf.npy'), self._idf)
+        np.save(os.path.join(tmp_path, 'level_codes.npy'), self._level_codes)
+        if self._row_scales is not None:
+            np.save(os.path.join(tmp_path, 'row_scales.npy'), self._row_scales)
+        if self.ann_index is not None:
+            np.save(os.path.join(tmp_path, 'ann_components.npy'), self.ann_index.components)
+            np.save(os.path.join(tmp_path, 'ann_centroids.npy'), self.ann_index.centroids)
+            np.save(os.path.join(tmp_path, 'ann_labels.npy'), self.ann_index.labels)
+            np.save(os.path.join(tmp_path, 'ann_cluster_max.npy'), self.ann_index.cluster_max)
+            np.save(os.path.join(tmp_path, 'ann_cluster_levels.npy'), self.ann_index.cluster_levels)
+        
+        with open(os.path.join(tmp_path, 'vocabulary.json'), 'w', encoding='utf-8') as f:
+            json.dump({term: int(index) for term, index in self._vocabulary.items()}, f)
+        
+        # 训练文本 features 只在 fit 时需要，不保存
+        catalog = self.content_df.drop(columns='features', errors='ignore')
+        with open(os.path.join(tmp_path, 'catalog.json'), 'w', encoding='utf-8') as f:
+            json.dump({column: catalog[column].tolist() for column in catalog.columns}, f)
+        
+        with open(os.path.join(tmp_path, 'meta.json'), 'w', encoding='utf-8') as f:
+            json.dump({
+                **metadata,
+                'format': SNAPSHOT_FORMAT,
+                'created_at': time.time(),
+                'shape': list(matrix.shape),
+                'drift': self.drift,
+                'compact': self.compact,
+            }, f)
+        
+        old_path = f"{path}.old-{os.getpid()}"
+        if os.path.exists(path):
+            os.rename(path, old_path)
+        os.rename(tmp_path, path)
+        shutil.rmtree(old_path, ignore_errors=True)
+    
+    @staticmethod
+    def snapshot_info(path):
+        """读取快照的 meta.json，不存在或格式不符返回 None"""
+        try:
+            with open(os.path.join(path, 'meta.json'), encoding='utf-8') as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return meta if meta.get('format') == SNAPSHOT_FORMAT else None
+    
+    @classmethod
+    def load(cls, path, mmap=True, **kwargs):
+        """
+        从快照加载模型（不重新 fit）
+        
+        mmap=True 时矩阵和 IDF 以只读内存映射方式打开，
+        多个 worker 进程共享同一份物理内存
+        """
+        meta = cls.snapshot_info(path)
+        if meta is None:
+            raise ValueError(f"No model snapshot at {path}")
+        
+        mmap_mode = 'r' if mmap else None
+        
+        def array(name):
+            return np.load(os.path.join(path, name), mmap_mode=mmap_mode)
+        
+        # 快照里矩阵的精度以保存时为准
+        recommender = cls(**{**kwargs, 'compact': meta.get('compact')})
+        
+        with open(os.path.join(path, 'vocabulary.json'), encoding='utf-8') as f:
+            recommender.vectorizer.vocabulary_ = json.load(f)
+        recommender.vectorizer.idf_ = array('idf.npy')
+        
+        recommender.content_matrix = sparse.csr_matrix(
+            (array('matrix_data.npy'), array('matrix_indices.npy'), array('matrix_indptr.npy')),
+            shape=tuple(meta['shape']),
+            copy=False
+        )
+        
+        with open(os.path.join(path, 'catalog.json'), encoding='utf-8') as f:
+            recommender.content_df = pd.DataFrame(json.load(f))
+        recommender._record_columns = [
+            c for c in RECORD_COLUMNS if c in recommender.content_df.columns
+        ]
+        
+        recommender._level_codes = array('level_codes.npy')
+        if os.path.exists(os.path.join(path, 'row_scales.npy')):
+            recommender._row_scales = array('row_scales.npy')
+        if os.path.exists(os.path.join(path, 'ann_labels.npy')):
+            recommender.ann_index = AnnIndex(
+                array('ann_components.npy'), array('ann_centroids.npy'), array('ann_labels.npy'),
+                array('ann_cluster_max.npy'), array('ann_cluster_levels.npy'), recommender.ann_probes
+            )
+        recommender._id_to_row = {
+            item_id: row for row, item_id in enumerate(recommender.content_df['id'])
+        }
+        recommender._build_facets()
+        recommender._prepare_query_components()
+        recommender.drift = meta.get('drift', 0)
+        
+        return recommender
+    
+    def upsert_items(self, items_df):
+        """
+        增量新增 / 替换内容（不重新 fit）
+        
+        词表和 IDF 保持冻结，新行直接用现有 vectorizer 转换；
+        已存在的 id 原位替换，新 id 追加到末尾
+        """
+        duplicated = items_df['id'][items_df['id'].duplicated()]
+        if not duplicated.empty:
+            raise ValueError(f"Duplicate content ids: {sorted(set(duplicated))}")
+        
+        items_df = items_df.reset_index(drop=True)
+        items_df['features'] = self._features(items_df)
+        item_matrix = self.vectorizer.transform(items_df['features'])
+        
+        # 行号映射：被替换的行指向新数据，新 id 追加
+        size = len(self.content_df)
+        take = np.arange(size)
+        appended = []
+        for position, item_id in enumerate(items_df['id']):
+            row = self._id_to_row.get(item_id)
+            if row is None:
+                appended.append(size + position)
+            else:
+                take[row] = size + position
+        take = np.concatenate([take, np.array(appended, dtype=take.dtype)])
+        
+        # ANN：新行分配到最近的已有聚类，并抬高这些聚类的得分上界
+        ann_index = None
+        if self.ann_index is not None:
+            item_labels = self.ann_index.assign(item_matrix)
+            item_levels = np.array([LEVEL_MAP.get(level, 0) for level in items_df['level']], dtype=np.int8)
+            ann_index = self.ann_index.with_labels(
+                np.concatenate([self.ann_index.labels, item_labels])[take],
+                item_matrix, item_labels, item_levels
+            )
+        
+        item_matrix, item_scales = self._compact_matrix(item_matrix)
+        if self.compact is not None:
+            items_df = items_df.drop(columns='features')
+        
+        combined_df = pd.concat([self.content_df, items_df], ignore_index=True)
+        self._replace_catalog(
+            combined_df.iloc[take].reset_index(drop=True),
+            sparse.vstack([self.content_matrix, item_matrix], format='csr')[take],
+            ann_index,
+            np.concatenate([self._row_scales, item_scales])[take] if item_scales is not None else None
+        )
+        self.drift += len(items_df)
+        return len(items_df)
+    
+    def remove_items(self, item_ids):
+        """增量删除内容，返回实际删除的条数"""
+        rows = [self._id_to_row[i] for i in set(item_ids) if i in self._id_to_row]
+        if not rows:
+            return 0
+        
+        keep = np.ones(len(self.content_df), dtype=bool)
+        keep[rows] = False
+        self._replace_catalog(
+            self.content_df[keep].reset_index(drop=True),
+            self.content_matrix[keep],
+            self.ann_index.with_labels(self.ann_index.labels[keep]) if self.ann_index is not None else None,
+            self._row_scales[keep] if self._row_scales is not None else None
+        )
+        self.drift += len(rows)
+        return len(rows)
+    
+    def clone(self):
+        """
+        浅拷贝模型（共享 vectorizer 和矩阵），用于在副本上做增量修改后整体替换。
+        增量修改总是重新赋值属性而不是原地改数组，所以共享是安全的
+        """
+        other = copy.copy(self)
+        other.ranking_cache = RankingCache(self.ranking_cache.maxsize)
+        other._query_components = dict(self._query_components)
+        return other
+    
+    def recommend(self, user_level, learning_goals, completed_lessons=None, n=10, filters=None):
+        """
+        生成推荐（先查排名缓存，已完成课程在缓存之后过滤）
         
-    def recommend(self, user_level, learning_goals, completed_lessons=None, n=10):
-        """生成推荐"""
+        filters（可选）：{'type': 'video', 'category': ['Grammar'], 'level_min': 'A2', 'level_max': 'B1',
+        'include_ids': [...], 'exclude_ids': [...]}；多个取值之间是“或”，不同条件之间是“且”。
+        过滤在取 Top-N 之前用预计算的布尔索引完成，每种过滤条件各自缓存排名
+        """
         if completed_lessons is None:
             completed_lessons = []
         
-        # 构建用户查询
-        query = ' '.join([
-            user_level, user_level, user_level,  # Level 重复3次
-            *[goal for goal in learning_goals for _ in range(2)]  # Goals 重复2次
-        ])
+        filter_key = self._filter_key(filters)
+        if filters and filters.get('exclude_ids'):
+            completed_lessons = list(completed_lessons) + list(filters['exclude_ids'])
+        
+        key = self._profile_key(user_level, learning_goals)
+        if filter_key is not None:
+            key += (filter_key,)
+        ranking = self.ranking_cache.get(key)
+        if ranking is None:
+            mask = self._filter_mask(filter_key) if filter_key is not None else None
+            ranking = self._ann_ranking(user_level, learning_goals, max(n, self.cache_depth), filter_key)
+            if ranking is None:
+                similarities = self._similarities(user_level, learning_goals)
+                ranking = self._ranking(similarities, user_level, max(n, self.cache_depth), mask)
+            self.ranking_cache.put(key, ranking)
+        
+        rows, scores = ranking
+        completed_rows = [self._id_to_row[i] for i in completed_lessons if i in self._id_to_row]
+        keep = ~np.isin(rows, completed_rows)
+        
+        # 缓存的候选不够（被截断且大部分已完成）→ 完整重新打分
+        if keep.sum() < n:
+            mask = self._filter_mask(filter_key) if filter_key is not None else None
+            if len(rows) < (len(self._level_codes) if mask is None else int(mask.sum())):
+                similarities = self._similarities(user_level, learning_goals)
+                return self._rank(similarities, user_level, completed_lessons, n, mask)
+        
+        # 协同加分依赖完成列表，叠加在缓存的内容排名之上
+        boost_rows, boosts = self._collaborative(completed_lessons)
+        if filter_key is not None and len(boost_rows):
+            passes = self._filter_mask(filter_key, boost_rows)
+            boost_rows, boosts = boost_rows[passes], boosts[passes]
+        if len(boost_rows):
+            return self._blend(rows[keep], scores[keep], boost_rows, boosts, user_level, learning_goals, n)
+        
+        return self._rows_to_frame(rows[keep][:n], scores[keep][:n])
+    
+    def get_item(self, item_id):
+        """按 id 直接取完整记录（O(1)），不存在返回 None"""
+        row = self._id_to_row.get(item_id)
+        if row is None:
+            return None
+        return self.content_df.iloc[row][self._record_columns].to_dict()
+    
+    def cache_info(self):
+        """排名缓存命中统计"""
+        return self.ranking_cache.info()
+    
+    @property
+    def item_count(self):
+        return len(self.content_df)
+    
+    def recommend_many(self, profiles, n=10, batch_size=256):
+        """
+        批量生成推荐：所有用户查询拼成一个稀疏矩阵，一次稀疏矩阵乘法打分
+        
+        profiles: [{'user_level': 'A1', 'learning_goals': [...], 'completed_lessons': [...]}, ...]
+        返回与 profiles 顺序一致的推荐列表
+        """
+        results = []
+        
+        # 分批计算，避免 (用户数 × 内容数) 的稠密矩阵过大
+        for start in range(0, len(profiles), batch_size):
+            batch = profiles[start:start + batch_size]
+            
+            # 批量重算，不经过排名缓存
+            user_matrix = sparse.vstack([
+                self._query_vector(p['user_level'], p.get('learning_goals', []))
+                for p in batch
+            ], format='csr')
+            similarities = self._dot(user_matrix).T
+            
+            for profile, row in zip(batch, similarities):
+                filters = profile.get('filters')
+                filter_key = self._filter_key(filters)
+                completed_lessons = list(profile.get('completed_lessons') or [])
+                if filters and filters.get('exclude_ids'):
+                    completed_lessons += list(filters['exclude_ids'])
+                results.append(self._rank(
+                    row, profile['user_level'], completed_lessons, n,
+                    self._filter_mask(filter_key) if filter_key is not None else None
+                ))
+        
+        return results
+    
+    @staticmethod
+    def _new_vectorizer():
+        return TfidfVectorizer(
+            max_features=1000,
+            stop_words='english',
+            ngram_range=(1, 2)
+        )
+    
+    def _compact_matrix(self, matrix):
+        """
+        按紧凑模式转换 TF-IDF 矩阵 → (矩阵, 每行缩放系数或 None)
+        
+        float32：数据降为单精度；uint8：每行除以 (行最大值 / 255) 后取整，
+        点积结果再乘回缩放系数。行号 / 列号统一为 int32
+        """
+        if self.compact is None:
+            return matrix, None
+        
+        matrix = sparse.csr_matrix(matrix)
+        indices = matrix.indices.astype(np.int32, copy=False)
+        indptr = matrix.indptr.astype(np.int32, copy=False)
+        
+        if self.compact == 'float32':
+            data = matrix.data.astype(np.float32)
+            scales = None
+        else:
+            scales = (matrix.max(axis=1).toarray().ravel() / 255).astype(np.float32)
+            scales[scales == 0] = 1
+            data = np.rint(matrix.data / np.repeat(scales, np.diff(indptr))).astype(np.uint8)
+        
+        return sparse.csr_matrix((data, indices, indptr), shape=matrix.shape), scales
+    
+    def _dot(self, user_matrix, rows=None):
+        """
+        内容行 · 查询向量 → (行数 × 查询数) 的稠密数组；rows=None 表示全部内容
+        
+        查询先转成稠密向量：稀疏 × 稀疏乘法会把 float32 / uint8 矩阵整个升成 float64，
+        稀疏 × 稠密只需扫描一遍非零元素
+        """
+        matrix = self.content_matrix if rows is None else self.content_matrix[rows]
+        dtype = np.float64 if matrix.dtype == np.float64 else np.float32
+        similarities = matrix @ user_matrix.T.toarray().astype(dtype, copy=False)
+        if self._row_scales is not None:
+            similarities *= (self._row_scales if rows is None else self._row_scales[rows])[:, None]
+        return similarities
+    
+    @staticmethod
+    def _features(content_df):
+        """组合特征文本"""
+        return (
+            content_df['title'] + ' ' +
+            content_df['title'] + ' ' +  # 标题重复（加权）
+            content_df['category'] + ' ' +
+            content_df['level'] + ' ' +
+            content_df.get('description', '').fillna('')
+        )
+    
+    def _build_indexes(self):
+        """等级编码 + id → 行号索引 + 过滤用的布尔索引"""
+        self._level_codes = np.array(
+            [LEVEL_MAP.get(level, 0) for level in self.content_df['level']],
+            dtype=np.int8
+        )
+        self._id_to_row = {
+            item_id: row for row, item_id in enumerate(self.content_df['id'])
+        }
+        self._build_facets()
+    
+    def _build_facets(self):
+        """
+        每个 type / category 取值一个布尔数组（该行是否取这个值），过滤时按位组合；
+        等级范围用每个等级的“不低于 / 不高于”两组布尔数组，一次按位与得到
+        """
+        self._facets = {}
+        for column in FACET_COLUMNS:
+            if column not in self.content_df.columns:
+                continue
+            codes, values = pd.factorize(self.content_df[column].map(_facet_value))
+            self._facets[column] = {value: codes == code for code, value in enumerate(values)}
+        
+        levels = range(len(LEVEL_MAP))
+        self._level_at_least = [self._level_codes >= level for level in levels]
+        self._level_at_most = [self._level_codes <= level for level in levels]
+    
+    @staticmethod
+    def _filter_key(filters):
+        """
+        规范化过滤条件 → 可哈希的 key（无过滤时为 None），同时校验取值
+        
+        exclude_ids 不在 key 里：它和已完成课程一样在缓存的排名之后排除
+        """
+        if not filters:
+            return None
+        unknown = set(filters) - set(FILTER_KEYS)
+        if unknown:
+            raise ValueError(f"Unknown filters: {sorted(unknown)}")
+        
+        key = []
+        for column in FACET_COLUMNS:
+            values = filters.get(column)
+            if values:
+                values = [values] if isinstance(values, str) else values
+                key.append((column, tuple(sorted({_facet_value(value) for value in values}))))
+        
+        level_min, level_max = filters.get('level_min'), filters.get('level_max')
+        if level_min or level_max:
+            for level in (level_min, level_max):
+                if level and level not in LEVEL_MAP:
+                    raise ValueError(f"Unknown level: {level}")
+            key.append(('level', (
+                LEVEL_MAP[level_min] if level_min else 0,
+                LEVEL_MAP[level_max] if level_max else max(LEVEL_MAP.values()),
+            )))
+        
+        if filters.get('include_ids') is not None:
+            key.append(('include_ids', tuple(sorted(set(filters['include_ids'])))))
         
+        return tuple(key) or None
+    
+    def _filter_mask(self, filter_key, rows=None):
+        """满足过滤条件的行（布尔数组）；rows 给定时只计算这些行"""
+        size = len(self._level_codes) if rows is None else len(rows)
+        mask = np.ones(size, dtype=bool)
+        for name, value in filter_key or ():
+            if name in FACET_COLUMNS:
+                facet = self._facets.get(name, {})
+                matches = np.zeros(size, dtype=bool)
+                for facet_value in value:
+                    index = facet.get(facet_value)
+                    if index is not None:
+                        matches |= index if rows is None else index[rows]
+                mask &= matches
+            elif name == 'level':
+                at_least, at_most = self._level_at_least[value[0]], self._level_at_most[value[1]]
+                mask &= (at_least & at_most) if rows is None else (at_least[rows] & at_most[rows])
+            else:
+                # 只按 include_ids 自己的行号计算，不扫描整个目录
+                included = np.fromiter(
+                    (row for row in map(self._id_to_row.get, value) if row is not None), dtype=np.intp
+                )
+                if rows is None:
+                    kept = np.zeros(size, dtype=bool)
+                    kept[included] = mask[included]
+                    mask = kept
+                else:
+                    mask &= np.isin(rows, included)
+        return mask
+    
+    def _replace_catalog(self, content_df, content_matrix, ann_index=None, row_scales=None):
+        """增量修改后替换内容表、矩阵、行缩放系数和 ANN 索引，重建索引并清空排名缓存"""
+        self.content_df = content_df
+        self.content_matrix = content_matrix
+        self._row_scales = row_scales
+        self.ann_index = ann_index
+        self._build_indexes()
+        self.ranking_cache.clear()
+    
+    @staticmethod
+    def _profile_key(user_level, learning_goals):
+        """
+        规范化画像 key：goal 大小写和空白不影响 TF-IDF 结果，统一处理；
+        goal 的顺序和重复会影响 bigram 和词频，因此保留
+        """
+        return (user_level, tuple(' '.join(str(goal).lower().split()) for goal in learning_goals))
+    
+    def _similarities(self, user_level, learning_goals):
+        """用户查询与所有内容的余弦相似度"""
         # 向量化
-        user_vector = self.vectorizer.transform([query])
+        user_vector = self._query_vector(user_level, learning_goals)
         
-        # 计算相似度
-        similarities = cosine_similarity(user_vector, self.content_matrix)[0]
+        # TF-IDF 行向量已做 L2 归一化，点积即余弦相似度
+        return self._dot(user_vector).ravel()
+    
+    def _prepare_query_components(self):
+        """
+        fit() 时预计算查询分量，请求路径不再走 sklearn 文本处理
+        （分词、停用词过滤、bigram 生成）
+        """
+        self._preprocess = self.vectorizer.build_preprocessor()
+        self._tokenize = self.vectorizer.build_tokenizer()
+        self._stop_words = self.vectorizer.get_stop_words() or frozenset()
+        self._vocabulary = self.vectorizer.vocabulary_
+        self._idf = self.vectorizer.idf_
         
-        # 创建结果
-        results = self.content_df.copy()
-        results['similarity'] = similarities
+        self._query_components = {}
+        for text in [*LEVEL_MAP, *KNOWN_GOALS, *self.content_df['category'].unique()]:
+            self._query_components[text] = self._build_component(text)
+    
+    def _build_component(self, text):
+        """
+        单个 level / goal 的分量：(首 token, 末 token, {词表下标: 词频})
+        词频包含 unigram 和该片段内部的 bigram
+        """
+        tokens = [
+            token for token in self._tokenize(self._preprocess(str(text)))
+            if token not in self._stop_words
+        ]
+        if not tokens:
+            return None, None, {}
         
-        # Level 匹配加分
-        level_map = {'A1': 0, 'A2': 1, 'B1': 2, 'B2': 3, 'C1': 4, 'C2': 5}
-        user_level_num = level_map.get(user_level, 0)
+        terms = tokens + [' '.join(pair) for pair in zip(tokens, tokens[1:])]
+        counts = {}
+        for term in terms:
+            index = self._vocabulary.get(term)
+            if index is not None:
+                counts[index] = counts.get(index, 0) + 1
         
-        def level_bonus(content_level):
-            content_num = level_map.get(content_level, 0)
-            diff = abs(user_level_num - content_num)
-            if diff == 0: return 0.3
-            if diff == 1: return 0.15
-            return 0
+        return tokens[0], tokens[-1], counts
+    
+    def _component(self, text):
+        component = self._query_components.get(text)
+        if component is None:
+            component = self._build_component(text)
+            if len(self._query_components) < MAX_QUERY_COMPONENTS:
+                self._query_components[text] = component
+        return component
+    
+    def _query_vector(self, user_level, learning_goals):
+        """
+        用预计算分量拼出用户查询的 TF-IDF 向量（1 × 词表）
+        
+        等价于对 "level×3 + 每个 goal×2" 拼成的字符串做 vectorizer.transform：
+        各片段词频加权求和，再补上相邻片段交界处的 bigram，乘 IDF 后 L2 归一化
+        """
+        pieces = [user_level] * 3 + [goal for goal in learning_goals for _ in range(2)]
+        
+        counts = {}
+        previous_last = None
+        for text in pieces:
+            first, last, component_counts = self._component(text)
+            if first is None:
+                continue
+            
+            for index, count in component_counts.items():
+                counts[index] = counts.get(index, 0) + count
+            
+            # 交界处 bigram（停用词已过滤，与 sklearn 一致）
+            if previous_last is not None:
+                index = self._vocabulary.get(previous_last + ' ' + first)
+                if index is not None:
+                    counts[index] = counts.get(index, 0) + 1
+            previous_last = last
+        
+        vocabulary_size = len(self._idf)
+        if not counts:
+            return sparse.csr_matrix((1, vocabulary_size))
+        
+        indices = np.fromiter(counts.keys(), dtype=np.int32, count=len(counts))
+        order = np.argsort(indices)
+        indices = indices[order]
+        data = np.fromiter(counts.values(), dtype=np.float64, count=len(counts))[order]
+        data *= self._idf[indices]
+        data /= np.sqrt(np.dot(data, data))
+        
+        return sparse.csr_matrix(
+            (data, indices, np.array([0, len(indices)], dtype=np.int32)),
+            shape=(1, vocabulary_size)
+        )
+    
+    def _scores(self, similarities, user_level):
+        """相似度 70% + Level 加分 30%"""
+        # Level 匹配加分（查表）
+        user_level_num = LEVEL_MAP.get(user_level, 0)
+        level_bonus = LEVEL_BONUS[np.abs(self._level_codes - user_level_num)]
+        
+        return similarities * SIMILARITY_WEIGHT + level_bonus * LEVEL_WEIGHT
+    
+    def _ranking(self, similarities, user_level, depth, mask=None):
+        """不排除已完成的前 depth 名 (行号, 得分)，用于缓存；mask 之外的行不参与排名"""
+        scores = self._scores(similarities, user_level)
+        if mask is not None:
+            scores[~mask] = -np.inf
+            depth = min(depth, int(mask.sum()))
+        top = self._top_k(scores, depth)
+        return top, scores[top]
+    
+    def _ann_ranking(self, user_level, learning_goals, depth, filter_key=None):
+        """ANN 模式：只对索引召回的候选精确打分；未启用或查询为空时返回 None"""
+        if self.ann_index is None:
+            return None
+        
+        user_vector = self._query_vector(user_level, learning_goals)
+        user_level_num = LEVEL_MAP.get(user_level, 0)
+        candidates = self.ann_index.search(user_vector, user_level_num)
+        if candidates is None:
+            return None
+        if filter_key is not None:
+            candidates = candidates[self._filter_mask(filter_key, candidates)]
+        
+        similarities = self._dot(user_vector, candidates).ravel()
+        level_bonus = LEVEL_BONUS[np.abs(self._level_codes[candidates] - user_level_num)]
+        scores = similarities * SIMILARITY_WEIGHT + level_bonus * LEVEL_WEIGHT
         
-        results['level_bonus'] = results['level'].apply(level_bonus)
+        top = self._top_k(scores, depth)
+        return candidates[top], scores[top]
+    
+    def _rows_to_frame(self, rows, scores):
+        """只把选中的行转成 DataFrame（含 description / type / route 等完整记录）"""
+        results = self.content_df.iloc[rows][self._record_columns].copy()
+        results['score'] = scores
+        return results
+    
+    def _rank(self, similarities, user_level, completed_lessons, n, mask=None):
+        """相似度 + Level 加分 → 排除已完成和不满足过滤条件的行 → Top-N"""
+        if completed_lessons is None:
+            completed_lessons = []
         
         # 最终得分
-        results['score'] = results['similarity'] * 0.7 + results['level_bonus'] * 0.3
+        scores = self._scores(similarities, user_level)
         
-        # 排除已完成
-        results = results[~results['id'].isin(completed_lessons)]
+        # 排除已完成（id → 行号索引构建布尔掩码）
+        completed = np.zeros(len(scores), dtype=bool)
+        completed[[self._id_to_row[i] for i in completed_lessons if i in self._id_to_row]] = True
+        
+        # 协同加分（已完成课程的共现邻居）
+        boost_rows, boosts = self._collaborative(completed_lessons)
+        scores[boost_rows] += boosts * self.collaborative_weight
+        
+        if mask is not None:
+            completed |= ~mask
+        scores[completed] = -np.inf
         
         # 排序返回
-        return results.nlargest(n, 'score')[['id', 'title', 'category', 'level', 'score']]
+        top = self._top_k(scores, min(n, len(scores) - int(completed.sum())))
+        return self._rows_to_frame(top, scores[top])
+    
+    def _collaborative(self, completed_lessons):
+        """协同得分 → (行号, 得分)，只含当前内容表里未完成的课程"""
+        if self.cooccurrence is None or not self.collaborative_weight or not completed_lessons:
+            return np.empty(0, dtype=np.intp), np.empty(0)
+        
+        boosts = self.cooccurrence.scores(completed_lessons)
+        rows = [(self._id_to_row[i], value) for i, value in boosts.items() if i in self._id_to_row]
+        if not rows:
+            return np.empty(0, dtype=np.intp), np.empty(0)
+        
+        rows.sort()
+        return (
+            np.fromiter((row for row, _ in rows), dtype=np.intp, count=len(rows)),
+            np.fromiter((value for _, value in rows), dtype=np.float64, count=len(rows)),
+        )
+    
+    def _blend(self, rows, scores, boost_rows, boosts, user_level, learning_goals, n):
+        """
+        在缓存的内容排名上叠加协同加分
+        
+        候选 = 缓存中未完成的行 ∪ 有协同得分的行。缓存外、没有协同得分的行，
+        得分不超过缓存里最后一名的内容得分，不可能挤进前 n，所以结果与完整打分一致
+        """
+        missing = boost_rows[~np.isin(boost_rows, rows)]
+        if len(missing):
+            # 缓存外的邻居：只对这几行算内容得分
+            user_vector = self._query_vector(user_level, learning_goals)
+            similarities = self._dot(user_vector, missing).ravel()
+            user_level_num = LEVEL_MAP.get(user_level, 0)
+            level_bonus = LEVEL_BONUS[np.abs(self._level_codes[missing] - user_level_num)]
+            rows = np.concatenate([rows, missing])
+            scores = np.concatenate([scores, similarities * SIMILARITY_WEIGHT + level_bonus * LEVEL_WEIGHT])
+        
+        order = np.argsort(rows, kind='stable')
+        rows, scores = rows[order], scores[order].copy()
+        scores[np.searchsorted(rows, boost_rows)] += boosts * self.collaborative_weight
+        
+        top = self._top_k(scores, n)
+        return self._rows_to_frame(rows[top], scores[top])
+    
+    @staticmethod
+    def _top_k(scores, n):
+        """取得分最高的 n 行（与 DataFrame.nlargest 的 keep='first' 一致）"""
+        n = min(n, len(scores))
+        if n <= 0:
+            return np.empty(0, dtype=np.intp)
+        
+        # argpartition 找到第 n 大的分数，再按行号补齐并列项
+        kth = scores[np.argpartition(-scores, n - 1)[n - 1]]
+        above = np.flatnonzero(scores > kth)
+        ties = np.flatnonzero(scores == kth)[:n - len(above)]
+        top = np.concatenate([above, ties])
+        
+        # 分数降序，并列时行号升序
+        return top[np.lexsort((top, -scores[top]))]
+
+
+def shard_key(value):
+    """分片 key：模块 / category 规范化（大小写、空白不影响）"""
+    return ' '.join(str(value).lower().split()) or 'other'
+
+
+def catalog_fingerprint(content_df, settings=''):
+    """内容表指纹（与行顺序无关），用来判断分片内容是否变化"""
+    catalog = content_df.drop(columns='features', errors='ignore')
+    catalog = catalog[sorted(catalog.columns)].sort_values('id').reset_index(drop=True)
+    digest = hashlib.sha1(f"{SNAPSHOT_FORMAT}|{settings}|{','.join(catalog.columns)}".encode())
+    digest.update(pd.util.hash_pandas_object(catalog.astype(str), index=False).values.tobytes())
+    return digest.hexdigest()
+
+
+def model_footprint(recommender):
+    """分片模型占用的内存估算（字节）：矩阵、缩放系数、ANN 索引和内容表"""
+    matrix = recommender.content_matrix
+    size = matrix.data.nbytes + matrix.indices.nbytes + matrix.indptr.nbytes
+    if recommender._row_scales is not None:
+        size += recommender._row_scales.nbytes
+    if recommender.ann_index is not None:
+        index = recommender.ann_index
+        size += index.components.nbytes + index.centroids.nbytes + index.cluster_max.nbytes + index.labels.nbytes
+    return size + int(recommender.content_df.memory_usage(deep=True).sum())
+
+
+# 分片元数据：保存目录名、内容指纹（增量修改后为 None）、内容 id、增量修改条数
+Shard = namedtuple('Shard', ['name', 'fingerprint', 'ids', 'drift'])
+
+
+class ShardStore:
+    """
+    已加载分片模型的 LRU 缓存，按内存预算淘汰
+    
+    分片模型按名字保存在 directory 下且不再修改，被淘汰后下次使用时 mmap 重新加载；
+    没有 directory 时分片只能留在内存里，不淘汰
+    """
+    
+    def __init__(self, directory=None, memory_budget_mb=None, **options):
+        self.directory = directory
+        self.memory_budget = memory_budget_mb * 2 ** 20 if memory_budget_mb else None
+        self.options = options            # 传给每个分片的 ContentBasedRecommender
+        self._models = OrderedDict()      # 名字 → (模型, 估算字节数)
+        self._lock = threading.Lock()
+        self.loads = 0
+        self.evictions = 0
+    
+    def put(self, name, model):
+        """登记新训练 / 修改的分片模型（有 directory 时先保存到磁盘）"""
+        if self.directory is not None:
+            path = os.path.join(self.directory, name)
+            if ContentBasedRecommender.snapshot_info(path) is None:
+                model.save(path)
+        self._remember(name, model)
+    
+    def get(self, name):
+        """分片模型；不在内存里时从磁盘加载（可能淘汰最久未用的分片）"""
+        with self._lock:
+            entry = self._models.get(name)
+            if entry is not None:
+                self._models.move_to_end(name)
+                return entry[0]
+        
+        if self.directory is None:
+            raise KeyError(f"Shard {name} is not loaded and there is no shard directory")
+        
+        model = ContentBasedRecommender.load(os.path.join(self.directory, name), mmap=True, **self.options)
+        with self._lock:
+            self.loads += 1
+        self._remember(name, model)
+        return model
+    
+    def _remember(self, name, model):
+        footprint = model_footprint(model)
+        with self._lock:
+            self._models[name] = (model, footprint)
+            self._models.move_to_end(name)
+            
+            # 只有能重新加载的分片才淘汰；刚用到的分片保留
+            if self.directory is None or self.memory_budget is None:
+                return
+            total = sum(size for _, size in self._models.values())
+            while total > self.memory_budget and len(self._models) > 1:
+                _, (_, size) = self._models.popitem(last=False)
+                total -= size
+                self.evictions += 1
+    
+    def loaded(self, name):
+        with self._lock:
+            entry = self._models.get(name)
+        return entry[0] if entry is not None else None
+    
+    def retain(self, names, min_age=3600):
+        """
+        只保留 names 里的分片：其余的从内存中释放，磁盘上超过 min_age 秒的目录删除
+        （旧版本模型上还没结束的请求需要时会重新加载，所以磁盘上留一段时间）
+        """
+        if self.directory is None:
+            return 0
+        names = set(names)
+        with self._lock:
+            for name in [name for name in self._models if name not in names]:
+                del self._models[name]
+        if not os.path.isdir(self.directory):
+            return 0
+        
+        removed = 0
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if name in names or time.time() - os.path.getmtime(path) < min_age:
+                continue
+            shutil.rmtree(path, ignore_errors=True)
+            removed += 1
+        return removed
+    
+    def info(self):
+        with self._lock:
+            return {
+                'loaded': len(self._models),
+                'loaded_mb': round(sum(size for _, size in self._models.values()) / 2 ** 20, 2),
+                'budget_mb': round(self.memory_budget / 2 ** 20, 2) if self.memory_budget else None,
+                'loads': self.loads,
+                'evictions': self.evictions,
+            }
+
+
+class ShardedRecommender:
+    """
+    按模块（category）分片的推荐器：每个分片是独立的 ContentBasedRecommender
+    （各自的 vectorizer、IDF 和矩阵）
+    
+    - 查询对全部分片打分（分片按需加载），合并成全局 Top-N；route_by_goals=True 时
+      只打分与学习目标同名的分片，目标不对应任何模块、或这些分片的候选不够时才打分全部分片
+    - recommend_many() 每个分片对所有用户批量打分（一次稀疏矩阵乘法），再按用户合并
+    - 分片模型放在 ShardStore 里，首次使用时加载，超出内存预算按 LRU 淘汰
+    - refit() 只重新训练内容变化（或有增量修改）的分片，其余分片原样复用
+    
+    各分片的 IDF 不同，跨分片比较的是各自的余弦相似度 + Level 加分
+    """
+    
+    def __init__(self, directory=None, memory_budget_mb=None, store=None, route_by_goals=False, **options):
+        self.store = store if store is not None else ShardStore(directory, memory_budget_mb, **options)
+        self.route_by_goals = route_by_goals
+        self.shards = {}                  # 分片 key → Shard
+        self._id_to_shard = {}
+        self._settings = repr(sorted(
+            (key, value) for key, value in self.store.options.items() if key != 'cooccurrence'
+        ))
+        self.compact = self.store.options.get('compact')
+        self.ann_index = None
+    
+    @property
+    def drift(self):
+        return sum(shard.drift for shard in self.shards.values())
+    
+    @property
+    def item_count(self):
+        return len(self._id_to_shard)
+    
+    @property
+    def content_df(self):
+        """完整内容表（会加载全部分片，只在重新训练等后台操作中使用）"""
+        return pd.concat(
+            [self.store.get(shard.name).content_df for shard in self.shards.values()],
+            ignore_index=True
+        )
+    
+    def fit(self, content_df):
+        """按模块拆分内容，每个分片单独训练"""
+        duplicated = content_df['id'][content_df['id'].duplicated()]
+        if not duplicated.empty:
+            raise ValueError(f"Duplicate content ids: {sorted(set(duplicated))}")
+        
+        self.shards = {}
+        for key, part in self._split(content_df):
+            self.shards[key] = self._fit_shard(key, part)
+        self._build_index()
+        logger.info("✅ Trained %d shards with %d items", len(self.shards), self.item_count)
+    
+    def refit(self, content_df=None):
+        """
+        重新训练，返回新的 ShardedRecommender（当前模型不变）
+        
+        content_df 为 None 时只重新训练有增量修改的分片；否则与新内容表逐个分片比较指纹，
+        内容没有变化、也没有增量修改的分片直接复用
+        """
+        other = self._copy()
+        if content_df is None:
+            for key, shard in self.shards.items():
+                if shard.drift:
+                    model = self.store.get(shard.name)
+                    other.shards[key] = other._fit_shard(key, model.content_df)
+            other._build_index()
+            return other
+        
+        other.shards = {}
+        reused = 0
+        for key, part in self._split(content_df):
+            shard = self.shards.get(key)
+            if shard is not None and shard.fingerprint == catalog_fingerprint(part, self._settings):
+                other.shards[key] = shard
+                reused += 1
+            else:
+                other.shards[key] = other._fit_shard(key, part)
+        other._build_index()
+        logger.info("✅ Refit %d of %d shards", len(other.shards) - reused, len(other.shards))
+        return other
+    
+    def recommend(self, user_level, learning_goals, completed_lessons=None, n=10, filters=None):
+        """
+        各分片取 Top-N，按得分合并（route_by_goals 时先只查学习目标对应的分片）
+        
+        category 过滤条件直接决定查哪些分片，其余过滤条件交给各分片
+        """
+        keys, allowed = self._route(learning_goals, filters)
+        results = self._merge(keys, user_level, learning_goals, completed_lessons, n, filters)
+        if len(results) < n and len(keys) < len(allowed):
+            results = self._merge(allowed, user_level, learning_goals, completed_lessons, n, filters)
+        return results
+    
+    def recommend_many(self, profiles, n=10, batch_size=256):
+        """批量推荐：每个分片一次性给要查它的用户打分，结果与逐个 recommend() 一致"""
+        routes = [self._route(p.get('learning_goals', []), p.get('filters')) for p in profiles]
+        results = self._merge_many(profiles, [keys for keys, _ in routes], n, batch_size)
+        
+        short = [i for i, (keys, allowed) in enumerate(routes) if len(results[i]) < n and len(keys) < len(allowed)]
+        if short:
+            expanded = self._merge_many([profiles[i] for i in short], [routes[i][1] for i in short], n, batch_size)
+            for i, result in zip(short, expanded):
+                results[i] = result
+        return results
+    
+    def get_item(self, item_id):
+        key = self._id_to_shard.get(item_id)
+        if key is None:
+            return None
+        return self.store.get(self.shards[key].name).get_item(item_id)
+    
+    def upsert_items(self, items_df):
+        """增量新增 / 替换内容：只修改涉及的分片；换了模块的内容从旧分片移走"""
+        duplicated = items_df['id'][items_df['id'].duplicated()]
+        if not duplicated.empty:
+            raise ValueError(f"Duplicate content ids: {sorted(set(duplicated))}")
+        
+        parts = list(self._split(items_df))
+        moved = [
+            item_id
+            for key, part in parts
+            for item_id in part['id']
+            if self._id_to_shard.get(item_id, key) != key
+        ]
+        self._remove(moved)
+        
+        for key, part in parts:
+            shard = self.shards.get(key)
+            if shard is None:
+                # 新模块：直接训练一个分片
+                self.shards[key] = self._fit_shard(key, part)
+            else:
+                model = self.store.get(shard.name).clone()
+                model.upsert_items(part)
+                self.shards[key] = self._edited_shard(key, model)
+        self._build_index()
+        return len(items_df)
+    
+    def remove_items(self, item_ids):
+        """增量删除内容，返回实际删除的条数"""
+        removed = self._remove(item_ids)
+        self._build_index()
+        return removed
+    
+    def clone(self):
+        """浅拷贝（共享 ShardStore 和分片模型），增量修改总是替换分片而不是原地修改"""
+        return self._copy()
+    
+    def cache_info(self):
+        """已加载分片的排名缓存统计之和"""
+        info = {'hits': 0, 'misses': 0, 'size': 0, 'maxsize': 0}
+        for shard in self.shards.values():
+            model = self.store.loaded(shard.name)
+            if model is not None:
+                for key, value in model.cache_info().items():
+                    info[key] += value
+        return info
+    
+    def shard_info(self):
+        return {
+            'shards': {key: len(shard.ids) for key, shard in sorted(self.shards.items())},
+            'store': self.store.info(),
+        }
+    
+    def save(self, path, **metadata):
+        """
+        保存分片清单 meta.json；分片本身保存在 path/shards/<名字> 下（已存在的不重复保存）
+        
+        清单先写临时文件再替换，其他进程读到的总是完整的一版
+        """
+        shard_dir = os.path.join(path, 'shards')
+        os.makedirs(shard_dir, exist_ok=True)
+        for shard in self.shards.values():
+            shard_path = os.path.join(shard_dir, shard.name)
+            if ContentBasedRecommender.snapshot_info(shard_path) is None:
+                self.store.get(shard.name).save(shard_path)
+        
+        tmp_path = os.path.join(path, f"meta.json.tmp-{os.getpid()}")
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({
+                **metadata,
+                'format': SHARDED_SNAPSHOT_FORMAT,
+                'created_at': time.time(),
+                'settings': self._settings,
+                'shards': {
+                    key: {'name': shard.name, 'fingerprint': shard.fingerprint,
+                          'ids': list(shard.ids), 'drift': shard.drift}
+                    for key, shard in self.shards.items()
+                },
+            }, f)
+        os.replace(tmp_path, os.path.join(path, 'meta.json'))
+        
+        if os.path.abspath(shard_dir) == os.path.abspath(self.store.directory or ''):
+            self.store.retain(shard.name for shard in self.shards.values())
+    
+    @staticmethod
+    def snapshot_info(path):
+        """分片清单（不存在或格式不符时返回 None）"""
+        try:
+            with open(os.path.join(path, 'meta.json'), encoding='utf-8') as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return meta if meta.get('format') == SHARDED_SNAPSHOT_FORMAT else None
+    
+    @classmethod
+    def load(cls, path, mmap=True, store=None, memory_budget_mb=None, **options):
+        """读取分片清单；分片模型在首次使用时才加载"""
+        meta = cls.snapshot_info(path)
+        if meta is None:
+            raise ValueError(f"No sharded model snapshot at {path}")
+        
+        recommender = cls(os.path.join(path, 'shards'), memory_budget_mb, store=store, **options)
+        recommender.shards = {
+            key: Shard(shard['name'], shard['fingerprint'], tuple(shard['ids']), shard['drift'])
+            for key, shard in meta['shards'].items()
+        }
+        recommender._build_index()
+        return recommender
+    
+    def _copy(self):
+        other = copy.copy(self)
+        other.shards = dict(self.shards)
+        return other
+    
+    @staticmethod
+    def _split(content_df):
+        content_df = content_df.reset_index(drop=True)
+        keys = content_df['category'].map(shard_key)
+        for key, part in content_df.groupby(keys, sort=True):
+            yield key, part.reset_index(drop=True)
+    
+    def _fit_shard(self, key, part):
+        model = ContentBasedRecommender(**self.store.options)
+        model.fit(part)
+        fingerprint = catalog_fingerprint(part, self._settings)
+        name = f"{self._safe_name(key)}-{fingerprint[:16]}"
+        self.store.put(name, model)
+        return Shard(name, fingerprint, tuple(part['id']), 0)
+    
+    def _edited_shard(self, key, model):
+        name = f"{self._safe_name(key)}-{uuid.uuid4().hex[:16]}"
+        self.store.put(name, model)
+        return Shard(name, None, tuple(model.content_df['id']), model.drift)
+    
+    def _remove(self, item_ids):
+        by_shard = {}
+        for item_id in set(item_ids):
+            key = self._id_to_shard.get(item_id)
+            if key is not None:
+                by_shard.setdefault(key, []).append(item_id)
+        
+        removed = 0
+        for key, ids in by_shard.items():
+            model = self.store.get(self.shards[key].name).clone()
+            removed += model.remove_items(ids)
+            if len(model.content_df):
+                self.shards[key] = self._edited_shard(key, model)
+            else:
+                del self.shards[key]
+        return removed
+    
+    def _route(self, learning_goals, filters):
+        """（先查的分片, 候选不够时扩展到的分片）"""
+        filter_key = dict(ContentBasedRecommender._filter_key(filters) or ())
+        allowed = list(self.shards)
+        if 'category' in filter_key:
+            allowed = [key for key in filter_key['category'] if key in self.shards]
+        if not self.route_by_goals:
+            return allowed, allowed
+        
+        keys = [key for key in dict.fromkeys(shard_key(goal) for goal in learning_goals) if key in allowed]
+        return keys or allowed, allowed
+    
+    def _merge(self, keys, user_level, learning_goals, completed_lessons, n, filters=None):
+        frames = [
+            self.store.get(self.shards[key].name).recommend(user_level, learning_goals, completed_lessons, n, filters)
+            for key in keys
+        ]
+        return self._top(frames, n)
+    
+    def _merge_many(self, profiles, shard_keys, n, batch_size):
+        # 分片 → 要查它的用户（下标）；每个分片只加载一次
+        members = {}
+        for i, keys in enumerate(shard_keys):
+            for position, key in enumerate(keys):
+                members.setdefault(key, []).append((i, position))
+        
+        frames = [[] for _ in profiles]
+        for key, users in members.items():
+            model = self.store.get(self.shards[key].name)
+            batch = model.recommend_many([profiles[i] for i, _ in users], n, batch_size)
+            for (i, position), frame in zip(users, batch):
+                frames[i].append((position, frame))
+        
+        # 按分片顺序合并，同分时与 recommend() 的顺序一致
+        return [self._top([frame for _, frame in sorted(user_frames, key=lambda pair: pair[0])], n)
+                for user_frames in frames]
+    
+    @staticmethod
+    def _top(frames, n):
+        if not frames:
+            return pd.DataFrame(columns=RESULT_COLUMNS + ['score'])
+        results = pd.concat(frames, ignore_index=True)
+        return results.sort_values('score', ascending=False, kind='stable').head(n).reset_index(drop=True)
+    
+    def _build_index(self):
+        self._id_to_shard = {
+            item_id: key for key, shard in self.shards.items() for item_id in shard.ids
+        }
+    
+    @staticmethod
+    def _safe_name(key):
+        return re.sub(r'[^a-z0-9_-]+', '_', key)[:40] or 'shard'
 
 
 # ========== 测试代码 ==========
@@ -130,5 +1669,727 @@ def test_content_based():
     print("Priority：Similar 70% + Level Match 30%")
 
 
+def _recommend_pandas(recommender, user_level, learning_goals, completed_lessons, n):
+    """旧版 pandas 实现（仅用于对照测试）"""
+    query = ' '.join([
+        user_level, user_level, user_level,
+        *[goal for goal in learning_goals for _ in range(2)]
+    ])
+    user_vector = recommender.vectorizer.transform([query])
+    similarities = cosine_similarity(user_vector, recommender.content_matrix)[0]
+    
+    results = recommender.content_df.copy()
+    results['similarity'] = similarities
+    
+    user_level_num = LEVEL_MAP.get(user_level, 0)
+    
+    def level_bonus(content_level):
+        diff = abs(user_level_num - LEVEL_MAP.get(content_level, 0))
+        if diff == 0: return 0.3
+        if diff == 1: return 0.15
+        return 0
+    
+    results['level_bonus'] = results['level'].apply(level_bonus)
+    results['score'] = results['similarity'] * 0.7 + results['level_bonus'] * 0.3
+    results = results[~results['id'].isin(completed_lessons)]
+    return results.nlargest(n, 'score')[[*recommender._record_columns, 'score']]
+
+
+def test_vectorized_parity():
+    """NumPy 打分路径与旧版 pandas 输出一致"""
+    rng = np.random.default_rng(0)
+    words = ['tense', 'verbs', 'idioms', 'stories', 'listening', 'present',
+             'past', 'future', 'phrasal', 'business', 'travel', 'news']
+    categories = ['Grammar', 'Vocabulary', 'Reading', 'Listening', 'Speaking']
+    levels = list(LEVEL_MAP) + ['X9']
+    
+    content = pd.DataFrame([
+        {
+            'id': f'item-{i}',
+            'title': ' '.join(rng.choice(words, 2)).title(),
+            'category': rng.choice(categories),
+            'level': rng.choice(levels),
+            'description': ' '.join(rng.choice(words, 4)),
+        }
+        for i in range(500)
+    ])
+    
+    recommender = ContentBasedRecommender()
+    recommender.fit(content)
+    
+    for user_level in levels:
+        for goals in ([], ['Grammar'], ['Vocabulary', 'Listening'], ['travel']):
+            completed = list(rng.choice(content['id'], 40)) + ['missing-id']
+            for n in (1, 10, 600):
+                expected = _recommend_pandas(recommender, user_level, goals, completed, n)
+                actual = recommender.recommend(user_level, goals, completed, n)
+                
+                assert list(actual['id']) == list(expected['id'])
+                assert np.allclose(actual['score'], expected['score'])
+    
+    print("✅ Vectorized scoring matches pandas output")
+
+
+def test_recommend_many():
+    """批量推荐与逐个 recommend 结果一致"""
+    content = pd.DataFrame([
+        {'id': 'g1', 'title': 'Present Simple Tense', 'category': 'Grammar', 'level': 'A1', 'description': 'Basic tense'},
+        {'id': 'g2', 'title': 'Past Simple Tense', 'category': 'Grammar', 'level': 'A2', 'description': 'Past tense'},
+        {'id': 'v1', 'title': 'Common Verbs', 'category': 'Vocabulary', 'level': 'A1', 'description': 'Essential verbs'},
+        {'id': 'v2', 'title': 'English Idioms', 'category': 'Vocabulary', 'level': 'B2', 'description': 'Idioms'},
+        {'id': 'r1', 'title': 'Short Stories', 'category': 'Reading', 'level': 'A1', 'description': 'Reading practice'},
+    ])
+    
+    recommender = ContentBasedRecommender()
+    recommender.fit(content)
+    
+    profiles = [
+        {'user_level': 'A1', 'learning_goals': ['Grammar', 'Vocabulary'], 'completed_lessons': ['g1']},
+        {'user_level': 'B2', 'learning_goals': ['Vocabulary']},
+        {'user_level': 'A2', 'learning_goals': [], 'completed_lessons': ['g2', 'v1']},
+    ]
+    
+    batched = recommender.recommend_many(profiles, n=3, batch_size=2)
+    
+    assert len(batched) == len(profiles)
+    for profile, actual in zip(profiles, batched):
+        expected = recommender.recommend(
+            profile['user_level'], profile['learning_goals'],
+            profile.get('completed_lessons'), n=3
+        )
+        assert list(actual['id']) == list(expected['id'])
+        assert np.allclose(actual['score'], expected['score'])
+    
+    print("✅ recommend_many matches per-user recommend")
+
+
+def test_ranking_cache():
+    """相同画像命中缓存，已完成课程在缓存后过滤，fit() 清空缓存"""
+    content = pd.DataFrame([
+        {'id': 'g1', 'title': 'Present Simple Tense', 'category': 'Grammar', 'level': 'A1', 'description': 'Basic tense'},
+        {'id': 'g2', 'title': 'Past Simple Tense', 'category': 'Grammar', 'level': 'A2', 'description': 'Past tense'},
+        {'id': 'v1', 'title': 'Common Verbs', 'category': 'Vocabulary', 'level': 'A1', 'description': 'Essential verbs'},
+        {'id': 'v2', 'title': 'English Idioms', 'category': 'Vocabulary', 'level': 'B2', 'description': 'Idioms'},
+        {'id': 'r1', 'title': 'Short Stories', 'category': 'Reading', 'level': 'A1', 'description': 'Reading practice'},
+    ])
+    
+    recommender = ContentBasedRecommender(cache_depth=2)
+    recommender.fit(content)
+    
+    first = recommender.recommend('A1', ['Grammar'], [], n=2)
+    second = recommender.recommend('A1', [' grammar '], ['g1'], n=2)
+    expected = _recommend_pandas(recommender, 'A1', ['Grammar'], ['g1'], 2)
+    
+    assert recommender.cache_info()['hits'] == 1
+    assert recommender.cache_info()['misses'] == 1
+    assert 'g1' not in list(second['id'])
+    assert list(second['id']) == list(expected['id'])
+    assert list(first['id']) != list(second['id'])
+    
+    recommender.fit(content)
+    assert recommender.cache_info()['size'] == 0
+    
+    print("✅ Ranking cache hits, filters and flushes correctly")
+
+
+def test_query_vector_parity():
+    """预计算分量拼出的查询向量与字符串 + vectorizer.transform 一致"""
+    content = pd.DataFrame([
+        {'id': 'g1', 'title': 'Present Simple Tense', 'category': 'Grammar', 'level': 'A1', 'description': 'Grammar a1 basics'},
+        {'id': 'g2', 'title': 'Past Simple Tense', 'category': 'Grammar', 'level': 'A2', 'description': 'Past tense'},
+        {'id': 'v1', 'title': 'Common Verbs', 'category': 'Vocabulary', 'level': 'A1', 'description': 'Vocabulary grammar verbs'},
+        {'id': 'v2', 'title': 'Business Idioms', 'category': 'Vocabulary', 'level': 'B2', 'description': 'Idioms'},
+        {'id': 'r1', 'title': 'Short Stories', 'category': 'Reading', 'level': 'A1', 'description': 'Reading practice'},
+    ])
+    
+    recommender = ContentBasedRecommender()
+    recommender.fit(content)
+    
+    profiles = [
+        ('A1', []),
+        ('A1', ['Grammar', 'Vocabulary']),
+        ('B2', ['vocabulary', 'grammar', 'vocabulary']),
+        ('C1', ['Business English', 'the', 'Short stories']),
+        ('unknown', ['Reading']),
+    ]
+    for user_level, goals in profiles:
+        query = ' '.join([user_level] * 3 + [goal for goal in goals for _ in range(2)])
+        expected = recommender.vectorizer.transform([query]).toarray()
+        actual = recommender._query_vector(user_level, goals).toarray()
+        assert np.allclose(actual, expected)
+    
+    print("✅ Composed query vectors match vectorizer.transform")
+
+
+def test_incremental_updates():
+    """增量 upsert / delete 与用冻结词表重新转换整个内容表一致"""
+    content = pd.DataFrame([
+        {'id': 'g1', 'title': 'Present Simple Tense', 'category': 'Grammar', 'level': 'A1', 'description': 'Basic tense'},
+        {'id': 'g2', 'title': 'Past Simple Tense', 'category': 'Grammar', 'level': 'A2', 'description': 'Past tense'},
+        {'id': 'v1', 'title': 'Common Verbs', 'category': 'Vocabulary', 'level': 'A1', 'description': 'Essential verbs'},
+        {'id': 'v2', 'title': 'English Idioms', 'category': 'Vocabulary', 'level': 'B2', 'description': 'Idioms'},
+        {'id': 'r1', 'title': 'Short Stories', 'category': 'Reading', 'level': 'A1', 'description': 'Reading practice'},
+    ])
+    
+    recommender = ContentBasedRecommender()
+    recommender.fit(content)
+    recommender.recommend('A1', ['Grammar'])
+    
+    updated = recommender.clone()
+    updated.upsert_items(pd.DataFrame([
+        {'id': 'g2', 'title': 'Past Continuous Tense', 'category': 'Grammar', 'level': 'B1', 'description': 'Past tense'},
+        {'id': 'r2', 'title': 'News Stories', 'category': 'Reading', 'level': 'B1', 'description': 'Reading news'},
+    ]))
+    assert updated.remove_items(['v2', 'missing']) == 1
+    
+    assert list(updated.content_df['id']) == ['g1', 'g2', 'v1', 'r1', 'r2']
+    assert updated.drift == 3
+    assert updated.cache_info()['size'] == 0
+    assert updated.get_item('g2')['level'] == 'B1'
+    
+    expected = updated.vectorizer.transform(updated.content_df['features'])
+    assert np.allclose(updated.content_matrix.toarray(), expected.toarray())
+    
+    # 原模型不受影响
+    assert list(recommender.content_df['id']) == ['g1', 'g2', 'v1', 'v2', 'r1']
+    assert recommender.cache_info()['size'] == 1
+    
+    print("✅ Incremental upsert / delete keep the model consistent")
+
+
+def test_snapshot_roundtrip():
+    """保存后 mmap 加载的模型与原模型推荐一致"""
+    import tempfile
+    
+    content = pd.DataFrame([
+        {'id': 'g1', 'title': 'Present Simple Tense', 'category': 'Grammar', 'level': 'A1', 'description': 'Basic tense'},
+        {'id': 'g2', 'title': 'Past Simple Tense', 'category': 'Grammar', 'level': 'A2', 'description': 'Past tense'},
+        {'id': 'v1', 'title': 'Common Verbs', 'category': 'Vocabulary', 'level': 'A1', 'description': 'Essential verbs'},
+        {'id': 'v2', 'title': 'English Idioms', 'category': 'Vocabulary', 'level': 'B2', 'description': 'Idioms'},
+        {'id': 'r1', 'title': 'Short Stories', 'category': 'Reading', 'level': 'A1', 'description': 'Reading practice'},
+    ])
+    
+    recommender = ContentBasedRecommender()
+    recommender.fit(content)
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'model')
+        recommender.save(path, version='v1')
+        recommender.save(path, version='v2')  # 覆盖已有快照
+        
+        assert ContentBasedRecommender.snapshot_info(path)['version'] == 'v2'
+        
+        loaded = ContentBasedRecommender.load(path)
+        assert not loaded.content_matrix.data.flags.writeable  # mmap 只读
+        
+        for user_level, goals in [('A1', ['Grammar']), ('B2', ['Vocabulary', 'Reading'])]:
+            expected = recommender.recommend(user_level, goals, ['g1'], n=3)
+            actual = loaded.recommend(user_level, goals, ['g1'], n=3)
+            assert list(actual['id']) == list(expected['id'])
+            assert np.allclose(actual['score'], expected['score'])
+        
+        # 加载后的模型仍可增量更新
+        loaded.upsert_items(pd.DataFrame([
+            {'id': 'r2', 'title': 'News Stories', 'category': 'Reading', 'level': 'B1', 'description': 'Reading news'},
+        ]))
+        assert loaded.get_item('r2')['title'] == 'News Stories'
+        
+        del loaded
+    
+    print("✅ Model snapshot save / mmap load round-trips")
+
+
+def test_cooccurrence():
+    """共现阶段：增量更新、邻居有界、缓存路径与完整打分一致"""
+    rng = np.random.default_rng(0)
+    categories = ['Grammar', 'Vocabulary', 'Reading', 'Listening']
+    words = ['tense', 'verbs', 'idioms', 'stories', 'news', 'podcast', 'travel', 'food', 'work', 'family']
+    content = pd.DataFrame([
+        {
+            'id': f'c{i}',
+            'title': f"{words[i % len(words)]} {words[(i * 7) % len(words)]} {i}",
+            'category': categories[i % len(categories)],
+            'level': list(LEVEL_MAP)[i % 6],
+            'description': ' '.join(rng.choice(words, size=5)),
+        }
+        for i in range(300)
+    ])
+    
+    cooccurrence = ItemCooccurrence(top_k=5, history=20)
+    recommender = ContentBasedRecommender(cache_depth=20, cooccurrence=cooccurrence)
+    recommender.fit(content)
+    
+    # 没有共现数据时与纯内容推荐一致
+    plain = ContentBasedRecommender(cache_depth=20)
+    plain.fit(content)
+    before = recommender.recommend('A1', ['Grammar'], ['c0'], n=10)
+    assert list(before['id']) == list(plain.recommend('A1', ['Grammar'], ['c0'], n=10)['id'])
+    
+    # 增量更新：重复提交同一列表不重复计数
+    users = {f'u{u}': [f'c{i}' for i in rng.choice(300, size=rng.integers(2, 30), replace=False)] for u in range(200)}
+    for user_id, completed in users.items():
+        assert cooccurrence.observe(user_id, completed) == len(completed)
+        assert cooccurrence.observe(user_id, completed) == 0
+    extra = next(f'c{i}' for i in range(300) if f'c{i}' not in users['u0'])
+    assert cooccurrence.observe('u0', users['u0'] + [extra]) == 1
+    
+    # 每行邻居数有界
+    assert all(len(row) <= 2 * cooccurrence.top_k for row in cooccurrence._neighbours.values())
+    
+    # 缓存 + 协同叠加的结果 == 完整打分（包括被挤出缓存的邻居）
+    for user_id, completed in list(users.items())[:50]:
+        for user_level, goals in [('A1', ['Grammar']), ('B2', ['Reading', 'Vocabulary'])]:
+            actual = recommender.recommend(user_level, goals, completed, n=10)
+            expected = recommender._rank(
+                recommender._similarities(user_level, goals), user_level, completed, n=10
+            )
+            assert list(actual['id']) == list(expected['id'])
+            assert np.allclose(actual['score'], expected['score'])
+            assert not set(actual['id']) & set(completed)
+    
+    # 相同画像共用一个缓存条目，协同部分因人而异
+    assert recommender.cache_info()['size'] == 2
+    
+    # 共现模型以 id 为键，模型副本和增量修改后继续生效
+    updated = recommender.clone()
+    updated.remove_items(['c1', 'c2'])
+    ids = set(updated.recommend('A1', ['Grammar'], users['u1'], n=10)['id'])
+    assert not ids & {'c1', 'c2'}
+    
+    # 读不加锁：并发 observe() 时 scores() 只看到完整发布的行
+    writer_done = threading.Event()
+    
+    def write():
+        for u in range(200, 600):
+            cooccurrence.observe(f'u{u}', [f'c{i}' for i in rng.choice(300, size=20, replace=False)])
+        writer_done.set()
+    
+    writer = threading.Thread(target=write)
+    writer.start()
+    with cooccurrence._lock:
+        # 写线程被挡住时读照样进行
+        assert cooccurrence.scores(users['u0'])
+    while not writer_done.is_set():
+        assert all(0 < value <= 1 for value in cooccurrence.scores(users['u0']).values())
+    writer.join()
+    
+    print("✅ Co-occurrence stage blends into cached rankings exactly")
+
+
+def test_ann():
+    """ANN 模式：候选精确打分、召回率、增量修改和快照保存后索引仍然对齐"""
+    import tempfile
+    
+    rng = np.random.default_rng(1)
+    categories = ['Grammar', 'Vocabulary', 'Reading', 'Listening', 'Speaking', 'Writing']
+    words = ['tense', 'verbs', 'idioms', 'stories', 'news', 'podcast', 'travel', 'food', 'work',
+             'family', 'email', 'interview', 'phrasal', 'articles', 'debate', 'letters']
+    content = pd.DataFrame([
+        {
+            'id': f'c{i}',
+            'title': ' '.join(rng.choice(words, size=3)),
+            'category': categories[i % len(categories)],
+            'level': list(LEVEL_MAP)[rng.integers(6)],
+            'description': ' '.join(rng.choice(words, size=8)),
+        }
+        for i in range(3000)
+    ])
+    profiles = [
+        (list(LEVEL_MAP)[rng.integers(6)], list(rng.choice(categories + words, size=2, replace=False)))
+        for _ in range(50)
+    ]
+    
+    exact = ContentBasedRecommender()
+    exact.fit(content)
+    recommender = ContentBasedRecommender(ann_min_items=1000, ann_probes=32)
+    recommender.fit(content)
+    assert recommender.ann_index is not None
+    
+    # 内容数低于阈值时不建索引
+    small = ContentBasedRecommender(ann_min_items=5000)
+    small.fit(content)
+    assert small.ann_index is None
+    
+    def recall(model):
+        hits = []
+        for user_level, goals in profiles:
+            model.ranking_cache.clear()
+            actual = model.recommend(user_level, goals, n=10)
+            expected = exact.recommend(user_level, goals, n=10)
+            
+            # 候选的得分与完整打分完全一致
+            scores = exact._scores(exact._similarities(user_level, goals), user_level)
+            rows = [exact._id_to_row[i] for i in actual['id']]
+            assert np.allclose(actual['score'], scores[rows])
+            hits.append(np.mean(actual['score'].values >= expected['score'].values[-1] - 1e-9))
+        return np.mean(hits)
+    
+    assert recall(recommender) >= 0.8
+    
+    # 探测全部聚类时与精确结果一致
+    recommender.ann_index.n_probes = len(recommender.ann_index.centroids)
+    assert recall(recommender) == 1.0
+    
+    # 增量修改：聚类分配与行对齐，新行能被召回
+    updated = recommender.clone()
+    updated.upsert_items(pd.DataFrame([
+        {'id': 'new1', 'title': 'Job Interview Phrases', 'category': 'Speaking', 'level': 'C2',
+         'description': 'Interview practice'},
+    ]))
+    updated.remove_items(['c0', 'c1'])
+    assert len(updated.ann_index.labels) == len(updated.content_df)
+    assert len(updated.ann_index._order) == len(updated.content_df)
+    assert 'new1' in set(updated.recommend('C2', ['Job Interview Phrases'], n=5)['id'])
+    assert recommender.ann_index.labels is not updated.ann_index.labels
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'model')
+        updated.save(path)
+        loaded = ContentBasedRecommender.load(path, ann_probes=updated.ann_index.n_probes)
+        assert np.array_equal(loaded.ann_index.labels, updated.ann_index.labels)
+        for user_level, goals in profiles[:10]:
+            expected = updated.recommend(user_level, goals, n=10)
+            actual = loaded.recommend(user_level, goals, n=10)
+            assert list(actual['id']) == list(expected['id'])
+        del loaded
+    
+    print("✅ ANN index recalls the exact top-10 and stays aligned with the catalog")
+
+
+def test_compact_modes():
+    """紧凑模式：float32 排名不变，uint8 得分误差有界；增量修改和快照保存后仍然一致"""
+    import tempfile
+    
+    rng = np.random.default_rng(2)
+    categories = ['Grammar', 'Vocabulary', 'Reading', 'Listening']
+    words = ['tense', 'verbs', 'idioms', 'stories', 'news', 'podcast', 'travel', 'food', 'work', 'family']
+    content = pd.DataFrame([
+        {
+            'id': f'c{i}',
+            'title': ' '.join(rng.choice(words, size=3)),
+            'category': categories[i % len(categories)],
+            'level': list(LEVEL_MAP)[rng.integers(6)],
+            'description': ' '.join(rng.choice(words, size=6)),
+        }
+        for i in range(500)
+    ])
+    profiles = [('A1', ['Grammar']), ('B2', ['Reading', 'travel']), ('C1', ['podcast news'])]
+    
+    exact = ContentBasedRecommender()
+    exact.fit(content)
+    
+    for compact, tolerance in [('float32', 1e-6), ('uint8', 0.01)]:
+        recommender = ContentBasedRecommender(compact=compact)
+        recommender.fit(content)
+        assert recommender.content_matrix.dtype == np.dtype(compact)
+        assert recommender.content_matrix.indices.dtype == np.int32
+        assert 'features' not in recommender.content_df.columns
+        
+        for user_level, goals in profiles:
+            actual = recommender._scores(recommender._similarities(user_level, goals), user_level)
+            expected = exact._scores(exact._similarities(user_level, goals), user_level)
+            assert np.abs(actual - expected).max() < tolerance
+        
+        # 批量打分与单次打分一致
+        batch = recommender.recommend_many(
+            [{'user_level': level, 'learning_goals': goals} for level, goals in profiles], n=5
+        )
+        for (user_level, goals), result in zip(profiles, batch):
+            assert list(result['id']) == list(recommender.recommend(user_level, goals, n=5)['id'])
+        
+        # 增量修改：缩放系数随行移动
+        recommender.upsert_items(pd.DataFrame([
+            {'id': 'c3', 'title': 'Travel Stories', 'category': 'Reading', 'level': 'B1', 'description': 'Trips'},
+            {'id': 'new1', 'title': 'Food Idioms', 'category': 'Vocabulary', 'level': 'B2', 'description': 'Idioms'},
+        ]))
+        recommender.remove_items(['c0'])
+        exact_updated = exact.clone()
+        exact_updated.upsert_items(pd.DataFrame([
+            {'id': 'c3', 'title': 'Travel Stories', 'category': 'Reading', 'level': 'B1', 'description': 'Trips'},
+            {'id': 'new1', 'title': 'Food Idioms', 'category': 'Vocabulary', 'level': 'B2', 'description': 'Idioms'},
+        ]))
+        exact_updated.remove_items(['c0'])
+        assert 'features' not in recommender.content_df.columns
+        for user_level, goals in profiles:
+            actual = recommender._similarities(user_level, goals)
+            expected = exact_updated._similarities(user_level, goals)
+            assert np.abs(actual - expected).max() < tolerance
+        
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'model')
+            recommender.save(path)
+            loaded = ContentBasedRecommender.load(path)
+            assert loaded.compact == compact
+            assert loaded.content_matrix.dtype == np.dtype(compact)
+            for user_level, goals in profiles:
+                assert np.array_equal(
+                    loaded._similarities(user_level, goals), recommender._similarities(user_level, goals)
+                )
+            del loaded
+    
+    print("✅ Compact float32 / uint8 models stay within tolerance of float64")
+
+
+def test_sharded_recommender():
+    """分片模型：全局合并 / 按目标路由、LRU 淘汰后重新加载、只重训变化的分片、增量修改跨分片移动"""
+    import tempfile
+    
+    rng = np.random.default_rng(3)
+    categories = ['Grammar', 'Vocabulary', 'Reading', 'Listening']
+    words = ['tense', 'verbs', 'idioms', 'stories', 'news', 'podcast', 'travel', 'food', 'work', 'family']
+    content = pd.DataFrame([
+        {
+            'id': f'c{i}',
+            'title': ' '.join(rng.choice(words, size=3)),
+            'category': categories[i % len(categories)],
+            'level': list(LEVEL_MAP)[rng.integers(6)],
+            'description': ' '.join(rng.choice(words, size=6)),
+        }
+        for i in range(400)
+    ])
+    
+    def expected(content_df, user_level, goals, completed=None, n=10, routed=False):
+        """每个模块（routed 时只有目标模块）单独训练，合并后取前 n"""
+        frames = []
+        for category in content_df['category'].unique():
+            if not routed or category.lower() in [goal.lower() for goal in goals]:
+                model = ContentBasedRecommender()
+                model.fit(content_df[content_df['category'] == category])
+                frames.append(model.recommend(user_level, goals, completed, n))
+        merged = pd.concat(frames, ignore_index=True)
+        return merged.sort_values('score', ascending=False, kind='stable').head(n)
+    
+    profiles = [('A1', ['Grammar']), ('B2', ['Reading', 'Vocabulary']), ('C1', ['listening'])]
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        # 内存预算只够放一个分片：每次换分片都要淘汰、重新加载
+        recommender = ShardedRecommender(os.path.join(tmp, 'shards'), memory_budget_mb=0.01)
+        recommender.fit(content)
+        assert sorted(recommender.shards) == ['grammar', 'listening', 'reading', 'vocabulary']
+        assert recommender.item_count == 400
+        
+        for user_level, goals in profiles:
+            actual = recommender.recommend(user_level, goals, ['c0', 'c1'])
+            reference = expected(content, user_level, goals, ['c0', 'c1'])
+            assert list(actual['id']) == list(reference['id'])
+            assert np.allclose(actual['score'], reference['score'])
+        assert recommender.store.info()['loaded'] == 1
+        assert recommender.store.info()['evictions'] > 0
+        
+        # 按目标路由（显式开启）：只查目标模块；目标不对应任何模块时打分全部分片
+        routed = ShardedRecommender(store=recommender.store, route_by_goals=True)
+        routed.shards = dict(recommender.shards)
+        routed._build_index()
+        for user_level, goals in profiles:
+            actual = routed.recommend(user_level, goals, ['c0', 'c1'])
+            reference = expected(content, user_level, goals, ['c0', 'c1'], routed=True)
+            assert list(actual['id']) == list(reference['id'])
+        assert len(routed.recommend('A1', ['travel'])) == 10
+        
+        # 批量推荐：按分片批量打分，结果与逐个推荐一致
+        batch = [
+            {'user_level': user_level, 'learning_goals': goals, 'completed_lessons': ['c0', 'c1']}
+            for user_level, goals in profiles + [('A1', ['travel'])]
+        ] + [{'user_level': 'B1', 'learning_goals': ['Reading'], 'filters': {'category': ['Listening']}}]
+        for model in (recommender, routed):
+            for profile, actual in zip(batch, model.recommend_many(batch)):
+                reference = model.recommend(
+                    profile['user_level'], profile['learning_goals'], profile.get('completed_lessons'),
+                    filters=profile.get('filters')
+                )
+                assert list(actual['id']) == list(reference['id'])
+                assert np.allclose(actual['score'], reference['score'])
+            assert set(actual['category']) == {'Listening'} and len(actual) == 10
+        
+        # 只有内容变化的分片重新训练
+        changed = content.copy()
+        changed.loc[changed['id'] == 'c0', 'title'] = 'Conditionals Explained'
+        refit = recommender.refit(changed)
+        assert refit.shards['grammar'].name != recommender.shards['grammar'].name
+        for key in ['listening', 'reading', 'vocabulary']:
+            assert refit.shards[key] is recommender.shards[key]
+        assert recommender.get_item('c0')['title'] != 'Conditionals Explained'
+        assert refit.get_item('c0')['title'] == 'Conditionals Explained'
+        
+        # 增量修改：换模块的内容从旧分片移走；新模块直接建分片
+        updated = refit.clone()
+        updated.upsert_items(pd.DataFrame([
+            {'id': 'c0', 'title': 'Travel Words', 'category': 'Vocabulary', 'level': 'A1', 'description': 'Trips'},
+            {'id': 'w1', 'title': 'Formal Emails', 'category': 'Writing', 'level': 'B2', 'description': 'Emails'},
+        ]))
+        assert updated.remove_items(['c2', 'missing']) == 1
+        assert updated.item_count == 400
+        assert updated.get_item('c0')['category'] == 'Vocabulary'
+        assert 'c0' not in set(updated.store.get(updated.shards['grammar'].name).content_df['id'])
+        assert updated.shards['writing'].ids == ('w1',)
+        assert updated.drift > 0 and refit.drift == 0
+        assert refit.get_item('c0')['category'] == 'Grammar'
+        
+        # 只重训有增量修改的分片
+        retrained = updated.refit()
+        assert retrained.drift == 0
+        assert retrained.shards['listening'] is updated.shards['listening']
+        
+        # 保存清单后加载：分片按需加载
+        path = os.path.join(tmp, 'model')
+        retrained.save(path, version='v1')
+        assert ShardedRecommender.snapshot_info(path)['version'] == 'v1'
+        assert ContentBasedRecommender.snapshot_info(path) is None
+        loaded = ShardedRecommender.load(path)
+        assert loaded.store.info()['loaded'] == 0
+        for user_level, goals in profiles:
+            assert list(loaded.recommend(user_level, goals)['id']) == list(retrained.recommend(user_level, goals)['id'])
+        assert loaded.store.info()['loaded'] == len(loaded.shards) == 5
+        del loaded
+    
+    print("✅ Sharded recommender routes, evicts, reloads and refits per shard")
+
+
+def test_filters():
+    """过滤条件：结果与先过滤再完整打分一致，走缓存、截断回退和批量路径"""
+    rng = np.random.default_rng(4)
+    categories = ['Grammar', 'Vocabulary', 'Reading', 'Listening']
+    words = ['tense', 'verbs', 'idioms', 'stories', 'news', 'podcast', 'travel', 'food', 'work', 'family']
+    content = pd.DataFrame([
+        {
+            'id': f'c{i}',
+            'title': ' '.join(rng.choice(words, size=3)),
+            'category': categories[i % len(categories)],
+            'level': list(LEVEL_MAP)[rng.integers(6)],
+            'description': ' '.join(rng.choice(words, size=6)),
+            'type': 'video' if i % 3 == 0 else 'lesson',
+        }
+        for i in range(600)
+    ])
+    
+    recommender = ContentBasedRecommender(cache_depth=5)
+    recommender.fit(content)
+    
+    def expected(user_level, goals, completed, filters, n=10):
+        """按 DataFrame 条件过滤后完整打分"""
+        keep = np.ones(len(content), dtype=bool)
+        if filters.get('type'):
+            keep &= content['type'].str.lower().isin([filters['type']]).values
+        if filters.get('category'):
+            keep &= content['category'].str.lower().isin([c.lower() for c in filters['category']]).values
+        levels = content['level'].map(LEVEL_MAP).values
+        keep &= levels >= LEVEL_MAP[filters.get('level_min', 'A1')]
+        keep &= levels <= LEVEL_MAP[filters.get('level_max', 'C2')]
+        if 'include_ids' in filters:
+            keep &= content['id'].isin(filters['include_ids']).values
+        completed = list(completed) + list(filters.get('exclude_ids', []))
+        similarities = recommender._similarities(user_level, goals)
+        return recommender._rank(similarities, user_level, completed, n, keep)
+    
+    cases = [
+        {'type': 'video'},
+        {'category': ['Grammar', 'reading']},
+        {'level_min': 'A2', 'level_max': 'B1'},
+        {'type': 'lesson', 'category': ['Vocabulary'], 'level_max': 'A2', 'exclude_ids': ['c1', 'c5']},
+        {'include_ids': ['c3', 'c7', 'c11', 'missing']},
+        {'category': ['Writing']},
+    ]
+    completed = [f'c{i}' for i in range(0, 600, 7)]
+    for filters in cases:
+        for user_level, goals in [('A1', ['Grammar']), ('B2', ['Reading', 'travel'])]:
+            for _ in range(2):  # 第二次走缓存
+                actual = recommender.recommend(user_level, goals, completed, n=10, filters=filters)
+                reference = expected(user_level, goals, completed, filters)
+                assert list(actual['id']) == list(reference['id'])
+                assert np.allclose(actual['score'], reference['score'])
+    
+    assert len(recommender.recommend('A1', ['Grammar'], filters={'category': ['Writing']})) == 0
+    assert set(recommender.recommend('A1', ['Grammar'], filters={'include_ids': ['c3', 'c7']})['id']) == {'c3', 'c7'}
+    
+    # exclude_ids 不占用新的缓存条目
+    size = recommender.cache_info()['size']
+    recommender.recommend('A1', ['Grammar'], filters={'type': 'video', 'exclude_ids': ['c0']})
+    assert recommender.cache_info()['size'] == size
+    
+    # 批量路径
+    profiles = [
+        {'user_level': 'A1', 'learning_goals': ['Grammar'], 'completed_lessons': completed, 'filters': filters}
+        for filters in cases
+    ]
+    for profile, result in zip(profiles, recommender.recommend_many(profiles, n=10)):
+        reference = recommender.recommend('A1', ['Grammar'], completed, n=10, filters=profile['filters'])
+        assert list(result['id']) == list(reference['id'])
+    
+    # 校验与 API 参数转换
+    for bad in [{'colour': 'red'}, {'level_min': 'D1'}]:
+        try:
+            recommender.recommend('A1', ['Grammar'], filters=bad)
+            raise AssertionError(f'{bad} should be rejected')
+        except ValueError:
+            pass
+    assert filters_from_request({'type': 'video', 'levelMin': 'A2', 'excludeIds': ['c1']}) == {
+        'type': 'video', 'level_min': 'A2', 'exclude_ids': ['c1']
+    }
+    assert filters_from_request({}) is None
+    assert filters_from_request({'category': 'Grammar'}) == {'category': 'Grammar'}
+    for bad in [{'category': 123}, {'type': ['video', None]}, {'levelMin': ['A1']}, {'levelMax': 4},
+                {'includeIds': [{'id': 'c1'}]}, {'excludeIds': 'c1'}, {'levelMin': 'D1'}, ['video']]:
+        try:
+            filters_from_request(bad)
+            raise AssertionError(f'{bad} should be rejected')
+        except ValueError:
+            pass
+    
+    # 分片模型：category 过滤直接选分片
+    sharded = ShardedRecommender()
+    sharded.fit(content)
+    result = sharded.recommend('A1', ['Grammar'], filters={'category': ['Reading'], 'type': 'video'})
+    assert len(result) == 10
+    assert set(result['category']) == {'Reading'} and set(result['type']) == {'video'}
+    
+    print("✅ Filters are applied before top-N and match full filtered scoring")
+
+
+def test_profile_fingerprint():
+    """画像指纹：顺序、重复不影响；相关输入一变就变"""
+    base = profile_fingerprint('A2', ['Grammar', 'travel'], ['c1', 'c2'], 'v1', {'category': ['grammar', 'reading']})
+    
+    assert base == profile_fingerprint('A2', ['travel', 'Grammar'], ['c2', 'c1', 'c2'], 'v1',
+                                       {'category': ['reading', 'grammar']})
+    for changed in [
+        profile_fingerprint('B1', ['Grammar', 'travel'], ['c1', 'c2'], 'v1', {'category': ['grammar', 'reading']}),
+        profile_fingerprint('A2', ['Grammar'], ['c1', 'c2'], 'v1', {'category': ['grammar', 'reading']}),
+        profile_fingerprint('A2', ['Grammar', 'travel'], ['c1', 'c2', 'c3'], 'v1', {'category': ['grammar', 'reading']}),
+        profile_fingerprint('A2', ['Grammar', 'travel'], ['c1', 'c2'], 'v2', {'category': ['grammar', 'reading']}),
+        profile_fingerprint('A2', ['Grammar', 'travel'], ['c1', 'c2'], 'v1', {'category': ['grammar']}),
+        profile_fingerprint('A2', ['Grammar', 'travel'], ['c1', 'c2'], 'v1', {'category': ['grammar', 'reading']}, n=5),
+        profile_fingerprint('A2', ['Grammar', 'travel'], ['c1', 'c2'], 'v1', {'category': ['grammar', 'reading']},
+                            cooccurrence=1),
+    ]:
+        assert changed != base
+    assert profile_fingerprint('A1', [], [], 'v1') == profile_fingerprint('A1', None, None, 'v1', {})
+    
+    # 共现版本号：别人的新完成记录累积到 generation_step 条后才变
+    cooccurrence = ItemCooccurrence(generation_step=3)
+    cooccurrence.observe('u1', ['c1', 'c2'])
+    assert cooccurrence.generation == 0
+    cooccurrence.observe('u2', ['c1'])
+    assert cooccurrence.generation == 1
+    cooccurrence.observe('u2', ['c1'])
+    assert cooccurrence.generation == 1
+    
+    print("✅ Profile fingerprints ignore order and change with every ranking input")
+
+
 if __name__ == '__main__':
-    test_content_based()
\ No newline at end of file
+    # 训练过程通过 logger 输出；直接运行本文件时打印到终端
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    
+    test_content_based()
+    test_vectorized_parity()
+    test_recommend_many()
+    test_ranking_cache()
+    test_query_vector_parity()
+    test_incremental_updates()
+    test_snapshot_roundtrip()
+    test_cooccurrence()
+    test_ann()
+    test_compact_modes()
+    test_sharded_recommender()
+    test_filters()
+    test_profile_fingerprint()
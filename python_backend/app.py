@@ -1,24 +1,393 @@
 # app.py - Simplified Backend: Just compare text from browser
 
-from flask import Flask, request, jsonify
+from flask import Flask, Request, Response, request, jsonify
 from flask_cors import CORS
+from werkzeug.exceptions import RequestEntityTooLarge
+from collections import Counter, OrderedDict, namedtuple
+from concurrent.futures import ProcessPoolExecutor
 from difflib import SequenceMatcher
+import copy
+import glob
+import hashlib
+import json
+import logging
 import os
+import queue
+import re
+import sys
 import tempfile
+import threading
+import time
+import metrics
+import logging_setup
 
 app = Flask(__name__)
 CORS(app)
 
+logger = logging.getLogger(__name__)
+
+# Audio uploads: kept in memory, spilled to disk only above the spool threshold
+AUDIO_MAX_BYTES = int(os.getenv('AUDIO_MAX_BYTES', str(10 * 1024 * 1024)))
+AUDIO_SPOOL_MAX_MEMORY = int(os.getenv('AUDIO_SPOOL_MAX_MEMORY', str(1024 * 1024)))
+AUDIO_ARCHIVE_DIR = os.getenv('AUDIO_ARCHIVE_DIR', '')      # empty = don't keep recordings
+AUDIO_ARCHIVE_QUEUE = int(os.getenv('AUDIO_ARCHIVE_QUEUE', '64'))
+
+# Batch scoring: items run on a process pool once the batch is big enough
+BATCH_MAX_ITEMS = int(os.getenv('BATCH_MAX_ITEMS', '500'))
+BATCH_PARALLEL_MIN_ITEMS = int(os.getenv('BATCH_PARALLEL_MIN_ITEMS', '32'))
+BATCH_PARALLEL_MIN_CHARS = int(os.getenv('BATCH_PARALLEL_MIN_CHARS', '20000'))
+SCORING_WORKERS = int(os.getenv('SCORING_WORKERS', str(os.cpu_count() or 2)))
+
+_scoring_pool = None
+_scoring_pool_lock = threading.Lock()
+
+# Prepared target sentences (speaking exercises reuse a fixed set of sentences)
+TARGET_CACHE_SIZE = int(os.getenv('TARGET_CACHE_SIZE', '2048'))
+# Speaking prompts (speakingPrompts[].modelSentence) live in the Firestore lessonContent
+# collection; none of the JSON bundled in src/data has any. TARGET_PREWARM_PATHS can add
+# JSON files (glob) on top, e.g. an export of the prompts for offline runs.
+TARGET_PREWARM = os.getenv('TARGET_PREWARM', '1') == '1'
+TARGET_PREWARM_PATHS = os.getenv('TARGET_PREWARM_PATHS', '')
+TARGET_PREWARM_KEYS = ('modelSentence', 'targetText', 'target_text')
+TARGET_PREWARM_TIMEOUT = float(os.getenv('TARGET_PREWARM_TIMEOUT', '20'))
+
+# Latency metrics (exposed at /api/metrics); children are bound once here
+SCORING_STAGE_SECONDS = metrics.Histogram(
+    'smartlearning_pronunciation_stage_seconds',
+    'Latency of each score-pronunciation stage',
+    ['stage']
+)
+_STAGE_PARSE = SCORING_STAGE_SECONDS.labels('parse')
+_STAGE_AUDIO = SCORING_STAGE_SECONDS.labels('audio')
+_STAGE_SCORE = SCORING_STAGE_SECONDS.labels('score')
+_STAGE_TOTAL = SCORING_STAGE_SECONDS.labels('total')
+_STAGE_BATCH = SCORING_STAGE_SECONDS.labels('batch')
+
+SCORING_REQUESTS = metrics.Counter(
+    'smartlearning_pronunciation_requests',
+    'score-pronunciation requests by outcome',
+    ['outcome']
+)
+_REQUESTS_OK = SCORING_REQUESTS.labels('ok')
+_REQUESTS_BAD_REQUEST = SCORING_REQUESTS.labels('bad_request')
+_REQUESTS_TOO_LARGE = SCORING_REQUESTS.labels('too_large')
+_REQUESTS_ERROR = SCORING_REQUESTS.labels('error')
+
+BATCH_ITEMS = metrics.Counter(
+    'smartlearning_pronunciation_batch_items',
+    'Items scored through the batch endpoint',
+    ['mode']
+)
+_BATCH_IN_PROCESS = BATCH_ITEMS.labels('in_process')
+_BATCH_PROCESS_POOL = BATCH_ITEMS.labels('process_pool')
+
+AUDIO_BYTES = metrics.Counter(
+    'smartlearning_pronunciation_audio_bytes',
+    'Audio bytes received with score-pronunciation requests'
+)
+
+WORD_PATTERN = re.compile(r"[a-z0-9]+(?:'[a-z0-9]+)*")
+
+
+def normalize_words(text):
+    """Lower-case words with punctuation removed ("Hello, world!" -> ['hello', 'world'])"""
+    return WORD_PATTERN.findall(text.lower())
+
+
+PreparedTarget = namedtuple(
+    'PreparedTarget',
+    ['text', 'normalized', 'words', 'word_counts', 'char_count', 'matcher', 'approx_bytes']
+)
+
+
+def _prepare_target(target_text):
+    """Normalize a target once and build a matcher whose target-side index is reused"""
+    words = normalize_words(target_text)
+    
+    # b (seq2) is the target: set_seq2 builds the word -> positions index once
+    matcher = SequenceMatcher(None, autojunk=False)
+    matcher.set_seq2(words)
+    
+    word_counts = Counter(words)
+    approx_bytes = (
+        sys.getsizeof(target_text) * 2
+        + sys.getsizeof(words) + sum(sys.getsizeof(word) for word in words)
+        + sys.getsizeof(word_counts)
+        + sys.getsizeof(matcher.b2j) + sum(sys.getsizeof(rows) for rows in matcher.b2j.values())
+    )
+    
+    return PreparedTarget(
+        text=target_text,
+        normalized=' '.join(words),
+        words=words,
+        word_counts=word_counts,
+        char_count=sum(map(len, words)),
+        matcher=matcher,
+        approx_bytes=approx_bytes
+    )
+
+
+class TargetCache:
+    """Thread-safe LRU of prepared target sentences, with hit rate and memory stats"""
+    
+    def __init__(self, maxsize=2048):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.bytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def get(self, target_text):
+        with self._lock:
+            prepared = self._entries.get(target_text)
+            if prepared is not None:
+                self._entries.move_to_end(target_text)
+                self.hits += 1
+                return prepared
+            self.misses += 1
+        
+        prepared = _prepare_target(target_text)
+        self._put(prepared)
+        return prepared
+    
+    def prewarm(self, target_texts):
+        """Prepare targets ahead of time (not counted as misses)"""
+        for target_text in target_texts:
+            with self._lock:
+                cached = target_text in self._entries
+            if not cached:
+                self._put(_prepare_target(target_text))
+    
+    def _put(self, prepared):
+        with self._lock:
+            if prepared.text in self._entries:
+                return
+            self._entries[prepared.text] = prepared
+            self.bytes += prepared.approx_bytes
+            while len(self._entries) > self.maxsize:
+                _, evicted = self._entries.popitem(last=False)
+                self.bytes -= evicted.approx_bytes
+    
+    def info(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else None,
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+                'approx_bytes': self.bytes,
+            }
+
+
+_target_cache = TargetCache(TARGET_CACHE_SIZE)
+
+
+def _collect_targets(node, keys, sentences):
+    """Append every non-empty string stored under one of keys, at any depth"""
+    if isinstance(node, dict):
+        for key, value in node.items():
+            if key in keys and isinstance(value, str) and value.strip():
+                sentences.append(value)
+            else:
+                _collect_targets(value, keys, sentences)
+    elif isinstance(node, list):
+        for value in node:
+            _collect_targets(value, keys, sentences)
+
+
+def find_target_sentences(pattern=TARGET_PREWARM_PATHS, keys=TARGET_PREWARM_KEYS):
+    """Collect speaking target sentences (e.g. modelSentence) from JSON files"""
+    sentences = []
+    for path in sorted(glob.glob(pattern)) if pattern else []:
+        try:
+            with open(path, encoding='utf-8') as f:
+                _collect_targets(json.load(f), keys, sentences)
+        except (OSError, ValueError) as e:
+            logger.warning("⚠️  Could not read %s: %s", path, e)
+    
+    return list(dict.fromkeys(sentences))
+
+
+def firestore_target_sentences(db=None, keys=TARGET_PREWARM_KEYS):
+    """Collect the speaking prompts' model sentences from the lessonContent collection"""
+    if db is None:
+        # Optional here: scoring itself doesn't need Firebase
+        from dotenv import load_dotenv
+        from firebase_admin import credentials, firestore, get_app, initialize_app
+        
+        try:
+            get_app()
+        except ValueError:
+            load_dotenv('.env.backend')
+            initialize_app(credentials.Certificate({
+                "type": "service_account",
+                "project_id": os.getenv("FIREBASE_PROJECT_ID"),
+                "private_key_id": os.getenv("FIREBASE_PRIVATE_KEY_ID"),
+                "private_key": (os.getenv("FIREBASE_PRIVATE_KEY") or '').replace('\\n', '\n'),
+                "client_email": os.getenv("FIREBASE_CLIENT_EMAIL"),
+                "client_id": os.getenv("FIREBASE_CLIENT_ID"),
+                "auth_uri": "https://accounts.google.com/o/oauth2/auth",
+                "token_uri": "https://oauth2.googleapis.com/token",
+                "auth_provider_x509_cert_url": "https://www.googleapis.com/oauth2/v1/certs",
+            }))
+        db = firestore.client()
+    
+    sentences = []
+    # Prewarm is best effort: one bounded attempt, so an unreachable Firestore can't hold up the start
+    for doc in db.collection('lessonContent').stream(retry=None, timeout=TARGET_PREWARM_TIMEOUT):
+        _collect_targets(doc.to_dict() or {}, keys, sentences)
+    return list(dict.fromkeys(sentences))
+
+
+def prewarm_targets():
+    """Prepare the speaking prompts (Firestore, plus TARGET_PREWARM_PATHS) before the first request"""
+    sentences = []
+    try:
+        sentences += firestore_target_sentences()
+    except Exception as e:
+        logger.warning("⚠️  Speaking prompts not loaded from Firestore: %s", e)
+    sentences += find_target_sentences()
+    
+    sentences = list(dict.fromkeys(sentences))
+    _target_cache.prewarm(sentences)
+    return len(sentences)
+
+
+def _matching_chars(word1, word2):
+    """Characters two words have in common (partial credit for a substituted word)"""
+    return sum(block.size for block in SequenceMatcher(None, word1, word2).get_matching_blocks())
+
+
+def _disjoint_alignment(target_count, user_count):
+    """Alignment of word lists with no word in common: substitute pairwise, then the leftovers"""
+    common = min(target_count, user_count)
+    ops = [('substitute', k, k) for k in range(common)]
+    ops += [('missing', k, None) for k in range(common, target_count)]
+    ops += [('extra', None, k) for k in range(common, user_count)]
+    return ops
+
+
+def _edit_alignment(target_words, user_words):
+    """
+    Levenshtein alignment of two short word lists
+    Returns ops: ('equal' | 'substitute', i, j), ('missing', i, None), ('extra', None, j)
+    """
+    rows, cols = len(target_words), len(user_words)
+    
+    # distance[i][j] = edits to turn target_words[:i] into user_words[:j]
+    distance = [list(range(cols + 1))]
+    for i in range(1, rows + 1):
+        previous = distance[-1]
+        current = [i] + [0] * cols
+        target_word = target_words[i - 1]
+        for j in range(1, cols + 1):
+            cost = 0 if target_word == user_words[j - 1] else 1
+            current[j] = min(previous[j - 1] + cost, previous[j] + 1, current[j - 1] + 1)
+        distance.append(current)
+    
+    # Backtrace, preferring substitutions over missing + extra pairs
+    ops = []
+    i, j = rows, cols
+    while i > 0 or j > 0:
+        if i > 0 and j > 0:
+            cost = 0 if target_words[i - 1] == user_words[j - 1] else 1
+            if distance[i][j] == distance[i - 1][j - 1] + cost:
+                ops.append(('equal' if cost == 0 else 'substitute', i - 1, j - 1))
+                i -= 1
+                j -= 1
+                continue
+        if i > 0 and distance[i][j] == distance[i - 1][j] + 1:
+            ops.append(('missing', i - 1, None))
+            i -= 1
+        else:
+            ops.append(('extra', None, j - 1))
+            j -= 1
+    
+    ops.reverse()
+    return ops
+
+
+def align_texts(user_text, target_text):
+    """
+    One word-level alignment pass over the normalized texts
+    
+    Matching runs of words are found first (difflib on word lists, not characters),
+    and only the gaps between them are aligned with edit distance, so long reading
+    passages stay cheap. The alignment yields everything the response needs:
+    similarity, missing / extra / substituted words with their positions.
+    
+    similarity is character-weighted like the old SequenceMatcher ratio:
+    2 * matching characters / (characters in target + characters said),
+    where a substituted word earns credit for the characters it shares.
+    
+    target_text may be a string or a PreparedTarget; strings go through the
+    target cache, so repeated lesson sentences are only normalized once.
+    """
+    target = target_text if isinstance(target_text, PreparedTarget) else _target_cache.get(target_text)
+    target_words = target.words
+    user_words = normalize_words(user_text)
+    
+    missing_words = []
+    extra_words = []
+    substituted_words = []
+    matched_chars = 0
+    
+    # No word in common (checked against the target's word counts): skip the
+    # matcher and the quadratic alignment, pairwise substitution is optimal
+    disjoint = not any(word in target.word_counts for word in user_words)
+    if disjoint:
+        opcodes = [('replace', 0, len(user_words), 0, len(target_words))]
+    else:
+        # Reuse the prepared target index; the copy keeps per-request state separate
+        matcher = copy.copy(target.matcher)
+        matcher.set_seq1(user_words)
+        opcodes = matcher.get_opcodes()
+    
+    for tag, u1, u2, t1, t2 in opcodes:
+        if tag == 'equal':
+            matched_chars += sum(len(word) for word in target_words[t1:t2])
+            continue
+        
+        if disjoint:
+            ops = _disjoint_alignment(t2 - t1, u2 - u1)
+        else:
+            ops = _edit_alignment(target_words[t1:t2], user_words[u1:u2])
+        
+        for op, i, j in ops:
+            if op == 'equal':
+                matched_chars += len(target_words[t1 + i])
+            elif op == 'substitute':
+                expected, said = target_words[t1 + i], user_words[u1 + j]
+                matched_chars += _matching_chars(expected, said)
+                substituted_words.append({'expected': expected, 'said': said, 'position': t1 + i})
+            elif op == 'missing':
+                missing_words.append({'word': target_words[t1 + i], 'position': t1 + i})
+            else:
+                extra_words.append({'word': user_words[u1 + j], 'position': u1 + j})
+    
+    total_chars = target.char_count + sum(map(len, user_words))
+    similarity = 2 * matched_chars / total_chars if total_chars else 1.0
+    
+    return {
+        'similarity': similarity,
+        'target_word_count': len(target_words),
+        'user_word_count': len(user_words),
+        'missing_words': missing_words,
+        'extra_words': extra_words,
+        'substituted_words': substituted_words,
+    }
+
+
 def calculate_similarity(text1, text2):
     """Calculate similarity between two texts"""
-    text1 = text1.lower().strip()
-    text2 = text2.lower().strip()
-    similarity = SequenceMatcher(None, text1, text2).ratio()
-    return similarity
+    return align_texts(text1, text2)['similarity']
 
-def get_pronunciation_score(user_text, target_text):
-    """Calculate pronunciation score based on similarity"""
-    similarity = calculate_similarity(user_text, target_text)
+
+def score_from_similarity(similarity):
+    """Turn a similarity into (score, level, feedback)"""
     score = int(similarity * 100)
     
     if score >= 90:
@@ -39,21 +408,22 @@ def get_pronunciation_score(user_text, target_text):
     
     return score, level, feedback
 
-def get_specific_feedback(user_text, target_text):
+
+def get_pronunciation_score(user_text, target_text, alignment=None):
+    """Calculate pronunciation score based on similarity"""
+    if alignment is None:
+        alignment = align_texts(user_text, target_text)
+    return score_from_similarity(alignment['similarity'])
+
+
+def get_specific_feedback(user_text, target_text, alignment=None):
     """Get specific feedback on what was different"""
-    user_words = user_text.lower().split()
-    target_words = target_text.lower().split()
+    if alignment is None:
+        alignment = align_texts(user_text, target_text)
     
-    missing_words = []
-    extra_words = []
-    
-    for word in target_words:
-        if word not in user_words:
-            missing_words.append(word)
-    
-    for word in user_words:
-        if word not in target_words:
-            extra_words.append(word)
+    missing_words = [item['word'] for item in alignment['missing_words']]
+    extra_words = [item['word'] for item in alignment['extra_words']]
+    substituted_words = alignment['substituted_words']
     
     specific_feedback = []
     
@@ -63,11 +433,15 @@ def get_specific_feedback(user_text, target_text):
     if extra_words:
         specific_feedback.append(f"Extra words: {', '.join(extra_words[:5])}")
     
-    if not missing_words and not extra_words:
+    if substituted_words:
+        pairs = [f"'{item['said']}' instead of '{item['expected']}'" for item in substituted_words[:5]]
+        specific_feedback.append(f"Said {', '.join(pairs)}")
+    
+    if not missing_words and not extra_words and not substituted_words:
         specific_feedback.append("Word choice is accurate!")
     
     # Additional feedback based on score
-    similarity = calculate_similarity(user_text, target_text)
+    similarity = alignment['similarity']
     if similarity < 0.5:
         specific_feedback.append("Try to speak more of the sentence next time.")
     elif similarity >= 0.9:
@@ -75,89 +449,575 @@ def get_specific_feedback(user_text, target_text):
     
     return specific_feedback
 
+def score_texts(user_text, target_text):
+    """Score one recognized text against its target (the JSON body of a scoring response)"""
+    alignment = align_texts(user_text, target_text)
+    similarity = alignment['similarity']
+    score, level, feedback = get_pronunciation_score(user_text, target_text, alignment)
+    specific_feedback = get_specific_feedback(user_text, target_text, alignment)
+    
+    return {
+        'success': True,
+        'user_text': user_text,
+        'target_text': target_text,
+        'score': score,
+        'level': level,
+        'feedback': feedback,
+        'specific_feedback': specific_feedback,
+        'similarity': similarity,
+        'missing_words': alignment['missing_words'],
+        'extra_words': alignment['extra_words'],
+        'substituted_words': alignment['substituted_words'],
+    }
+
+
+def _score_pair(pair):
+    """Process-pool entry point: (target_text, user_text) -> result"""
+    target_text, user_text = pair
+    return score_texts(user_text, target_text)
+
+
+def init_scoring_pool():
+    """
+    Create the batch scoring process pool
+    
+    Call once at startup, before the server starts its request threads: forking
+    workers from a process that already has running threads can copy held locks.
+    Without a pool, batches are scored in-process.
+    """
+    global _scoring_pool
+    with _scoring_pool_lock:
+        if _scoring_pool is None and SCORING_WORKERS > 1:
+            _scoring_pool = ProcessPoolExecutor(max_workers=SCORING_WORKERS)
+            # Start the workers now rather than on the first batch
+            _scoring_pool.submit(int).result()
+        return _scoring_pool
+
+
+def get_scoring_pool():
+    """The pool created by init_scoring_pool(), or None"""
+    return _scoring_pool
+
+
+class AudioUpload:
+    """
+    Upload buffer that checks the size cap and hashes the audio while it streams in
+    
+    Wraps a SpooledTemporaryFile: small recordings never touch the disk, larger ones
+    spill to a temp file once they pass AUDIO_SPOOL_MAX_MEMORY.
+    """
+    
+    def __init__(self, max_bytes=AUDIO_MAX_BYTES, spool_bytes=AUDIO_SPOOL_MAX_MEMORY):
+        self._file = tempfile.SpooledTemporaryFile(max_size=spool_bytes, mode='w+b')
+        self._sha256 = hashlib.sha256()
+        self.max_bytes = max_bytes
+        self.size = 0
+    
+    def write(self, data):
+        self.size += len(data)
+        if self.size > self.max_bytes:
+            raise RequestEntityTooLarge(f'Audio upload is larger than {self.max_bytes} bytes')
+        self._sha256.update(data)
+        return self._file.write(data)
+    
+    def hexdigest(self):
+        return self._sha256.hexdigest()
+    
+    @property
+    def spilled(self):
+        """True once the buffer has rolled over to a file on disk"""
+        return self._file is not None and getattr(self._file, '_rolled', False)
+    
+    def detach(self):
+        """Hand the underlying buffer to someone else (request teardown won't close it)"""
+        buffer, self._file = self._file, None
+        buffer.seek(0)
+        return buffer
+    
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+    
+    def __getattr__(self, name):
+        return getattr(self._file, name)
+
+
+class AudioRequest(Request):
+    """Request class that streams uploaded files into AudioUpload buffers"""
+    
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        # Reject up front when the part announces its size
+        if content_length and content_length > AUDIO_MAX_BYTES:
+            raise RequestEntityTooLarge(f'Audio upload is larger than {AUDIO_MAX_BYTES} bytes')
+        return AudioUpload(max_bytes=AUDIO_MAX_BYTES, spool_bytes=AUDIO_SPOOL_MAX_MEMORY)
+
+
+app.request_class = AudioRequest
+
+
+class AudioArchiver:
+    """
+    Background writer for recordings that should be kept
+    
+    Files are named by content hash, so re-uploads of the same recording are written once.
+    When the queue is full, recordings are dropped rather than slowing down requests.
+    """
+    
+    def __init__(self, archive_dir, max_queue=64):
+        self.archive_dir = archive_dir
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._thread = None
+        self._lock = threading.Lock()
+        
+        # Stats
+        self.archived = 0
+        self.deduplicated = 0
+        self.dropped = 0
+        self.failed = 0
+        self.last_error = None
+    
+    def submit(self, buffer, sha256):
+        """Queue a detached buffer for archiving; returns False if it was dropped"""
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='audio-archiver', daemon=True)
+                self._thread.start()
+        try:
+            self._queue.put_nowait((buffer, sha256))
+            return True
+        except queue.Full:
+            buffer.close()
+            with self._lock:
+                self.dropped += 1
+            return False
+    
+    def stats(self):
+        with self._lock:
+            return {
+                'enabled': True,
+                'depth': self._queue.qsize(),
+                'archived': self.archived,
+                'deduplicated': self.deduplicated,
+                'dropped': self.dropped,
+                'failed': self.failed,
+                'last_error': self.last_error,
+            }
+    
+    def _run(self):
+        while True:
+            buffer, sha256 = self._queue.get()
+            try:
+                self._write(buffer, sha256)
+            except Exception as e:
+                with self._lock:
+                    self.failed += 1
+                    self.last_error = str(e)
+            finally:
+                buffer.close()
+                self._queue.task_done()
+    
+    def _write(self, buffer, sha256):
+        path = os.path.join(self.archive_dir, f'{sha256}.webm')
+        if os.path.exists(path):
+            with self._lock:
+                self.deduplicated += 1
+            return
+        
+        os.makedirs(self.archive_dir, exist_ok=True)
+        temp_path = f'{path}.{threading.get_ident()}.tmp'
+        with open(temp_path, 'wb') as f:
+            while True:
+                chunk = buffer.read(64 * 1024)
+                if not chunk:
+                    break
+                f.write(chunk)
+        os.replace(temp_path, path)
+        with self._lock:
+            self.archived += 1
+
+
+_audio_archiver = AudioArchiver(AUDIO_ARCHIVE_DIR, AUDIO_ARCHIVE_QUEUE) if AUDIO_ARCHIVE_DIR else None
+
+
+def _parse_batch_item(item):
+    """Accept {"target_text": ..., "user_text": ...} or [target_text, user_text]"""
+    if isinstance(item, dict):
+        return item.get('target_text', ''), item.get('user_text', '')
+    if isinstance(item, (list, tuple)) and len(item) == 2:
+        return item[0], item[1]
+    return None, None
+
+
 @app.route('/api/score-pronunciation', methods=['POST'])
 def score_pronunciation():
     """
     API endpoint to score pronunciation
     """
-    temp_audio_path = None  # ✅ 添加这个
-    
+    started = time.perf_counter()
     try:
-        target_text = request.form.get('target_text', '')
-        user_text = request.form.get('user_text', '')
+        # Reading the form parses (and streams in) the whole multipart body
+        with _STAGE_PARSE.time():
+            target_text = request.form.get('target_text', '')
+            user_text = request.form.get('user_text', '')
+            files = request.files
         
         if not target_text:
+            _REQUESTS_BAD_REQUEST.inc()
             return jsonify({'error': 'No target text provided'}), 400
         
         if not user_text:
+            _REQUESTS_BAD_REQUEST.inc()
             return jsonify({'error': 'No recognized text provided'}), 400
         
-        # Optional: Save audio file if provided
-        if 'audio' in request.files:
-            audio_file = request.files['audio']
-            
-            # ✅ 修改这部分：不立即删除，延迟删除
-            with tempfile.NamedTemporaryFile(delete=False, suffix='.webm') as temp_audio:
-                audio_file.save(temp_audio.name)
-                temp_audio_path = temp_audio.name
-                audio_size = os.path.getsize(temp_audio_path)
-                print(f"📁 Audio saved: {audio_size} bytes")
+        # Optional: audio was size-checked and hashed while the upload streamed in
+        audio_info = None
+        if 'audio' in files:
+            audio_started = time.perf_counter()
+            upload = files['audio'].stream
+            if not upload.size:
+                _REQUESTS_BAD_REQUEST.inc()
+                return jsonify({'error': 'No audio data provided'}), 400
+            audio_info = {
+                'size': upload.size,
+                'sha256': upload.hexdigest(),
+                'archived': False,
+            }
+            if _audio_archiver is not None:
+                audio_info['archived'] = _audio_archiver.submit(upload.detach(), audio_info['sha256'])
+            AUDIO_BYTES.inc(upload.size)
+            _STAGE_AUDIO.observe(time.perf_counter() - audio_started)
+        
+        logger.debug("🎯 Target: %s | 🗣️  User said: %s", target_text, user_text)
+        
+        # Calculate score (one alignment pass feeds score and feedback)
+        with _STAGE_SCORE.time():
+            result = score_texts(user_text, target_text)
+        if audio_info is not None:
+            result['audio'] = audio_info
+        
+        logger.info(
+            "📊 Score: %d/100 (%s)", result['score'], result['level'],
+            extra={'audio_bytes': audio_info['size'] if audio_info else 0}
+        )
+        
+        _REQUESTS_OK.inc()
+        return jsonify(result), 200
+    
+    except RequestEntityTooLarge as e:
+        _REQUESTS_TOO_LARGE.inc()
+        logger.warning("❌ Audio rejected: %s", e.description)
+        return jsonify({'error': e.description}), 413
+    
+    except Exception as e:
+        _REQUESTS_ERROR.inc()
+        logger.exception("❌ Error: %s", e)
+        return jsonify({'error': f'Server error: {str(e)}'}), 500
+    
+    finally:
+        _STAGE_TOTAL.observe(time.perf_counter() - started)
+
+@app.route('/api/score-pronunciation/batch', methods=['POST'])
+def score_pronunciation_batch():
+    """
+    Score many (target_text, user_text) pairs in one request,
+    e.g. a whole speaking exercise or a teacher re-grading a class
+    
+    Request (JSON): either a bare array or {"items": [...]}, where each item is
+        {"target_text": "...", "user_text": "..."}  or  ["target text", "user text"]
+    
+    Response: {"success": true, "results": [...]} with one result per item, in order.
+    Invalid items get {"success": false, "error": ...} without failing the batch.
+    """
+    try:
+        data = request.get_json(silent=True)
+        items = data.get('items') if isinstance(data, dict) else data
+        
+        if not isinstance(items, list) or not items:
+            return jsonify({'error': 'Expected a non-empty JSON array of items'}), 400
+        
+        if len(items) > BATCH_MAX_ITEMS:
+            return jsonify({'error': f'Too many items (max {BATCH_MAX_ITEMS})'}), 413
+        
+        results = [None] * len(items)
+        pairs = []
+        positions = []
+        for position, item in enumerate(items):
+            target_text, user_text = _parse_batch_item(item)
+            if not isinstance(target_text, str) or not target_text:
+                results[position] = {'success': False, 'error': 'No target text provided'}
+            elif not isinstance(user_text, str) or not user_text:
+                results[position] = {'success': False, 'error': 'No recognized text provided'}
+            else:
+                pairs.append((target_text, user_text))
+                positions.append(position)
+        
+        # Small batches are cheaper in-process than shipping them to workers
+        total_chars = sum(len(target) + len(user) for target, user in pairs)
+        parallel = (
+            SCORING_WORKERS > 1
+            and len(pairs) > 1
+            and (len(pairs) >= BATCH_PARALLEL_MIN_ITEMS or total_chars >= BATCH_PARALLEL_MIN_CHARS)
+        )
         
-        print(f"🎯 Target: {target_text}")
-        print(f"🗣️  User said: {user_text}")
+        pool = get_scoring_pool()
+        parallel = parallel and pool is not None
         
-        # Calculate score
-        score, level, feedback = get_pronunciation_score(user_text, target_text)
-        specific_feedback = get_specific_feedback(user_text, target_text)
-        similarity = calculate_similarity(user_text, target_text)
+        batch_started = time.perf_counter()
+        if parallel:
+            chunksize = max(1, len(pairs) // (SCORING_WORKERS * 4))
+            scored = pool.map(_score_pair, pairs, chunksize=chunksize)
+        else:
+            scored = map(_score_pair, pairs)
         
-        print(f"📊 Score: {score}/100 ({level})")
+        for position, result in zip(positions, scored):
+            results[position] = result
+        _STAGE_BATCH.observe(time.perf_counter() - batch_started)
+        (_BATCH_PROCESS_POOL if parallel else _BATCH_IN_PROCESS).inc(len(pairs))
+        
+        logger.info("📊 Scored batch of %d items (%s)", len(items), 'process pool' if parallel else 'in-process')
         
         return jsonify({
             'success': True,
-            'user_text': user_text,
-            'target_text': target_text,
-            'score': score,
-            'level': level,
-            'feedback': feedback,
-            'specific_feedback': specific_feedback,
-            'similarity': similarity,
+            'count': len(results),
+            'parallel': parallel,
+            'results': results,
         }), 200
     
     except Exception as e:
-        print(f"❌ Error: {str(e)}")
+        logger.exception("❌ Error: %s", e)
         return jsonify({'error': f'Server error: {str(e)}'}), 500
-    
-    finally:
-        # ✅ 添加延迟删除
-        if temp_audio_path and os.path.exists(temp_audio_path):
-            try:
-                import time
-                time.sleep(0.1)  # 等待100毫秒
-                os.remove(temp_audio_path)
-                print("🗑️  Temp file cleaned up")
-            except Exception as e:
-                print(f"⚠️  Could not delete temp file: {e}")
-                # 不要让这个错误影响响应
-                pass
+
+def _target_cache_lookups():
+    info = _target_cache.info()
+    return {('hit',): info['hits'], ('miss',): info['misses']}
+
+
+metrics.GaugeFunction(
+    'smartlearning_target_cache_lookups',
+    'Prepared target sentence cache lookups',
+    _target_cache_lookups,
+    ['result']
+)
+metrics.GaugeFunction(
+    'smartlearning_target_cache_bytes',
+    'Approximate memory held by prepared target sentences',
+    lambda: _target_cache.info()['approx_bytes']
+)
+
+
+@app.route('/api/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Latency histograms and counters in Prometheus text format"""
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
 
 @app.route('/api/health', methods=['GET'])
 def health_check():
     """Health check endpoint"""
     return jsonify({
         'status': 'healthy',
+        'target_cache': _target_cache.info(),
+        'logging': logging_setup.log_stats(),
+        'audio_archive': _audio_archiver.stats() if _audio_archiver is not None else {'enabled': False},
         'message': 'Speech pronunciation API is running',
         'mode': 'text_comparison',
         'features': {
             'audio_upload': True,
             'text_comparison': True,
             'scoring': True,
+            'batch_scoring': True,
             'speech_recognition': 'browser_based'
         },
         'note': 'Using browser Web Speech API for recognition, Python for scoring'
     }), 200
 
-if __name__ == '__main__':
+# ========================================
+# Tests (python app.py test)
+# ========================================
+
+def test_alignment_positions():
+    """Missing / extra / substituted words carry target (missing, substituted) or user (extra) positions"""
+    alignment = align_texts('I like eat red apples now', 'I like to eat green apples')
+    
+    assert alignment['missing_words'] == [{'word': 'to', 'position': 2}]
+    assert alignment['substituted_words'] == [{'expected': 'green', 'said': 'red', 'position': 4}]
+    assert alignment['extra_words'] == [{'word': 'now', 'position': 5}]
+    assert alignment['target_word_count'] == 6 and alignment['user_word_count'] == 6
+    
+    # Character-weighted: 14 matching characters, plus 're' shared by 'red' and 'green',
+    # over 21 target + 20 said characters
+    assert abs(alignment['similarity'] - 2 * 16 / 41) < 1e-9
+    
+    result = score_texts('I like eat red apples now', 'I like to eat green apples')
+    assert result['score'] == int(alignment['similarity'] * 100)
+    assert result['missing_words'] == alignment['missing_words']
+    assert any(line.startswith('Missing words: to') for line in result['specific_feedback'])
+    print("✅ Alignment reports substituted / missing / extra words at their positions")
+
+
+def test_punctuation_and_empty_text():
+    """Punctuation and case are ignored; empty or punctuation-only input doesn't break scoring"""
+    assert normalize_words("Hello, World! It's fine.") == ['hello', 'world', "it's", 'fine']
+    
+    result = score_texts('hello world', 'Hello, world!')
+    assert result['similarity'] == 1.0 and result['score'] == 100
+    assert result['specific_feedback'][0] == 'Word choice is accurate!'
+    
+    # Both sides punctuation only: nothing to compare, nothing wrong
+    alignment = align_texts('...', '!!!')
+    assert alignment['similarity'] == 1.0
+    assert alignment['target_word_count'] == 0 and alignment['user_word_count'] == 0
+    
+    # Punctuation-only target, user said something: all extra
+    alignment = align_texts('hello there', '?!')
+    assert alignment['similarity'] == 0.0
+    assert [item['word'] for item in alignment['extra_words']] == ['hello', 'there']
+    
+    # No user words: every target word is missing
+    result = score_texts('', 'Good morning, everyone.')
+    assert result['similarity'] == 0.0 and result['score'] == 0 and result['level'] == 'poor'
+    assert result['missing_words'] == [
+        {'word': 'good', 'position': 0}, {'word': 'morning', 'position': 1}, {'word': 'everyone', 'position': 2}
+    ]
+    assert result['extra_words'] == [] and result['substituted_words'] == []
+    print("✅ Punctuation-only and empty texts score without errors")
+
+
+def test_disjoint_fast_path():
+    """With no word in common the pairwise fast path is an optimal edit alignment"""
+    import random
+    
+    rng = random.Random(0)
+    vocabulary = [f'w{i}' for i in range(50)]
+    for _ in range(200):
+        words = rng.sample(vocabulary, rng.randint(0, 20))
+        split = rng.randint(0, len(words))
+        target_words, user_words = words[:split], words[split:]
+        
+        fast = _disjoint_alignment(len(target_words), len(user_words))
+        full = _edit_alignment(target_words, user_words)
+        
+        # Same edit cost and the same number of each operation
+        assert Counter(op for op, _, _ in fast) == Counter(op for op, _, _ in full)
+        if len(target_words) == len(user_words):
+            assert fast == full
+        
+        # align_texts takes the fast path here and reports the same counts
+        alignment = align_texts(' '.join(user_words), ' '.join(target_words))
+        counts = Counter(op for op, _, _ in full)
+        assert len(alignment['substituted_words']) == counts['substitute']
+        assert len(alignment['missing_words']) == counts['missing']
+        assert len(alignment['extra_words']) == counts['extra']
+    print("✅ Disjoint fast path matches the full edit alignment")
+
+
+def test_batch_scoring():
+    """Batch endpoint: one result per item in order, bad items fail alone, bad payloads get 400"""
+    global BATCH_PARALLEL_MIN_ITEMS
+    client = app.test_client()
+    items = [
+        {'target_text': 'I like apples', 'user_text': 'I like apples'},
+        ['Good morning', 'good evening'],
+        {'target_text': '', 'user_text': 'hello'},
+        {'target_text': 'hello', 'user_text': ''},
+        'not an item',
+    ]
+    
+    def check(response):
+        assert response.status_code == 200
+        data = response.get_json()
+        assert data['success'] and data['count'] == len(items)
+        results = data['results']
+        assert results[0]['score'] == 100
+        assert results[1] == score_texts('good evening', 'Good morning')
+        assert results[2] == {'success': False, 'error': 'No target text provided'}
+        assert results[3] == {'success': False, 'error': 'No recognized text provided'}
+        assert results[4] == {'success': False, 'error': 'No target text provided'}
+        return data
+    
+    # In-process (small batch), bare array and {"items": [...]} forms
+    assert check(client.post('/api/score-pronunciation/batch', json=items))['parallel'] is False
+    check(client.post('/api/score-pronunciation/batch', json={'items': items}))
+    
+    # Same results through the process pool
+    saved = BATCH_PARALLEL_MIN_ITEMS
+    BATCH_PARALLEL_MIN_ITEMS = 2
+    try:
+        parallel = check(client.post('/api/score-pronunciation/batch', json=items))['parallel']
+        assert parallel is (init_scoring_pool() is not None)
+    finally:
+        BATCH_PARALLEL_MIN_ITEMS = saved
+    
+    # Error path: the whole request is rejected
+    for payload in ([], {'items': []}, {'items': 'nope'}, None):
+        response = client.post('/api/score-pronunciation/batch', json=payload)
+        assert response.status_code == 400, payload
+    response = client.post('/api/score-pronunciation/batch', data='not json', content_type='application/json')
+    assert response.status_code == 400
+    response = client.post('/api/score-pronunciation/batch', json=[items[0]] * (BATCH_MAX_ITEMS + 1))
+    assert response.status_code == 413
+    print("✅ Batch scoring returns per-item results and rejects bad payloads")
+
+
+def test_audio_upload():
+    """Audio parts: size cap -> 413, empty part -> 400, large uploads spill to disk"""
+    global AUDIO_MAX_BYTES, AUDIO_SPOOL_MAX_MEMORY
+    from io import BytesIO
+    
+    client = app.test_client()
+    
+    def form(audio=None):
+        data = {'target_text': 'I like apples', 'user_text': 'I like apples'}
+        if audio is not None:
+            data['audio'] = (BytesIO(audio), 'recording.webm')
+        return data
+    
+    saved = AUDIO_MAX_BYTES, AUDIO_SPOOL_MAX_MEMORY
+    AUDIO_MAX_BYTES, AUDIO_SPOOL_MAX_MEMORY = 4096, 1024
+    try:
+        # Within the cap: size and hash are reported
+        audio = b'\x1a\x45\xdf\xa3' * 256
+        response = client.post('/api/score-pronunciation', data=form(audio))
+        assert response.status_code == 200
+        assert response.get_json()['audio'] == {
+            'size': len(audio), 'sha256': hashlib.sha256(audio).hexdigest(), 'archived': False,
+        }
+        
+        # Audio is optional, but an audio part without data is a bad request
+        response = client.post('/api/score-pronunciation', data=form())
+        assert response.status_code == 200 and 'audio' not in response.get_json()
+        response = client.post('/api/score-pronunciation', data=form(b''))
+        assert response.status_code == 400
+        assert response.get_json()['error'] == 'No audio data provided'
+        
+        # One byte over the cap is rejected while it streams in
+        response = client.post('/api/score-pronunciation', data=form(b'x' * 4097))
+        assert response.status_code == 413
+        
+        # Small uploads stay in memory, larger ones roll over to a temp file
+        for size, spilled in ((512, False), (2048, True)):
+            with app.test_request_context('/api/score-pronunciation', method='POST', data=form(b'x' * size)):
+                upload = request.files['audio'].stream
+                assert isinstance(upload, AudioUpload)
+                assert upload.spilled is spilled and upload.size == size
+                if spilled:
+                    assert os.fstat(upload.fileno()).st_size == size
+    finally:
+        AUDIO_MAX_BYTES, AUDIO_SPOOL_MAX_MEMORY = saved
+    print("✅ Audio uploads are capped, validated and spooled to disk only above the threshold")
+
+
+if __name__ == '__main__' and sys.argv[1:] == ['test']:
+    init_scoring_pool()
+    test_alignment_positions()
+    test_punctuation_and_empty_text()
+    test_disjoint_fast_path()
+    test_batch_scoring()
+    test_audio_upload()
+
+elif __name__ == '__main__':
+    # Logs go through a queue to a background thread, so requests never wait on stdout
+    logging_setup.setup_logging()
+    
     print("=" * 70)
     print("🎤 Speech Pronunciation Scoring API")
     print("=" * 70)
@@ -193,4 +1053,12 @@ if __name__ == '__main__':
     print("=" * 70)
     print()
     
+    # Prepare the lesson target sentences before the first student arrives
+    if TARGET_PREWARM:
+        print(f"🔥 Prewarmed {prewarm_targets()} target sentences")
+        print()
+    
+    # Fork the scoring workers while this is still the only thread
+    init_scoring_pool()
+    
     app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
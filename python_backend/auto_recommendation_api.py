@@ -6,10 +6,17 @@
 from flask import Flask, request, jsonify
 from flask_cors import CORS
 from dotenv import load_dotenv
+import logging
 import os
 import pandas as pd
+import prefork  # 必须在 firebase_admin 之前导入：PREFORK_WORKERS > 0 时设置 gRPC 的 fork 支持
 from firebase_admin import initialize_app, firestore, credentials
-from SOLUTION_1_ContentBased import ContentBasedRecommender
+from SOLUTION_1_ContentBased import (
+    ContentBasedRecommender, drop_duplicate_ids, filters_from_request, get_user_documents, profile_fingerprint
+)
+import logging_setup
+
+logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 CORS(app)  # 允许前端调用
@@ -41,7 +48,7 @@ def init_firebase():
     
     cred = credentials.Certificate(firebase_config)
     initialize_app(cred)
-    print("✅ Firebase initialized")
+    logger.info("✅ Firebase initialized")
     return firestore.client()
 
 
@@ -53,7 +60,7 @@ def load_content_and_train(db):
     """加载内容并训练推荐模型"""
     global _content_df, _recommender, _last_updated
     
-    print("🔄 Loading content and training model...")
+    logger.info("🔄 Loading content and training model...")
     
     content_list = []
     
@@ -86,14 +93,14 @@ def load_content_and_train(db):
             'route': f"/modules/{data.get('category', 'general')}/video/{doc.id}"
         })
     
-    _content_df = pd.DataFrame(content_list)
+    _content_df = drop_duplicate_ids(pd.DataFrame(content_list))
     
-    # 训练模型
-    _recommender = ContentBasedRecommender()
-    _recommender.fit(_content_df)
-    _last_updated = pd.Timestamp.now()
+    # 训练模型（训练完再发布，请求不会拿到还没 fit 的模型）
+    recommender = ContentBasedRecommender()
+    recommender.fit(_content_df)
+    _recommender, _last_updated = recommender, pd.Timestamp.now()
     
-    print(f"✅ Loaded {len(_content_df)} items and trained model")
+    logger.info("✅ Loaded %d items and trained model", len(_content_df))
 
 
 # ========================================
@@ -107,13 +114,22 @@ def generate_recommendations():
     
     Request:
     {
-        "userId": "abc123"
+        "userId": "abc123",
+        "filters": {                     // optional
+            "type": "video",             // or ["lesson", "video"]
+            "category": ["grammar"],
+            "levelMin": "A2",
+            "levelMax": "B1",
+            "includeIds": ["..."],
+            "excludeIds": ["..."]
+        }
     }
     
     Response:
     {
         "success": true,
         "recommendations": 10,
+        "cached": false,                 // true：输入没变，没有重新计算和写入
         "message": "Recommendations generated successfully"
     }
     """
@@ -127,14 +143,31 @@ def generate_recommendations():
                 'error': 'userId is required'
             }), 400
         
-        print(f"\n🎯 Generating recommendations for user: {user_id}")
+        # 可选过滤条件（类型 / 模块 / Level 范围 / 指定或排除 id）
+        try:
+            filters = filters_from_request(data.get('filters'))
+        except ValueError as e:
+            return jsonify({
+                'success': False,
+                'error': str(e)
+            }), 400
+        
+        # 模型还没加载：先返回 503，不读 Firestore
+        recommender, last_updated = _recommender, _last_updated
+        if recommender is None or last_updated is None:
+            return jsonify({
+                'success': False,
+                'error': 'Recommendation model not loaded'
+            }), 503
+        
+        logger.debug("🎯 Generating recommendations for user: %s", user_id)
         
         # 获取 Firestore 客户端
         db = firestore.client()
         
-        # 获取用户数据
-        user_doc = db.collection('users').document(user_id).get()
-        if not user_doc.exists:
+        # 用户数据、进度和已保存的推荐一起读取
+        user_doc, progress_doc, saved_doc = get_user_documents(db, user_id)
+        if user_doc is None or not user_doc.exists:
             return jsonify({
                 'success': False,
                 'error': 'User not found'
@@ -144,35 +177,47 @@ def generate_recommendations():
         user_level = user_data.get('quizLevel', 'A1')
         learning_goals = user_data.get('learningGoals', [])
         
-        # 获取用户进度
-        progress_doc = db.collection('userProgress').document(user_id).get()
+        # 用户进度
         completed_lessons = []
-        if progress_doc.exists:
+        if progress_doc is not None and progress_doc.exists:
             progress_data = progress_doc.to_dict()
             completed_lessons = progress_data.get('completedLessons', [])
         
+        # Level、目标、完成列表、过滤条件和模型都没变 → 直接用已保存的推荐
+        fingerprint = profile_fingerprint(
+            user_level, learning_goals, completed_lessons, last_updated.isoformat(), filters
+        )
+        saved = saved_doc.to_dict() if saved_doc is not None and saved_doc.exists else None
+        if saved and saved.get('fingerprint') == fingerprint:
+            logger.debug("✅ Recommendations for %s unchanged", user_id, extra={'user_id': user_id})
+            return jsonify({
+                'success': True,
+                'recommendations': saved.get('totalRecommendations', 0),
+                'cached': True,
+                'message': 'Recommendations unchanged'
+            })
+        
         # 生成推荐
-        recommendations = _recommender.recommend(
+        recommendations = recommender.recommend(
             user_level=user_level,
             learning_goals=learning_goals,
             completed_lessons=completed_lessons,
-            n=10
+            n=10,
+            filters=filters
         )
         
-        # 转换为列表
+        # 转换为列表（推荐结果已包含完整记录）
         recs_list = []
-        for _, row in recommendations.iterrows():
-            content_info = _content_df[_content_df['id'] == row['id']].iloc[0]
-            
+        for rec in recommendations.to_dict('records'):
             recs_list.append({
-                'id': row['id'],
-                'title': row['title'],
-                'category': row['category'],
-                'level': row['level'],
-                'score': float(row['score']),
-                'description': content_info.get('description', ''),
-                'type': content_info.get('type', 'lesson'),
-                'route': content_info.get('route', f"/modules/{row['category'].lower()}/lesson/{row['id']}")
+                'id': rec['id'],
+                'title': rec['title'],
+                'category': rec['category'],
+                'level': rec['level'],
+                'score': float(rec['score']),
+                'description': rec.get('description') or '',
+                'type': rec.get('type') or 'lesson',
+                'route': rec.get('route') or f"/modules/{rec['category'].lower()}/lesson/{rec['id']}"
             })
         
         # 保存到 Firebase
@@ -181,24 +226,25 @@ def generate_recommendations():
             'recommendations': recs_list,
             'userLevel': user_level,
             'learningGoals': learning_goals,
+            'filters': data.get('filters') or None,
+            'fingerprint': fingerprint,
             'generatedAt': firestore.SERVER_TIMESTAMP,
             'totalRecommendations': len(recs_list)
         }
         
         db.collection('recommendations').document(user_id).set(recommendation_data)
         
-        print(f"✅ Generated {len(recs_list)} recommendations for {user_id}")
+        logger.info("✅ Generated %d recommendations for %s", len(recs_list), user_id, extra={'user_id': user_id})
         
         return jsonify({
             'success': True,
             'recommendations': len(recs_list),
+            'cached': False,
             'message': 'Recommendations generated successfully'
         })
         
     except Exception as e:
-        print(f"❌ Error: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("❌ Error generating recommendations: %s", e)
         
         return jsonify({
             'success': False,
@@ -215,7 +261,16 @@ def reload_content():
     """
     重新加载内容和训练模型
     当添加新课程时调用
+    prefork 模式下由主进程重新训练，并用新模型换掉全部 worker
     """
+    if prefork.is_worker():
+        prefork.request_reload()
+        return jsonify({
+            'success': True,
+            'message': 'Reload requested from the master process',
+            'generation': prefork.info()['generation']
+        }), 202
+    
     try:
         db = firestore.client()
         load_content_and_train(db)
@@ -244,7 +299,10 @@ def health():
         'status': 'healthy',
         'model_loaded': _recommender is not None,
         'total_content': len(_content_df) if _content_df is not None else 0,
-        'last_updated': _last_updated.isoformat() if _last_updated else None
+        'last_updated': _last_updated.isoformat() if _last_updated else None,
+        'ranking_cache': _recommender.cache_info() if _recommender is not None else None,
+        'server': prefork.info(),
+        'logging': logging_setup.log_stats()
     })
 
 
@@ -253,6 +311,9 @@ def health():
 # ========================================
 
 if __name__ == '__main__':
+    # 日志经队列由后台线程输出，请求线程不阻塞在 stdout 上
+    logging_setup.setup_logging()
+    
     print("="*60)
     print("🚀 Starting Auto-Recommendation API Server")
     print("="*60)
@@ -260,8 +321,9 @@ if __name__ == '__main__':
     # 初始化 Firebase
     db = init_firebase()
     
-    # 加载内容和训练模型
-    load_content_and_train(db)
+    # 加载内容和训练模型（prefork 模式下由 PreforkServer 在主进程里调用）
+    if not prefork.PREFORK_WORKERS:
+        load_content_and_train(db)
     
     print("\n" + "="*60)
     print("📍 API Endpoints:")
@@ -269,9 +331,20 @@ if __name__ == '__main__':
     print("   POST /api/reload-content            - Reload Content")
     print("   GET  /api/health                    - Health Check")
     print("="*60)
-    print("✅ Server ready! Listening on http://localhost:8080")
-    print("="*60)
-    print()
     
-    # 启动服务器
-    app.run(debug=True, port=5000, host='0.0.0.0')
\ No newline at end of file
+    if prefork.PREFORK_WORKERS:
+        # 生产模式：主进程训练一次，fork 出的 worker 以写时复制共享模型；kill -HUP <主进程> 重新加载
+        print(f"✅ Master {os.getpid()} starting {prefork.PREFORK_WORKERS} workers on http://localhost:5000")
+        print("="*60)
+        print()
+        prefork.PreforkServer(
+            app, lambda: load_content_and_train(firestore.client()),
+            port=5000, workers=prefork.PREFORK_WORKERS, on_worker_exit=[logging_setup.stop_logging]
+        ).serve_forever()
+    else:
+        print("✅ Server ready! Listening on http://localhost:8080")
+        print("="*60)
+        print()
+        
+        # 启动服务器
+        app.run(debug=True, port=5000, host='0.0.0.0')
\ No newline at end of file
@@ -0,0 +1,126 @@
+"""
+ANN mode benchmark: recall@k and latency against the exact ranking
+
+Fits ContentBasedRecommender with the ANN index on synthetic catalogs (same
+generators as bench_recommender.py), then for a range of n_probes measures
+- recall@k: share of the ANN top-k whose score reaches the exact k-th score
+  (items tied with the exact k-th item count as hits)
+- cold recommend() latency with the index, against the exact full scan
+
+Usage:
+    python benchmarks/bench_ann.py [--sizes 10000,100000] [--probes 16,32,64,128,256]
+        [--queries 300] [--k 10] [--output bench_ann.json]
+"""
+
+import argparse
+import datetime
+import json
+import os
+import sys
+import time
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARK_DIR))
+sys.path.insert(0, BENCHMARK_DIR)
+
+import numpy as np  # noqa: E402
+
+from bench_recommender import environment, git_commit, make_catalog, make_profiles, percentiles  # noqa: E402
+from SOLUTION_1_ContentBased import ContentBasedRecommender, LEVEL_MAP  # noqa: E402
+
+
+def cold_latency(recommender, profiles, k):
+    timings = []
+    for profile in profiles:
+        recommender.ranking_cache.clear()
+        started = time.perf_counter()
+        recommender.recommend(profile['user_level'], profile['learning_goals'], n=k)
+        timings.append((time.perf_counter() - started) * 1000)
+    return percentiles(timings)
+
+
+def run_size(size, probes, queries, k, seed):
+    catalog = make_catalog(size, seed)
+    profiles = make_profiles(catalog, queries, seed + 1)
+
+    recommender = ContentBasedRecommender(ann_min_items=0)
+    started = time.perf_counter()
+    recommender.fit(catalog)
+    fit_seconds = time.perf_counter() - started
+    index = recommender.ann_index
+
+    # Exact k-th score per profile
+    kth_scores = []
+    for profile in profiles:
+        similarities = recommender._similarities(profile['user_level'], profile['learning_goals'])
+        _, scores = recommender._ranking(similarities, profile['user_level'], k)
+        kth_scores.append(scores[-1])
+
+    exact = recommender.clone()
+    exact.ann_index = None
+    result = {
+        'items': size,
+        'clusters': int(len(index.centroids)),
+        'fit_seconds': round(fit_seconds, 3),
+        'exact_ms': cold_latency(exact, profiles, k),
+        'probes': {},
+    }
+
+    for n_probes in probes:
+        index.n_probes = n_probes
+        hits, candidates = [], []
+        for profile, kth in zip(profiles, kth_scores):
+            rows, scores = recommender._ann_ranking(profile['user_level'], profile['learning_goals'], k)
+            hits.append(np.mean(scores[:k] >= kth - 1e-9) if len(scores) else 0.0)
+            probed = index.search(
+                recommender._query_vector(profile['user_level'], profile['learning_goals']),
+                LEVEL_MAP.get(profile['user_level'], 0)
+            )
+            candidates.append(0 if probed is None else len(probed))
+        result['probes'][str(n_probes)] = {
+            'recall_at_k': round(float(np.mean(hits)), 4),
+            'mean_candidates': round(float(np.mean(candidates)), 1),
+            'ann_ms': cold_latency(recommender, profiles, k),
+        }
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default='10000,100000', help='comma-separated catalog sizes')
+    parser.add_argument('--probes', default='16,32,64,128,256', help='comma-separated n_probes values')
+    parser.add_argument('--queries', type=int, default=300, help='learner profiles per size')
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='bench_ann.json')
+    args = parser.parse_args()
+
+    sizes = [int(size) for size in args.sizes.split(',') if size]
+    probes = [int(value) for value in args.probes.split(',') if value]
+
+    results = {
+        'benchmark': 'ann',
+        'created_at': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+        'commit': git_commit(),
+        'environment': environment(),
+        'settings': {'queries': args.queries, 'k': args.k, 'seed': args.seed},
+        'runs': [],
+    }
+
+    print(f"{'items':>9} {'clusters':>9} {'probes':>7} {'recall@' + str(args.k):>10} {'cands':>8} "
+          f"{'ann p50':>9} {'ann p99':>9} {'exact p50':>10}")
+    for size in sizes:
+        run = run_size(size, probes, args.queries, args.k, args.seed)
+        results['runs'].append(run)
+        for n_probes, stats in run['probes'].items():
+            print(f"{size:>9} {run['clusters']:>9} {n_probes:>7} {stats['recall_at_k']:>10.4f} "
+                  f"{stats['mean_candidates']:>8.0f} {stats['ann_ms']['p50']:>9.3f} "
+                  f"{stats['ann_ms']['p99']:>9.3f} {run['exact_ms']['p50']:>10.3f}")
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2)
+    print(f"\nResults written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,168 @@
+"""
+Compact model benchmark: memory footprint and ranking drift against float64
+
+Fits ContentBasedRecommender on synthetic catalogs (same generators as
+bench_recommender.py) once per compact mode (float64 / float32 / uint8) and reports
+- memory held by the fitted model: content matrix (data + indices + indptr + row
+  scales), catalog DataFrame, vectorizer, and everything fit() left allocated
+  (tracemalloc), also normalised per 100k items
+- cold recommend() latency
+- ranking drift against float64 for the same learners: top-k overlap, share of
+  identical top-k lists, tie-aware recall@k and the largest score difference
+
+Usage:
+    python benchmarks/bench_compact.py [--sizes 10000,100000] [--queries 300] [--k 10]
+        [--output bench_compact.json]
+"""
+
+import argparse
+import datetime
+import gc
+import json
+import os
+import pickle
+import sys
+import time
+import tracemalloc
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARK_DIR))
+sys.path.insert(0, BENCHMARK_DIR)
+
+import numpy as np  # noqa: E402
+
+from bench_recommender import environment, git_commit, make_catalog, make_profiles, percentiles  # noqa: E402
+from SOLUTION_1_ContentBased import COMPACT_MODES, ContentBasedRecommender  # noqa: E402
+
+
+def _mb(size):
+    return round(size / 2 ** 20, 2)
+
+
+def model_memory(recommender):
+    matrix = recommender.content_matrix
+    matrix_bytes = matrix.data.nbytes + matrix.indices.nbytes + matrix.indptr.nbytes
+    if recommender._row_scales is not None:
+        matrix_bytes += recommender._row_scales.nbytes
+    return {
+        'matrix_mb': _mb(matrix_bytes),
+        'matrix_dtype': str(matrix.dtype),
+        'index_dtype': str(matrix.indices.dtype),
+        'catalog_mb': _mb(recommender.content_df.memory_usage(deep=True).sum()),
+        'vectorizer_mb': _mb(len(pickle.dumps(recommender.vectorizer))),
+    }
+
+
+def fit_retained_mb(catalog, compact):
+    """Memory fit() leaves allocated (the model itself), measured with tracemalloc"""
+    gc.collect()
+    tracemalloc.start()
+    recommender = ContentBasedRecommender(compact=compact)
+    recommender.fit(catalog)
+    gc.collect()
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del recommender
+    return _mb(retained), _mb(peak)
+
+
+def run_size(size, queries, k, seed):
+    catalog = make_catalog(size, seed)
+    profiles = make_profiles(catalog, queries, seed + 1)
+
+    models, result = {}, {'items': size, 'modes': {}}
+    for compact in COMPACT_MODES:
+        name = compact or 'float64'
+        recommender = ContentBasedRecommender(compact=compact)
+        started = time.perf_counter()
+        recommender.fit(catalog)
+        fit_seconds = time.perf_counter() - started
+
+        timings = []
+        for profile in profiles:
+            recommender.ranking_cache.clear()
+            started = time.perf_counter()
+            recommender.recommend(profile['user_level'], profile['learning_goals'], n=k)
+            timings.append((time.perf_counter() - started) * 1000)
+
+        retained_mb, peak_mb = fit_retained_mb(catalog, compact)
+        memory = model_memory(recommender)
+        memory['retained_mb'] = retained_mb
+        memory['fit_peak_mb'] = peak_mb
+        memory['retained_mb_per_100k'] = round(retained_mb * 100_000 / size, 2)
+        result['modes'][name] = {
+            'fit_seconds': round(fit_seconds, 3),
+            'memory': memory,
+            'recommend_cold_ms': percentiles(timings),
+        }
+        models[name] = recommender
+
+    # Drift: compare each compact ranking with float64 on the exact float64 scores
+    reference = models['float64']
+    for name, recommender in models.items():
+        if name == 'float64':
+            continue
+        overlap, identical, recall, score_diff = [], [], [], 0.0
+        for profile in profiles:
+            level, goals = profile['user_level'], profile['learning_goals']
+            exact_scores = reference._scores(reference._similarities(level, goals), level)
+            compact_scores = recommender._scores(recommender._similarities(level, goals), level)
+            expected = reference._top_k(exact_scores, k)
+            actual = recommender._top_k(compact_scores, k)
+
+            overlap.append(len(set(expected) & set(actual)) / k)
+            identical.append(list(expected) == list(actual))
+            recall.append(np.mean(exact_scores[actual] >= exact_scores[expected[-1]] - 1e-9))
+            score_diff = max(score_diff, float(np.abs(compact_scores - exact_scores).max()))
+        result['modes'][name]['drift'] = {
+            'top_k_overlap': round(float(np.mean(overlap)), 4),
+            'identical_top_k': round(float(np.mean(identical)), 4),
+            'recall_at_k': round(float(np.mean(recall)), 4),
+            'max_score_diff': float(f'{score_diff:.3g}'),
+        }
+
+    baseline = result['modes']['float64']['memory']['retained_mb']
+    for stats in result['modes'].values():
+        stats['memory']['saved_mb_per_100k'] = round(
+            (baseline - stats['memory']['retained_mb']) * 100_000 / size, 2
+        )
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default='10000,100000', help='comma-separated catalog sizes')
+    parser.add_argument('--queries', type=int, default=300, help='learner profiles per size')
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='bench_compact.json')
+    args = parser.parse_args()
+
+    results = {
+        'benchmark': 'compact',
+        'created_at': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+        'commit': git_commit(),
+        'environment': environment(),
+        'settings': {'queries': args.queries, 'k': args.k, 'seed': args.seed},
+        'runs': [],
+    }
+
+    print(f"{'items':>9} {'mode':>8} {'matrix MB':>10} {'catalog MB':>11} {'model MB':>9} "
+          f"{'MB/100k':>8} {'saved/100k':>11} {'cold p50':>9} {'overlap':>8} {'recall@' + str(args.k):>10}")
+    for size in [int(size) for size in args.sizes.split(',') if size]:
+        run = run_size(size, args.queries, args.k, args.seed)
+        results['runs'].append(run)
+        for name, stats in run['modes'].items():
+            memory, drift = stats['memory'], stats.get('drift', {})
+            print(f"{size:>9} {name:>8} {memory['matrix_mb']:>10.2f} {memory['catalog_mb']:>11.2f} "
+                  f"{memory['retained_mb']:>9.2f} {memory['retained_mb_per_100k']:>8.2f} "
+                  f"{memory['saved_mb_per_100k']:>11.2f} {stats['recommend_cold_ms']['p50']:>9.3f} "
+                  f"{drift.get('top_k_overlap', 1.0):>8.4f} {drift.get('recall_at_k', 1.0):>10.4f}")
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2)
+    print(f"\nResults written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,225 @@
+"""
+Pre-fork server benchmark: per-worker memory and coordinated reload
+
+Runs combine_api under PreforkServer (prefork.py) against the in-memory
+FakeFirestore, then reports
+- memory of the master and of every worker (RSS / PSS / shared / private, from
+  /proc/<pid>/smaps_rollup) after startup and after a round of traffic; the
+  private part is what each extra worker costs
+- the same for one single-process server, for comparison
+- a coordinated reload: POST /api/reload-content on a worker, then the time until
+  every worker answers with the new generation and model version
+
+Linux only (smaps_rollup). No network or credentials needed.
+
+Usage:
+    python benchmarks/bench_prefork.py [--workers 4] [--items 20000] [--users 500]
+        [--requests 2000] [--concurrency 16] [--output bench_prefork.json]
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import argparse
+import datetime
+import json
+import logging
+import os
+import random
+import signal
+import sys
+import tempfile
+import time
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARK_DIR))
+sys.path.insert(0, BENCHMARK_DIR)
+
+from bench_recommender import environment, git_commit  # noqa: E402
+from fake_firestore import FakeFirestore, FakeFirestoreModule, seed_database  # noqa: E402
+from load_test import get_json, post_json  # noqa: E402
+
+
+def worker_pids(master_pid):
+    with open(f'/proc/{master_pid}/task/{master_pid}/children') as f:
+        return sorted(int(pid) for pid in f.read().split())
+
+
+def memory_report(master_pid):
+    import prefork
+
+    workers = {pid: prefork.process_memory(pid) for pid in worker_pids(master_pid)}
+    private = [memory['private_mb'] for memory in workers.values()]
+    return {
+        'master': prefork.process_memory(master_pid),
+        'workers': {str(pid): memory for pid, memory in workers.items()},
+        'worker_private_mb_mean': round(sum(private) / len(private), 1) if private else None,
+        'total_pss_mb': round(
+            prefork.process_memory(master_pid)['pss_mb'] + sum(memory['pss_mb'] for memory in workers.values()), 1
+        ),
+    }
+
+
+def start_server(db, workers, port):
+    """Fork a child that runs combine_api (prefork master when workers > 0); returns its pid"""
+    pid = os.fork()
+    if pid:
+        return pid
+
+    import combine_api
+    import logging_setup
+    import prefork
+
+    logging_setup.setup_logging()
+
+    combine_api.firestore = FakeFirestoreModule(db)
+    code = 0
+    try:
+        if workers:
+            prefork.PreforkServer(
+                combine_api.app, combine_api.load_generation, update=combine_api.apply_worker_edit,
+                host='127.0.0.1', port=port, workers=workers,
+                on_worker_exit=[combine_api.flush_worker, logging_setup.stop_logging]
+            ).serve_forever()
+        else:
+            combine_api.load_content_and_train(combine_api.get_content_source())
+            combine_api.load_cooccurrence(db)
+            from werkzeug.serving import make_server
+            make_server('127.0.0.1', port, combine_api.app, threaded=True).serve_forever()
+    except BaseException:
+        code = 1
+    finally:
+        os._exit(code)
+
+
+def wait_ready(url, timeout=600):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        status, body = get_json(url + '/api/health')
+        if status == 200 and body and body.get('recommendation_model_loaded'):
+            return body
+        time.sleep(0.2)
+    raise SystemExit('Server did not become ready')
+
+
+def drive(url, user_ids, requests, concurrency, seed):
+    rng = random.Random(seed)
+    users = [rng.choice(user_ids) for _ in range(requests)]
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(
+            lambda user_id: post_json(url + '/api/generate-recommendations', {'userId': user_id})[0], users
+        ))
+    return sum(1 for status in results if status != 200)
+
+
+def stop_server(pid):
+    os.kill(pid, signal.SIGTERM)
+    os.waitpid(pid, 0)
+
+
+def run_single(db, user_ids, args, port):
+    pid = start_server(db, 0, port)
+    url = f'http://127.0.0.1:{port}'
+    try:
+        wait_ready(url)
+        import prefork
+        started = prefork.process_memory(pid)
+        errors = drive(url, user_ids, args.requests, args.concurrency, args.seed)
+        return {'startup': started, 'after_traffic': prefork.process_memory(pid), 'errors': errors}
+    finally:
+        stop_server(pid)
+
+
+def run_prefork(db, user_ids, args, port):
+    pid = start_server(db, args.workers, port)
+    url = f'http://127.0.0.1:{port}'
+    try:
+        health = wait_ready(url)
+        while len(worker_pids(pid)) < args.workers:
+            time.sleep(0.1)
+        result = {'startup': memory_report(pid)}
+
+        errors = drive(url, user_ids, args.requests, args.concurrency, args.seed)
+        result['after_traffic'] = memory_report(pid)
+        result['errors'] = errors
+
+        # Coordinated reload: every worker must end up on the new generation / model version
+        generation, version = health['server']['generation'], health['model_version']
+        started = time.perf_counter()
+        status, _ = post_json(url + '/api/reload-content', {})
+        seen = {}
+        while time.perf_counter() - started < 600:
+            _, body = get_json(url + '/api/health')
+            if body and body['server']['generation'] > generation:
+                seen[body['server']['pid']] = body['model_version']
+            if len(seen) >= args.workers and set(worker_pids(pid)) <= set(seen):
+                break
+            time.sleep(0.05)
+        result['reload'] = {
+            'status': status,
+            'seconds': round(time.perf_counter() - started, 3),
+            'workers_on_new_generation': len(set(worker_pids(pid)) & set(seen)),
+            'model_versions': sorted(set(seen.values())),
+            'old_version': version,
+        }
+        result['after_reload'] = memory_report(pid)
+        return result
+    finally:
+        stop_server(pid)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--items', type=int, default=20000, help='catalog size')
+    parser.add_argument('--users', type=int, default=500)
+    parser.add_argument('--requests', type=int, default=2000, help='generate requests per server')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--port', type=int, default=5077)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='bench_prefork.json')
+    args = parser.parse_args()
+
+    os.environ.setdefault('MODEL_SNAPSHOT_DIR', tempfile.mkdtemp(prefix='bench-prefork-snapshot-'))
+    os.environ.setdefault('CONTENT_SOURCE', 'firestore')
+    os.environ.setdefault('LOG_LEVEL', 'WARNING')
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+
+    db = FakeFirestore(seed=args.seed)
+    user_ids, _ = seed_database(db, items=args.items, users=args.users, seed=args.seed)
+
+    results = {
+        'benchmark': 'prefork',
+        'created_at': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+        'commit': git_commit(),
+        'environment': environment(),
+        'settings': vars(args),
+        'single': run_single(db, user_ids, args, args.port),
+        'prefork': run_prefork(db, user_ids, args, args.port + 1),
+    }
+
+    single, forked = results['single'], results['prefork']
+    print(f"{'server':>8} {'phase':>14} {'RSS MB':>8} {'PSS MB':>8} {'private MB':>11}")
+    for phase in ('startup', 'after_traffic'):
+        memory = single[phase]
+        print(f"{'single':>8} {phase:>14} {memory['rss_mb']:>8.1f} {memory['pss_mb']:>8.1f} {memory['private_mb']:>11.1f}")
+    for phase in ('startup', 'after_traffic', 'after_reload'):
+        report = forked[phase]
+        print(f"{'master':>8} {phase:>14} {report['master']['rss_mb']:>8.1f} {report['master']['pss_mb']:>8.1f} "
+              f"{report['master']['private_mb']:>11.1f}")
+        for pid, memory in report['workers'].items():
+            print(f"{'worker':>8} {phase:>14} {memory['rss_mb']:>8.1f} {memory['pss_mb']:>8.1f} "
+                  f"{memory['private_mb']:>11.1f}")
+        print(f"{'':>8} {phase:>14} total PSS {report['total_pss_mb']:.1f} MB, "
+              f"mean worker private {report['worker_private_mb_mean']} MB")
+    reload = forked['reload']
+    print(f"\nreload: HTTP {reload['status']}, {reload['workers_on_new_generation']}/{args.workers} workers "
+          f"on the new generation after {reload['seconds']}s, versions {reload['model_versions']} "
+          f"(was {reload['old_version']})")
+    print(f"errors: single {single['errors']}, prefork {forked['errors']}")
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2)
+    print(f"\nResults written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+"""
+Pronunciation scoring benchmark
+
+Compares the old scoring path (three character-level SequenceMatcher runs plus
+list-based missing / extra word checks) with the single word-alignment pass in
+app.py, from short sentences up to paragraph-length reading passages.
+
+Usage:
+    python benchmarks/bench_pronunciation.py [--repeat 20]
+"""
+
+from difflib import SequenceMatcher
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import align_texts, get_pronunciation_score, get_specific_feedback  # noqa: E402
+
+
+PASSAGE = (
+    "Every morning, Maria walks to the small bakery at the end of her street. "
+    "She buys a loaf of fresh bread and sometimes a chocolate croissant for her brother. "
+    "The baker, an old man with a friendly smile, always asks about her studies. "
+    "Maria is learning English because she wants to travel around the world next year. "
+    "She practises speaking with her friends, listens to podcasts on the bus, and reads "
+    "short stories before she goes to sleep. Last week she watched a film without subtitles "
+    "for the first time, and she understood almost everything the characters said. "
+    "Her teacher says that reading aloud is one of the best ways to improve pronunciation, "
+    "because it helps you notice the rhythm of the language and the sounds you find difficult. "
+)
+
+
+# ========================================
+# Old scoring path (before the single-pass alignment)
+# ========================================
+
+def legacy_similarity(text1, text2):
+    return SequenceMatcher(None, text1.lower().strip(), text2.lower().strip()).ratio()
+
+
+def legacy_score(user_text, target_text):
+    # get_pronunciation_score + get_specific_feedback + the route each ran it once
+    similarity = legacy_similarity(user_text, target_text)
+    user_words = user_text.lower().split()
+    target_words = target_text.lower().split()
+    missing_words = [word for word in target_words if word not in user_words]
+    extra_words = [word for word in user_words if word not in target_words]
+    legacy_similarity(user_text, target_text)
+    legacy_similarity(user_text, target_text)
+    return int(similarity * 100), missing_words, extra_words
+
+
+def single_pass_score(user_text, target_text):
+    alignment = align_texts(user_text, target_text)
+    score = get_pronunciation_score(user_text, target_text, alignment)
+    feedback = get_specific_feedback(user_text, target_text, alignment)
+    return score, feedback
+
+
+# ========================================
+# Inputs
+# ========================================
+
+def recognise(target_text, error_rate, rng):
+    """Simulate browser speech recognition: dropped, swapped and inserted words"""
+    fillers = ['um', 'uh', 'the', 'a', 'like']
+    words = []
+    for word in target_text.lower().replace(',', '').replace('.', '').split():
+        roll = rng.random()
+        if roll < error_rate / 3:
+            continue
+        if roll < 2 * error_rate / 3:
+            words.append(word[:-1] or word)
+        else:
+            words.append(word)
+        if rng.random() < error_rate / 3:
+            words.append(rng.choice(fillers))
+    return ' '.join(words)
+
+
+def cases(rng):
+    sentence = "The quick brown fox jumps over the lazy dog."
+    paragraph = ' '.join(PASSAGE.split()[:80])
+    return [
+        ('sentence, exact', sentence, sentence.lower().rstrip('.')),
+        ('sentence, 20% errors', sentence, recognise(sentence, 0.2, rng)),
+        ('paragraph (80 words), 10% errors', paragraph, recognise(paragraph, 0.1, rng)),
+        ('passage (160 words), 10% errors', PASSAGE, recognise(PASSAGE, 0.1, rng)),
+        ('passage (160 words), 30% errors', PASSAGE, recognise(PASSAGE, 0.3, rng)),
+        ('long passage (480 words), 10% errors', PASSAGE * 3, recognise(PASSAGE * 3, 0.1, rng)),
+    ]
+
+
+def measure(function, user_text, target_text, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function(user_text, target_text)
+        timings.append(time.perf_counter() - started)
+    timings.sort()
+    return timings[len(timings) // 2] * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+
+    print(f"{'case':40} {'old (ms)':>10} {'new (ms)':>10} {'speedup':>8}")
+    print('-' * 72)
+    for name, target_text, user_text in cases(rng):
+        old_ms = measure(legacy_score, user_text, target_text, args.repeat)
+        new_ms = measure(single_pass_score, user_text, target_text, args.repeat)
+        print(f"{name:40} {old_ms:10.3f} {new_ms:10.3f} {old_ms / new_ms:7.1f}x")
+
+
+if __name__ == '__main__':
+    main()
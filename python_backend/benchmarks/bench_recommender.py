@@ -0,0 +1,371 @@
+"""
+Recommender benchmark suite
+
+Builds synthetic catalogs (1k .. 1M items) with realistic title / description /
+category / level distributions and synthetic learners with completed-lesson
+lists of varying length, then measures for ContentBasedRecommender:
+- fit() wall time and peak traced memory (tracemalloc, numpy included)
+- single-query recommend() latency percentiles, cold (ranking cache cleared
+  before every call) and warm (natural cache reuse between learners)
+- recommend_many() batch throughput
+
+Each catalog size runs in a fresh process so peak RSS is per size. Results are
+written as JSON; pass --compare with an earlier file to see the change per metric.
+
+Usage:
+    python benchmarks/bench_recommender.py [--sizes 1000,10000,100000,1000000]
+        [--queries 500] [--output bench_recommender.json] [--compare old.json]
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+import argparse
+import datetime
+import json
+import multiprocessing
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np  # noqa: E402
+import pandas as pd  # noqa: E402
+
+from SOLUTION_1_ContentBased import ContentBasedRecommender, LEVEL_MAP  # noqa: E402
+
+
+DEFAULT_SIZES = (1_000, 10_000, 100_000, 1_000_000)
+
+# Modules and how much of the catalog they make up
+CATEGORIES = {
+    'Grammar': 0.25,
+    'Vocabulary': 0.25,
+    'Reading': 0.15,
+    'Listening': 0.15,
+    'Speaking': 0.1,
+    'Writing': 0.1,
+}
+
+# Most material is for beginners and intermediate learners
+LEVELS = {'A1': 0.24, 'A2': 0.22, 'B1': 0.2, 'B2': 0.16, 'C1': 0.11, 'C2': 0.07}
+
+TOPICS = {
+    'Grammar': [
+        'present simple', 'present continuous', 'past simple', 'past continuous', 'present perfect',
+        'future tense', 'conditionals', 'passive voice', 'reported speech', 'modal verbs',
+        'articles', 'prepositions', 'relative clauses', 'gerunds', 'infinitives', 'comparatives',
+    ],
+    'Vocabulary': [
+        'food', 'travel', 'family', 'work', 'health', 'weather', 'shopping', 'sports', 'technology',
+        'idioms', 'phrasal verbs', 'collocations', 'emotions', 'environment', 'education', 'money',
+    ],
+    'Reading': [
+        'short stories', 'news articles', 'emails', 'blog posts', 'science texts', 'biographies',
+        'advertisements', 'reviews', 'instructions', 'opinion pieces',
+    ],
+    'Listening': [
+        'conversations', 'podcasts', 'announcements', 'interviews', 'lectures', 'phone calls',
+        'radio news', 'directions', 'songs', 'documentaries',
+    ],
+    'Speaking': [
+        'introductions', 'pronunciation', 'small talk', 'presentations', 'debates', 'job interviews',
+        'ordering food', 'asking directions', 'storytelling', 'intonation',
+    ],
+    'Writing': [
+        'formal emails', 'essays', 'reports', 'cover letters', 'summaries', 'reviews', 'stories',
+        'complaints', 'invitations', 'paragraph structure',
+    ],
+}
+
+TITLE_TEMPLATES = [
+    '{topic}', 'Introduction to {topic}', 'Practice: {topic}', '{topic} in context',
+    'Mastering {topic}', '{topic} for everyday life', 'Common mistakes with {topic}',
+    '{topic} quiz', 'Understanding {topic}', '{topic} part {part}',
+]
+
+DESCRIPTION_WORDS = (
+    'learn practice understand use improve common examples exercises everyday situations rules '
+    'meaning sentences questions answers listening speaking reading writing skills grammar vocabulary '
+    'pronunciation fluency accuracy confidence native speakers dialogue context tips mistakes review '
+    'quiz audio video text short long simple advanced beginner intermediate real world useful phrases'
+).split()
+
+
+# ========================================
+# Synthetic data
+# ========================================
+
+def _pick(rng, weights, size):
+    names = list(weights)
+    probabilities = np.array(list(weights.values()), dtype=float)
+    return np.array(names, dtype=object)[rng.choice(len(names), size=size, p=probabilities / probabilities.sum())]
+
+
+def make_catalog(size, seed=0):
+    """Synthetic lessonContent + videos catalog with the columns the APIs build"""
+    rng = np.random.default_rng(seed)
+    categories = _pick(rng, CATEGORIES, size)
+    levels = _pick(rng, LEVELS, size)
+    is_video = rng.random(size) < 0.2
+
+    # Zipf-like word frequencies, 6-20 words per description
+    word_weights = 1.0 / np.arange(1, len(DESCRIPTION_WORDS) + 1)
+    word_weights /= word_weights.sum()
+    lengths = rng.integers(6, 21, size=size)
+    words = np.array(DESCRIPTION_WORDS, dtype=object)[
+        rng.choice(len(DESCRIPTION_WORDS), size=int(lengths.sum()), p=word_weights)
+    ]
+    offsets = np.concatenate([[0], np.cumsum(lengths)])
+
+    template_ids = rng.integers(0, len(TITLE_TEMPLATES), size=size)
+    topic_draws = rng.random(size)
+    parts = rng.integers(1, 6, size=size)
+
+    ids, titles, descriptions, types, routes = [], [], [], [], []
+    for i in range(size):
+        category = categories[i]
+        topics = TOPICS[category]
+        topic = topics[int(topic_draws[i] * len(topics))]
+        title = TITLE_TEMPLATES[template_ids[i]].format(topic=topic, part=parts[i])
+        title = title[0].upper() + title[1:]
+
+        kind = 'video' if is_video[i] else 'lesson'
+        item_id = f'{category.lower()}-{kind}-{i}'
+        ids.append(item_id)
+        titles.append(title)
+        descriptions.append(' '.join(words[offsets[i]:offsets[i + 1]]))
+        types.append(kind)
+        routes.append(f'/modules/{category.lower()}/{kind}/{item_id}')
+
+    return pd.DataFrame({
+        'id': ids,
+        'title': titles,
+        'category': categories.astype(str),
+        'level': levels.astype(str),
+        'description': descriptions,
+        'type': types,
+        'route': routes,
+    })
+
+
+def make_profiles(catalog, count, seed=1):
+    """Learners: a quiz level, 0-3 goals and 0 .. 500 completed lessons (long-tailed)"""
+    rng = np.random.default_rng(seed)
+    ids = catalog['id'].to_numpy()
+    goal_names = list(CATEGORIES)
+    level_names = list(LEVEL_MAP)
+
+    profiles = []
+    for _ in range(count):
+        goals = list(rng.choice(goal_names, size=rng.integers(0, 4), replace=False))
+        completed_count = min(len(ids), int(rng.pareto(1.2) * 5))
+        completed_count = min(completed_count, 500)
+        completed = list(ids[rng.choice(len(ids), size=completed_count, replace=False)]) if completed_count else []
+        profiles.append({
+            'user_level': str(rng.choice(level_names, p=list(LEVELS.values()))),
+            'learning_goals': [str(goal) for goal in goals],
+            'completed_lessons': [str(item) for item in completed],
+        })
+    return profiles
+
+
+# ========================================
+# Measurements
+# ========================================
+
+def percentiles(timings_ms):
+    values = np.asarray(timings_ms)
+    return {
+        'p50': round(float(np.percentile(values, 50)), 4),
+        'p90': round(float(np.percentile(values, 90)), 4),
+        'p99': round(float(np.percentile(values, 99)), 4),
+        'mean': round(float(values.mean()), 4),
+        'max': round(float(values.max()), 4),
+    }
+
+
+def peak_rss_mb():
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def run_size(size, queries, batch_size, trace_memory, seed):
+    started = time.perf_counter()
+    catalog = make_catalog(size, seed)
+    profiles = make_profiles(catalog, queries, seed + 1)
+    generate_seconds = time.perf_counter() - started
+
+    recommender = ContentBasedRecommender()
+    started = time.perf_counter()
+    recommender.fit(catalog)
+    fit_seconds = time.perf_counter() - started
+
+    fit_peak_mb = None
+    if trace_memory:
+        # Separate fit: tracemalloc slows allocation-heavy code, so it is not timed
+        traced = ContentBasedRecommender()
+        tracemalloc.start()
+        traced.fit(catalog)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        fit_peak_mb = round(peak / 2 ** 20, 1)
+        del traced
+
+    # Cold: every call ranks the full catalog
+    cold = []
+    for profile in profiles:
+        recommender.ranking_cache.clear()
+        started = time.perf_counter()
+        recommender.recommend(profile['user_level'], profile['learning_goals'], profile['completed_lessons'], n=10)
+        cold.append((time.perf_counter() - started) * 1000)
+
+    # Warm: learners with the same level and goals share cached rankings
+    recommender.ranking_cache.clear()
+    warm = []
+    for profile in profiles:
+        started = time.perf_counter()
+        recommender.recommend(profile['user_level'], profile['learning_goals'], profile['completed_lessons'], n=10)
+        warm.append((time.perf_counter() - started) * 1000)
+    cache = recommender.cache_info()
+
+    # Keep each batch's dense (users x items) block around 16M cells
+    batch_size = batch_size or max(1, min(256, 2 ** 24 // size))
+    started = time.perf_counter()
+    recommender.recommend_many(profiles, n=10, batch_size=batch_size)
+    batch_seconds = time.perf_counter() - started
+
+    return {
+        'items': size,
+        'features': int(recommender.content_matrix.shape[1]),
+        'matrix_nnz': int(recommender.content_matrix.nnz),
+        'generate_seconds': round(generate_seconds, 3),
+        'fit_seconds': round(fit_seconds, 3),
+        'fit_peak_traced_mb': fit_peak_mb,
+        'peak_rss_mb': peak_rss_mb(),
+        'recommend_cold_ms': percentiles(cold),
+        'recommend_warm_ms': percentiles(warm),
+        'warm_cache_hit_rate': round(cache['hits'] / max(1, cache['hits'] + cache['misses']), 4),
+        'batch_size': batch_size,
+        'batch_profiles_per_second': round(len(profiles) / batch_seconds, 1),
+    }
+
+
+# ========================================
+# Reporting
+# ========================================
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=os.path.dirname(os.path.abspath(__file__)), stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def environment():
+    import scipy
+    import sklearn
+    return {
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'scipy': scipy.__version__,
+        'scikit-learn': sklearn.__version__,
+        'pandas': pd.__version__,
+        'machine': platform.machine(),
+        'processor': platform.processor() or None,
+        'cpu_count': os.cpu_count(),
+    }
+
+
+def _flatten(result, prefix=''):
+    for key, value in result.items():
+        if isinstance(value, dict):
+            yield from _flatten(value, f'{prefix}{key}.')
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            yield f'{prefix}{key}', value
+
+
+def compare(previous, current):
+    """Print metric changes per catalog size against an earlier results file"""
+    before = {run['items']: dict(_flatten(run)) for run in previous['runs']}
+    print()
+    print(f"Compared with {previous.get('commit') or 'previous run'} ({previous.get('created_at')})")
+    print(f"{'items':>9} {'metric':36} {'before':>12} {'after':>12} {'change':>8}")
+    print('-' * 82)
+    for run in current['runs']:
+        old = before.get(run['items'])
+        if old is None:
+            continue
+        for metric, value in _flatten(run):
+            if metric == 'items' or metric not in old or not old[metric]:
+                continue
+            change = (value - old[metric]) / old[metric] * 100
+            print(f"{run['items']:>9} {metric:36} {old[metric]:>12} {value:>12} {change:>+7.1f}%")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default=','.join(map(str, DEFAULT_SIZES)),
+                        help='comma-separated catalog sizes')
+    parser.add_argument('--queries', type=int, default=500, help='learner profiles per size')
+    parser.add_argument('--batch-size', type=int, default=0,
+                        help='recommend_many batch size (default: sized to the catalog)')
+    parser.add_argument('--no-trace-memory', action='store_true',
+                        help='skip the extra traced fit used to measure peak memory')
+    parser.add_argument('--in-process', action='store_true',
+                        help='run every size in this process (peak RSS is then cumulative)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='bench_recommender.json')
+    parser.add_argument('--compare', help='earlier results file to compare against')
+    args = parser.parse_args()
+
+    sizes = [int(size) for size in args.sizes.split(',') if size]
+    run_args = (args.queries, args.batch_size, not args.no_trace_memory, args.seed)
+
+    results = {
+        'benchmark': 'recommender',
+        'created_at': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+        'commit': git_commit(),
+        'environment': environment(),
+        'settings': {'queries': args.queries, 'seed': args.seed},
+        'runs': [],
+    }
+
+    print(f"{'items':>9} {'fit (s)':>9} {'fit MB':>9} {'cold p50':>9} {'cold p99':>9} "
+          f"{'warm p50':>9} {'batch/s':>9}")
+    print('-' * 72)
+    for size in sizes:
+        if args.in_process:
+            run = run_size(size, *run_args)
+        else:
+            # A fresh process per size keeps peak RSS and allocator state independent
+            with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as pool:
+                run = pool.submit(run_size, size, *run_args).result()
+        results['runs'].append(run)
+
+        fit_mb = run['fit_peak_traced_mb']
+        print(f"{size:>9} {run['fit_seconds']:>9.2f} {fit_mb if fit_mb is not None else '-':>9} "
+              f"{run['recommend_cold_ms']['p50']:>9.3f} {run['recommend_cold_ms']['p99']:>9.3f} "
+              f"{run['recommend_warm_ms']['p50']:>9.3f} {run['batch_profiles_per_second']:>9.1f}")
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2)
+    print(f"\nResults written to {args.output}")
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            compare(json.load(f), results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,202 @@
+"""
+In-memory stand-in for the Firestore client calls the API servers use
+
+Supports collection().stream(), collection().document(), document().get() / .set(),
+db.get_all([...]) and db.batch() (set + commit). Every round trip sleeps for
+latency +/- jitter seconds, so concurrency changes can be tried on a laptop
+without network access or credentials.
+
+Usage:
+    db = FakeFirestore(latency=0.02, jitter=0.01)
+    seed_database(db, items=5000, users=500)
+    combine_api.firestore = FakeFirestoreModule(db)   # what combine_api calls firestore.client() on
+"""
+
+import copy
+import datetime
+import random
+import threading
+import time
+
+import numpy as np
+
+from bench_recommender import make_catalog, make_profiles
+
+
+# Stored as the write time, like the real server does
+SERVER_TIMESTAMP = object()
+
+
+class FakeDocumentSnapshot:
+
+    def __init__(self, reference, data):
+        self.reference = reference
+        self.id = reference.id
+        self.exists = data is not None
+        self._data = data
+
+    def to_dict(self):
+        return copy.deepcopy(self._data) if self._data is not None else None
+
+
+class FakeDocumentReference:
+
+    def __init__(self, db, collection, doc_id):
+        self._db = db
+        self.id = doc_id
+        self.path = f'{collection}/{doc_id}'
+        self._collection = collection
+
+    def get(self):
+        self._db._round_trip('read')
+        return FakeDocumentSnapshot(self, self._db._read(self._collection, self.id))
+
+    def set(self, data):
+        self._db._round_trip('write')
+        self._db._write(self._collection, self.id, data)
+
+
+class FakeCollectionReference:
+
+    def __init__(self, db, name):
+        self._db = db
+        self.id = name
+
+    def document(self, doc_id):
+        return FakeDocumentReference(self._db, self.id, doc_id)
+
+    def stream(self, retry=None, timeout=None):
+        self._db._round_trip('stream')
+        for doc_id, data in self._db._scan(self.id):
+            yield FakeDocumentSnapshot(FakeDocumentReference(self._db, self.id, doc_id), data)
+
+
+class FakeWriteBatch:
+
+    def __init__(self, db):
+        self._db = db
+        self._writes = []
+
+    def set(self, reference, data):
+        self._writes.append((reference, data))
+
+    def commit(self):
+        self._db._round_trip('write')
+        for reference, data in self._writes:
+            self._db._write(reference._collection, reference.id, data)
+        self._writes = []
+
+
+class FakeFirestore:
+    """Thread-safe in-memory database with injected per-round-trip latency"""
+
+    def __init__(self, latency=0.0, jitter=0.0, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self._collections = {}
+        self._lock = threading.Lock()
+        self._random = random.Random(seed)
+        self.round_trips = {'read': 0, 'write': 0, 'stream': 0}
+
+    # Client API
+    def collection(self, name):
+        return FakeCollectionReference(self, name)
+
+    def get_all(self, references):
+        self._round_trip('read')
+        for reference in references:
+            yield FakeDocumentSnapshot(reference, self._read(reference._collection, reference.id))
+
+    def batch(self):
+        return FakeWriteBatch(self)
+
+    # Storage
+    def _round_trip(self, kind):
+        with self._lock:
+            self.round_trips[kind] += 1
+            delay = self.latency + self._random.uniform(-self.jitter, self.jitter)
+        if delay > 0:
+            time.sleep(delay)
+
+    def _read(self, collection, doc_id):
+        with self._lock:
+            data = self._collections.get(collection, {}).get(doc_id)
+        return copy.deepcopy(data)
+
+    def _write(self, collection, doc_id, data):
+        now = datetime.datetime.now(datetime.timezone.utc)
+        stored = {key: now if value is SERVER_TIMESTAMP else value for key, value in data.items()}
+        with self._lock:
+            self._collections.setdefault(collection, {})[doc_id] = copy.deepcopy(stored)
+
+    def _scan(self, collection):
+        with self._lock:
+            items = list(self._collections.get(collection, {}).items())
+        return items
+
+    def load(self, collection, documents):
+        """Bulk-insert {doc_id: data} without latency"""
+        with self._lock:
+            self._collections.setdefault(collection, {}).update(documents)
+
+    def count(self, collection):
+        with self._lock:
+            return len(self._collections.get(collection, {}))
+
+
+class FakeFirestoreModule:
+    """Replacement for the firebase_admin.firestore module attribute of an API module"""
+
+    SERVER_TIMESTAMP = SERVER_TIMESTAMP
+
+    def __init__(self, db):
+        self._db = db
+
+    def client(self):
+        return self._db
+
+
+def seed_database(db, items=5000, users=500, seed=0):
+    """
+    Synthetic lessonContent / videos / users / userProgress documents
+    Returns (user ids, [(target_text, user_text), ...]) for driving the APIs
+    """
+    catalog = make_catalog(items, seed)
+
+    lessons, videos = {}, {}
+    for record in catalog.to_dict('records'):
+        if record['type'] == 'video':
+            videos[record['id']] = {
+                'title': record['title'],
+                'category': record['category'].lower(),
+                'level': record['level'],
+                'description': record['description'],
+            }
+        else:
+            lessons[record['id']] = {
+                'moduleId': record['category'].lower(),
+                'level': record['level'],
+                'introduction': {'title': record['title'], 'summary': record['description']},
+            }
+    db.load('lessonContent', lessons)
+    db.load('videos', videos)
+
+    user_ids = [f'user-{i}' for i in range(users)]
+    profiles = make_profiles(catalog, users, seed + 1)
+    db.load('users', {
+        user_id: {'quizLevel': profile['user_level'], 'learningGoals': profile['learning_goals']}
+        for user_id, profile in zip(user_ids, profiles)
+    })
+    db.load('userProgress', {
+        user_id: {'completedLessons': profile['completed_lessons']}
+        for user_id, profile in zip(user_ids, profiles)
+    })
+
+    # Target / recognised sentence pairs for the pronunciation endpoint
+    rng = np.random.default_rng(seed + 2)
+    titles = catalog['title'].tolist()
+    sentences = [
+        (f"{titles[i]} is something I practise every day.", f"{titles[i]} is something i practice every day")
+        for i in rng.choice(len(titles), size=min(200, len(titles)), replace=False)
+    ]
+    return user_ids, sentences
@@ -0,0 +1,329 @@
+"""
+End-to-end load test for combine_api.py and app.py
+
+Starts both Flask apps on local threaded servers, with combine_api talking to the
+in-memory FakeFirestore (configurable latency / jitter), then drives
+/api/generate-recommendations and /api/score-pronunciation from N concurrent
+clients. Content reloads (/api/reload-content) are triggered at the given times
+and followed until they finish, so latency while a reload is running is reported
+separately.
+
+Reports throughput, p50 / p95 / p99 latency and error rate per endpoint, overall
+and during reloads. No network or credentials needed.
+
+Usage:
+    python benchmarks/load_test.py [--concurrency 16] [--duration 20]
+        [--mix generate=0.7,score=0.3] [--reload-at 5,12]
+        [--latency-ms 20] [--jitter-ms 10] [--items 5000] [--users 500]
+        [--output load_test.json]
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import argparse
+import datetime
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARK_DIR))
+sys.path.insert(0, BENCHMARK_DIR)
+
+import numpy as np  # noqa: E402
+from werkzeug.serving import make_server  # noqa: E402
+
+from fake_firestore import FakeFirestore, FakeFirestoreModule, seed_database  # noqa: E402
+
+
+# ========================================
+# Servers
+# ========================================
+
+class ServerThread(threading.Thread):
+    """Threaded werkzeug server on a free local port"""
+
+    def __init__(self, app):
+        super().__init__(daemon=True)
+        self.server = make_server('127.0.0.1', 0, app, threaded=True)
+        self.url = f'http://127.0.0.1:{self.server.server_port}'
+
+    def run(self):
+        self.server.serve_forever()
+
+    def stop(self):
+        self.server.shutdown()
+
+
+def start_servers(db):
+    # Keep the model snapshot of this run away from the real one
+    os.environ.setdefault('MODEL_SNAPSHOT_DIR', tempfile.mkdtemp(prefix='load-test-snapshot-'))
+    os.environ.setdefault('CONTENT_SOURCE', 'firestore')
+
+    import combine_api
+    import app as pronunciation_api
+    import logging_setup
+
+    logging_setup.setup_logging()
+
+    combine_api.firestore = FakeFirestoreModule(db)
+    combine_api.load_content_and_train(combine_api.get_content_source())
+
+    servers = {
+        'recommendations': ServerThread(combine_api.app),
+        'pronunciation': ServerThread(pronunciation_api.app),
+    }
+    for server in servers.values():
+        server.start()
+    return servers, combine_api
+
+
+# ========================================
+# HTTP helpers
+# ========================================
+
+def post_json(url, payload, timeout=30):
+    request = urllib.request.Request(
+        url, data=json.dumps(payload).encode(), headers={'Content-Type': 'application/json'}
+    )
+    return _send(request, timeout)
+
+
+def post_form(url, fields, files, timeout=30):
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in fields.items():
+        parts.append(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode()
+        )
+    for name, (filename, data) in files.items():
+        parts.append(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+            f'Content-Type: audio/webm\r\n\r\n'.encode() + data + b'\r\n'
+        )
+    parts.append(f'--{boundary}--\r\n'.encode())
+    request = urllib.request.Request(
+        url, data=b''.join(parts), headers={'Content-Type': f'multipart/form-data; boundary={boundary}'}
+    )
+    return _send(request, timeout)
+
+
+def get_json(url, timeout=30):
+    return _send(urllib.request.Request(url), timeout)
+
+
+def _send(request, timeout):
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            return response.status, json.loads(response.read() or b'null')
+    except urllib.error.HTTPError as e:
+        return e.code, None
+    except (urllib.error.URLError, OSError, ValueError):
+        return None, None
+
+
+# ========================================
+# Load generation
+# ========================================
+
+class Scenario:
+
+    def __init__(self, servers, user_ids, sentences, audio_bytes, seed):
+        self.recommend_url = servers['recommendations'].url + '/api/generate-recommendations'
+        self.score_url = servers['pronunciation'].url + '/api/score-pronunciation'
+        self.user_ids = user_ids
+        self.sentences = sentences
+        self.audio = os.urandom(audio_bytes) if audio_bytes else None
+        self.seed = seed
+
+    def generate(self, rng):
+        status, body = post_json(self.recommend_url, {'userId': rng.choice(self.user_ids)})
+        return status == 200 and bool(body and body.get('success'))
+
+    def score(self, rng):
+        target_text, user_text = rng.choice(self.sentences)
+        files = {'audio': ('recording.webm', self.audio)} if self.audio else {}
+        status, body = post_form(self.score_url, {'target_text': target_text, 'user_text': user_text}, files)
+        return status == 200 and bool(body and body.get('success'))
+
+
+def client_loop(scenario, endpoints, weights, deadline, worker, samples):
+    rng = random.Random(scenario.seed + worker)
+    while True:
+        started = time.perf_counter()
+        if started >= deadline:
+            return
+        endpoint = rng.choices(endpoints, weights)[0]
+        try:
+            ok = getattr(scenario, endpoint)(rng)
+        except Exception:
+            ok = False
+        samples.append((endpoint, started, time.perf_counter() - started, ok))
+
+
+def run_reloads(base_url, reload_at, start, deadline, reloads):
+    """POST /api/reload-content at the given offsets and poll the job until it finishes"""
+    for offset in reload_at:
+        delay = start + offset - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        if time.perf_counter() >= deadline:
+            return
+
+        started = time.perf_counter()
+        status, body = post_json(base_url + '/api/reload-content', {})
+        if status != 202 or not body:
+            reloads.append({'offset': offset, 'start': started, 'end': time.perf_counter(), 'status': 'error'})
+            continue
+
+        job_id = body['jobId']
+        job_status = body.get('status')
+        while job_status in ('pending', 'running'):
+            time.sleep(0.02)
+            _, health = get_json(f'{base_url}/api/health?jobId={job_id}')
+            job_status = ((health or {}).get('reload_job') or {}).get('status', 'unknown')
+        reloads.append({'offset': offset, 'start': started, 'end': time.perf_counter(), 'status': job_status})
+
+
+# ========================================
+# Reporting
+# ========================================
+
+def summarize(samples, elapsed):
+    if not samples:
+        return {'requests': 0}
+    latencies = np.array([sample[2] for sample in samples]) * 1000
+    errors = sum(1 for sample in samples if not sample[3])
+    return {
+        'requests': len(samples),
+        'throughput_rps': round(len(samples) / elapsed, 1) if elapsed > 0 else None,
+        'error_rate': round(errors / len(samples), 4),
+        'p50_ms': round(float(np.percentile(latencies, 50)), 2),
+        'p95_ms': round(float(np.percentile(latencies, 95)), 2),
+        'p99_ms': round(float(np.percentile(latencies, 99)), 2),
+        'max_ms': round(float(latencies.max()), 2),
+    }
+
+
+def report(samples, reloads, start, elapsed, endpoints):
+    def in_reload(sample):
+        return any(reload['start'] <= sample[1] < reload['end'] for reload in reloads)
+
+    reload_time = sum(min(reload['end'], start + elapsed) - reload['start'] for reload in reloads)
+    during = [sample for sample in samples if in_reload(sample)]
+    outside = [sample for sample in samples if not in_reload(sample)]
+
+    result = {'overall': {}, 'during_reload': {}, 'outside_reload': {}}
+    for endpoint in ['all'] + endpoints:
+        def pick(group):
+            return group if endpoint == 'all' else [sample for sample in group if sample[0] == endpoint]
+        result['overall'][endpoint] = summarize(pick(samples), elapsed)
+        result['during_reload'][endpoint] = summarize(pick(during), reload_time)
+        result['outside_reload'][endpoint] = summarize(pick(outside), elapsed - reload_time)
+    result['reloads'] = [
+        {'offset_s': reload['offset'], 'duration_s': round(reload['end'] - reload['start'], 3), 'status': reload['status']}
+        for reload in reloads
+    ]
+    return result
+
+
+def print_report(result):
+    print(f"{'window':16} {'endpoint':10} {'requests':>9} {'req/s':>8} {'errors':>7} "
+          f"{'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    print('-' * 82)
+    for window in ('overall', 'during_reload', 'outside_reload'):
+        for endpoint, stats in result[window].items():
+            if not stats.get('requests'):
+                continue
+            print(f"{window:16} {endpoint:10} {stats['requests']:>9} {stats['throughput_rps'] or 0:>8.1f} "
+                  f"{stats['error_rate'] * 100:>6.2f}% {stats['p50_ms']:>8.2f} {stats['p95_ms']:>8.2f} "
+                  f"{stats['p99_ms']:>8.2f}")
+    for reload in result['reloads']:
+        print(f"reload at {reload['offset_s']}s: {reload['status']} in {reload['duration_s']}s")
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(','):
+        name, _, weight = part.partition('=')
+        if name.strip() not in ('generate', 'score'):
+            raise SystemExit(f'Unknown endpoint in --mix: {name}')
+        mix[name.strip()] = float(weight or 1)
+    return mix
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=20.0, help='seconds')
+    parser.add_argument('--mix', default='generate=0.7,score=0.3', help='endpoint weights')
+    parser.add_argument('--reload-at', default='5', help='comma-separated seconds after start; empty for none')
+    parser.add_argument('--latency-ms', type=float, default=20.0, help='fake Firestore latency per round trip')
+    parser.add_argument('--jitter-ms', type=float, default=10.0)
+    parser.add_argument('--items', type=int, default=5000, help='catalog size')
+    parser.add_argument('--users', type=int, default=500)
+    parser.add_argument('--audio-bytes', type=int, default=32 * 1024, help='audio upload size (0 = text only)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--log-level', default='WARNING', help='log level of the servers under test')
+    parser.add_argument('--output', help='write the report as JSON')
+    args = parser.parse_args()
+
+    os.environ.setdefault('LOG_LEVEL', args.log_level)
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+
+    mix = parse_mix(args.mix)
+    endpoints = list(mix)
+    reload_at = sorted(float(offset) for offset in args.reload_at.split(',') if offset.strip())
+
+    db = FakeFirestore(latency=args.latency_ms / 1000, jitter=args.jitter_ms / 1000, seed=args.seed)
+    user_ids, sentences = seed_database(db, items=args.items, users=args.users, seed=args.seed)
+
+    print(f"🔧 Starting servers ({args.items} items, {args.users} users, "
+          f"Firestore latency {args.latency_ms}±{args.jitter_ms} ms)...")
+    servers, _ = start_servers(db)
+    scenario = Scenario(servers, user_ids, sentences, args.audio_bytes, args.seed)
+
+    print(f"🚀 {args.concurrency} clients for {args.duration}s, mix {mix}, reloads at {reload_at or 'none'}")
+    samples = []          # list.append is atomic; no lock needed
+    reloads = []
+    start = time.perf_counter()
+    deadline = start + args.duration
+
+    reload_thread = threading.Thread(
+        target=run_reloads,
+        args=(servers['recommendations'].url, reload_at, start, deadline, reloads),
+        daemon=True
+    )
+    reload_thread.start()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        for worker in range(args.concurrency):
+            pool.submit(client_loop, scenario, endpoints, [mix[name] for name in endpoints], deadline, worker, samples)
+    elapsed = time.perf_counter() - start
+    reload_thread.join(timeout=60)
+
+    result = report(samples, reloads, start, elapsed, endpoints)
+    result['settings'] = vars(args)
+    result['firestore_round_trips'] = dict(db.round_trips)
+    result['created_at'] = datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds')
+
+    print()
+    print_report(result)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(result, f, indent=2)
+        print(f"\nReport written to {args.output}")
+
+    for server in servers.values():
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
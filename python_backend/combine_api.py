@@ -5,21 +5,169 @@ Includes:
 2. Recommendation features (new)
 """
 
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify
 from flask_cors import CORS
 from dotenv import load_dotenv
+from collections import OrderedDict, namedtuple
+import logging
 import os
+import threading
+import time
+import uuid
 import pandas as pd
+import prefork  # before firebase_admin: sets the gRPC fork-support variables when PREFORK_WORKERS > 0
 from firebase_admin import initialize_app, firestore, credentials
-from SOLUTION_1_ContentBased import ContentBasedRecommender
+from SOLUTION_1_ContentBased import (
+    ANN_PROBES as DEFAULT_ANN_PROBES, COOCCURRENCE_GENERATION_STEP as DEFAULT_COOCCURRENCE_GENERATION_STEP,
+    ContentBasedRecommender, ItemCooccurrence, ShardedRecommender, ShardStore,
+    drop_duplicate_ids, filters_from_request, get_user_documents, profile_fingerprint
+)
+from content_sources import (
+    RECORD_BUILDERS, ContentSource, FirestoreContentSource, LocalContentSource
+)
+from write_behind import WriteBehindQueue
+import metrics
+import logging_setup
+
+logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 CORS(app)
 
 # Global variables for recommendation system
-_content_df = None
-_recommender = None
-_last_updated = None
+# The published model is one immutable snapshot (catalog + fitted model + indexes).
+# Requests read the reference once and keep using that snapshot until they finish.
+ModelSnapshot = namedtuple('ModelSnapshot', ['recommender', 'total_items', 'version', 'last_updated'])
+_snapshot = None
+
+# Incremental content updates
+_update_lock = threading.Lock()   # serialises upsert / delete / refit / snapshot publishing
+_refit_thread = None
+REFIT_DRIFT_THRESHOLD = int(os.getenv('CONTENT_REFIT_THRESHOLD', '50'))
+
+# Background reload jobs
+_reload_jobs = OrderedDict()      # job id -> status
+_reload_journal = None            # edits applied while a reload is running, replayed on its result
+_refit_journal = None             # same for a background refit; reset to None when a reload supersedes it
+MAX_RELOAD_JOBS = 20
+
+# Persisted model snapshot (memory-mapped on startup when fresh enough)
+SNAPSHOT_DIR = os.getenv(
+    'MODEL_SNAPSHOT_DIR',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'model_snapshot')
+)
+SNAPSHOT_MAX_AGE = float(os.getenv('MODEL_SNAPSHOT_MAX_AGE', '86400'))  # seconds
+
+# Catalog source: 'firestore' (default) or 'local' (data bundled with the frontend in src/)
+CONTENT_SOURCE = os.getenv('CONTENT_SOURCE', 'firestore')
+LOCAL_CONTENT_DIR = os.getenv('LOCAL_CONTENT_DIR')
+
+# Latency metrics (exposed at /api/metrics); children are bound once here
+RECOMMEND_STAGE_SECONDS = metrics.Histogram(
+    'smartlearning_recommend_stage_seconds',
+    'Latency of each generate-recommendations stage',
+    ['stage']
+)
+_STAGE_FIRESTORE_READ = RECOMMEND_STAGE_SECONDS.labels('firestore_read')
+_STAGE_SCORING = RECOMMEND_STAGE_SECONDS.labels('recommend')
+_STAGE_ENRICH = RECOMMEND_STAGE_SECONDS.labels('enrich')
+_STAGE_ENQUEUE_WRITE = RECOMMEND_STAGE_SECONDS.labels('enqueue_write')
+_STAGE_TOTAL = RECOMMEND_STAGE_SECONDS.labels('total')
+
+RECOMMEND_REQUESTS = metrics.Counter(
+    'smartlearning_recommend_requests',
+    'generate-recommendations requests by outcome',
+    ['outcome']
+)
+_REQUESTS_OK = RECOMMEND_REQUESTS.labels('ok')
+_REQUESTS_UNCHANGED = RECOMMEND_REQUESTS.labels('unchanged')
+_REQUESTS_BAD_REQUEST = RECOMMEND_REQUESTS.labels('bad_request')
+_REQUESTS_NOT_FOUND = RECOMMEND_REQUESTS.labels('not_found')
+_REQUESTS_UNAVAILABLE = RECOMMEND_REQUESTS.labels('unavailable')
+_REQUESTS_ERROR = RECOMMEND_REQUESTS.labels('error')
+
+FIRESTORE_WRITE_SECONDS = metrics.Histogram(
+    'smartlearning_firestore_write_seconds',
+    'Latency of write-behind batch commits',
+    ['result']
+)
+FIRESTORE_WRITE_DOCUMENTS = metrics.Counter(
+    'smartlearning_firestore_write_documents',
+    'Documents in write-behind batch commits',
+    ['result']
+)
+
+MODEL_BUILD_SECONDS = metrics.Histogram(
+    'smartlearning_model_build_seconds',
+    'Latency of loading content (stream) and training (fit)',
+    ['stage'],
+    buckets=metrics.SLOW_BUCKETS
+)
+_BUILD_STREAM = MODEL_BUILD_SECONDS.labels('stream')
+_BUILD_FIT = MODEL_BUILD_SECONDS.labels('fit')
+
+
+def _observe_commit(seconds, documents, ok):
+    result = 'ok' if ok else 'error'
+    FIRESTORE_WRITE_SECONDS.labels(result).observe(seconds)
+    FIRESTORE_WRITE_DOCUMENTS.labels(result).inc(documents)
+
+
+# Collaborative stage: item co-occurrence from everyone's completed lessons.
+# Keyed by item id, so every model snapshot shares the same instance.
+# Prefork workers serve it as it was when their generation was forked (see load_generation).
+# Saved recommendations are regenerated once COOCCURRENCE_GENERATION_STEP new completions
+# (from anyone) have come in, since the collaborative part of the score may have moved.
+COOCCURRENCE_TOP_K = int(os.getenv('COOCCURRENCE_TOP_K', '50'))
+COOCCURRENCE_GENERATION_STEP = int(os.getenv('COOCCURRENCE_GENERATION_STEP', str(DEFAULT_COOCCURRENCE_GENERATION_STEP)))
+_cooccurrence = ItemCooccurrence(top_k=COOCCURRENCE_TOP_K, generation_step=COOCCURRENCE_GENERATION_STEP)
+
+# ANN mode for large catalogs: off unless ANN_MIN_ITEMS is set (see benchmarks/bench_ann.py)
+ANN_MIN_ITEMS = int(os.getenv('ANN_MIN_ITEMS', '0')) or None
+ANN_PROBES = int(os.getenv('ANN_PROBES', str(DEFAULT_ANN_PROBES)))
+
+# Compact model: float32 or uint8 content matrix, training text dropped after fit
+# (see benchmarks/bench_compact.py for memory saved and ranking drift)
+MODEL_COMPACT = os.getenv('MODEL_COMPACT') or None
+
+
+def recommender_options():
+    """Constructor arguments shared by every model this process builds or loads"""
+    return {
+        'cooccurrence': _cooccurrence,
+        'ann_min_items': ANN_MIN_ITEMS,
+        'ann_probes': ANN_PROBES,
+        'compact': MODEL_COMPACT,
+    }
+
+
+# Sharded model: one sub-model per module (category), stored under MODEL_SNAPSHOT_DIR/shards,
+# loaded on first use and evicted LRU once the loaded shards pass SHARD_MEMORY_BUDGET_MB.
+# A reload refits only the shards whose content changed. Every shard is scored and merged
+# into a global top-N; SHARD_ROUTE_BY_GOALS scores only the learner's goal modules first.
+MODEL_SHARDING = os.getenv('MODEL_SHARDING', '').lower() in ('1', 'true', 'yes')
+SHARD_MEMORY_BUDGET_MB = float(os.getenv('SHARD_MEMORY_BUDGET_MB', '0')) or None
+SHARD_ROUTE_BY_GOALS = os.getenv('SHARD_ROUTE_BY_GOALS', '').lower() in ('1', 'true', 'yes')
+_shard_store = ShardStore(
+    os.path.join(SNAPSHOT_DIR, 'shards'), SHARD_MEMORY_BUDGET_MB, **recommender_options()
+) if MODEL_SHARDING else None
+
+
+def model_class():
+    return ShardedRecommender if MODEL_SHARDING else ContentBasedRecommender
+
+
+def new_recommender():
+    """An untrained model of the configured kind"""
+    if MODEL_SHARDING:
+        return ShardedRecommender(store=_shard_store, route_by_goals=SHARD_ROUTE_BY_GOALS)
+    return ContentBasedRecommender(**recommender_options())
+
+# Recommendation documents are saved off the request path, in coalesced batches
+_recommendation_writer = WriteBehindQueue(lambda: firestore.client(), on_commit=_observe_commit)
+_persist_lock = threading.Lock()
+_persist_pending = None
+_persist_thread = None
 
 # ========================================
 # Initialize Firebase
@@ -44,10 +192,10 @@ def init_firebase():
         
         cred = credentials.Certificate(firebase_config)
         initialize_app(cred)
-        print("✅ Firebase initialized")
+        logger.info("✅ Firebase initialized")
         return firestore.client()
     except Exception as e:
-        print(f"⚠️  Firebase initialization skipped (probably already initialized): {e}")
+        logger.warning("⚠️  Firebase initialization skipped (probably already initialized): %s", e)
         return firestore.client()
 
 
@@ -55,115 +203,215 @@ def init_firebase():
 # Load content and train model
 # ========================================
 
-def load_content_and_train(db):
-    """Load content and train recommendation model"""
-    global _content_df, _recommender, _last_updated
-    
-    print("🔄 Loading content and training recommendation model...")
-    
-    content_list = []
-    
-    # Read Lessons from lessonContent
-    print("  📖 Reading lessons from lessonContent...")
-    lessons = db.collection('lessonContent').stream()
-    
-    for doc in lessons:
-        data = doc.to_dict()
-        lesson_id = doc.id
-        
-        # Get title - try multiple sources
-        title = None
-        if 'title' in data and data['title']:
-            title = data['title']
-        elif 'introduction' in data and isinstance(data['introduction'], dict):
-            intro = data['introduction']
-            if 'title' in intro and intro['title']:
-                title = intro['title']
-        
-        # If still no title, use lesson ID
-        if not title:
-            title = f"Lesson {lesson_id}"
-        
-        # Get description
-        description = ""
-        if 'introduction' in data and isinstance(data['introduction'], dict):
-            intro = data['introduction']
-            description = intro.get('summary') or intro.get('description') or ""
-        if not description and 'description' in data:
-            description = data['description']
-        if not description and 'summary' in data:
-            description = data['summary']
-        if not description:
-            description = f"Learn {title.lower()}"
-        
-        # Get module ID
-        module_id = data.get('moduleId', 'general')
-        
-        # Get level
-        level = (data.get('level', 'A1')).upper()
-        
-        # Create correct route: /lesson/{moduleId}/{lessonId}
-        route = f"/lesson/{module_id}/{lesson_id}"
-        
-        content_list.append({
-            'id': lesson_id,
-            'title': title,
-            'category': module_id.capitalize(),
-            'level': level,
-            'description': description,
-            'type': 'lesson',
-            'route': route
-        })
-        
-        print(f"    ✅ {title} → {route}")
+def make_snapshot(recommender):
+    """Wrap a trained recommender in a new immutable snapshot"""
+    return ModelSnapshot(
+        recommender=recommender,
+        total_items=recommender.item_count,
+        version=uuid.uuid4().hex[:12],
+        last_updated=pd.Timestamp.now()
+    )
+
+
+def get_content_source():
+    """The configured catalog source (CONTENT_SOURCE / LOCAL_CONTENT_DIR)"""
+    if CONTENT_SOURCE == 'local':
+        if LOCAL_CONTENT_DIR:
+            return LocalContentSource(LOCAL_CONTENT_DIR)
+        return LocalContentSource()
+    return FirestoreContentSource(firestore.client())
+
+
+def build_snapshot(source):
+    """Load content from a ContentSource and train a new model snapshot (does not publish it)"""
+    logger.info("🔄 Loading content (%s) and training recommendation model...", source.name)
     
-    # Read Videos
-    print("  🎥 Reading videos...")
-    videos = db.collection('videos').stream()
+    with _BUILD_STREAM.time():
+        content_columns = source.load()
     
-    for doc in videos:
-        data = doc.to_dict()
-        video_id = doc.id
-        
-        title = data.get('title', f"Video {video_id}")
-        category = data.get('category', 'general')
-        level = (data.get('level', 'A1')).upper()
-        description = data.get('description', f"Watch {title.lower()}")
-        
-        # Create route for videos
-        route = f"/videos/{video_id}"
-        
-        content_list.append({
-            'id': video_id,
-            'title': title,
-            'category': category.capitalize(),
-            'level': level,
-            'description': description,
-            'type': 'video',
-            'route': route
-        })
+    if not content_columns['id']:
+        logger.warning("⚠️  No content found!")
+        return None
+    
+    content_df = drop_duplicate_ids(pd.DataFrame(content_columns))
+    
+    # Train model (a sharded model reuses the shards whose content did not change)
+    logger.info("🔧 Training recommendation model on %d items...", len(content_df))
+    current = _snapshot.recommender if _snapshot is not None else None
+    with _BUILD_FIT.time():
+        if MODEL_SHARDING and isinstance(current, ShardedRecommender):
+            recommender = current.refit(content_df)
+        else:
+            recommender = new_recommender()
+            recommender.fit(content_df)
+    
+    logger.info("✅ Loaded %d items and trained model", len(content_df))
+    return make_snapshot(recommender)
+
+
+def load_persisted_snapshot(max_age=SNAPSHOT_MAX_AGE):
+    """Memory-map the saved model snapshot if it is newer than max_age seconds"""
+    meta = model_class().snapshot_info(SNAPSHOT_DIR)
+    if meta is None:
+        return None
+    
+    age = time.time() - meta['created_at']
+    if age > max_age:
+        logger.warning("⚠️  Model snapshot is %.0fs old (max %.0fs), ignoring it", age, max_age)
+        return None
+    
+    try:
+        if MODEL_SHARDING:
+            recommender = ShardedRecommender.load(SNAPSHOT_DIR, store=_shard_store, route_by_goals=SHARD_ROUTE_BY_GOALS)
+        else:
+            recommender = ContentBasedRecommender.load(SNAPSHOT_DIR, mmap=True, **recommender_options())
+    except Exception as e:
+        logger.warning("⚠️  Could not load model snapshot: %s", e)
+        return None
+    
+    logger.info(
+        "✅ Loaded model snapshot %s (%d items, %.0fs old)",
+        meta.get('version'), recommender.item_count, age
+    )
+    return ModelSnapshot(
+        recommender=recommender,
+        total_items=recommender.item_count,
+        version=meta.get('version') or uuid.uuid4().hex[:12],
+        last_updated=pd.Timestamp.fromtimestamp(meta['created_at'])
+    )
+
+
+def _schedule_persist(snapshot):
+    """Write the snapshot to disk in the background; only the newest pending one is written"""
+    global _persist_pending, _persist_thread
+    
+    with _persist_lock:
+        _persist_pending = snapshot
+        if _persist_thread is None:
+            _persist_thread = threading.Thread(target=_persist_worker, daemon=True)
+            _persist_thread.start()
+
+
+def _persist_worker():
+    global _persist_pending, _persist_thread
+    
+    while True:
+        with _persist_lock:
+            snapshot, _persist_pending = _persist_pending, None
+            if snapshot is None:
+                _persist_thread = None
+                return
         
-        print(f"    ✅ {title} → {route}")
+        save_snapshot(snapshot)
+
+
+def save_snapshot(snapshot):
+    """Write the snapshot to SNAPSHOT_DIR (failures are logged; the model stays in memory)"""
+    try:
+        snapshot.recommender.save(SNAPSHOT_DIR, version=snapshot.version)
+    except Exception as e:
+        logger.warning("⚠️  Could not save model snapshot: %s", e)
+
+
+def load_content_and_train(source):
+    """
+    Load content, train recommendation model and publish it
+    Accepts a ContentSource or a Firestore client
+    """
+    if not isinstance(source, ContentSource):
+        source = FirestoreContentSource(source)
+    
+    snapshot = build_snapshot(source)
+    if snapshot is not None:
+        with _update_lock:
+            _publish(snapshot)
+    return snapshot
+
+
+def load_generation():
+    """
+    Build and publish the model the prefork workers are forked from (runs in the master)
+    Saving and co-occurrence seeding run inline: no thread may be running when the master forks
     
-    if not content_list:
-        print("⚠️  No content found!")
-        return
+    Workers never update co-occurrence themselves, so all of them score with the same
+    counts; each reload brings in the completions since the last one (observe() only
+    counts what is new).
+    """
+    snapshot = load_persisted_snapshot() if _snapshot is None else None
+    if snapshot is None:
+        snapshot = build_snapshot(get_content_source())
+        if snapshot is None:
+            raise RuntimeError('No content found')
+        save_snapshot(snapshot)
     
-    _content_df = pd.DataFrame(content_list)
+    with _update_lock:
+        _publish(snapshot, persist=False)
     
-    # Train model
-    print("\n🔧 Training recommendation model...")
-    _recommender = ContentBasedRecommender()
-    _recommender.fit(_content_df)
-    _last_updated = pd.Timestamp.now()
+    _seed_cooccurrence()
+
+
+def apply_worker_edit(edit):
+    """
+    Apply an upsert / delete sent by a prefork worker to the master's model (runs in the master)
+    
+    The edit is incremental, as in a single process; the next generation is forked from
+    the edited model without re-streaming the catalog or re-seeding co-occurrence.
+    Refit and save run inline: no thread may be running when the master forks.
+    Returns (body, changed); edits that publish nothing don't start a new generation.
+    """
+    published = _snapshot
+    if edit['action'] == 'upsert':
+        body = apply_upsert(edit['collection'], edit['ids'], background=False)
+    else:
+        body = apply_delete(edit['ids'], background=False)
+    
+    changed = _snapshot is not published
+    if not changed:
+        return body, False
+    
+    if body['refitScheduled']:
+        logger.info("🔧 Drift reached %d changes, refitting...", _snapshot.recommender.drift)
+        recommender = refit_model(_snapshot.recommender)
+        with _update_lock:
+            _publish(make_snapshot(recommender), persist=False)
+    save_snapshot(_snapshot)
+    return body, True
+
+
+def load_cooccurrence(db):
+    """Seed the co-occurrence stage from every userProgress document (later updates are incremental)"""
+    started = time.perf_counter()
+    users = 0
+    for doc in db.collection('userProgress').stream():
+        _cooccurrence.observe(doc.id, (doc.to_dict() or {}).get('completedLessons', []))
+        users += 1
     
-    print(f"✅ Loaded {len(_content_df)} items and trained model\n")
+    info = _cooccurrence.info()
+    logger.info(
+        "✅ Co-occurrence built from %d users: %d items, %d pairs (%.2fs)",
+        users, info['items'], info['pairs'], time.perf_counter() - started
+    )
+
+
+def _seed_cooccurrence():
+    try:
+        load_cooccurrence(firestore.client())
+    except Exception as e:
+        logger.warning("⚠️  Co-occurrence not loaded: %s", e)
 
 
 # ========================================
 # API: Generate recommendations
 # ========================================
 
+def saved_recommendations(doc, fingerprint):
+    """The saved recommendations document if it was generated from the same fingerprint"""
+    if doc is None or not doc.exists:
+        return None
+    saved = doc.to_dict() or {}
+    return saved if saved.get('fingerprint') == fingerprint else None
+
+
 @app.route('/api/generate-recommendations', methods=['POST'])
 def generate_recommendations():
     """
@@ -171,33 +419,64 @@ def generate_recommendations():
     
     Request:
     {
-        "userId": "abc123"
+        "userId": "abc123",
+        "filters": {                     // optional
+            "type": "video",             // or ["lesson", "video"]
+            "category": ["grammar"],
+            "levelMin": "A2",
+            "levelMax": "B1",
+            "includeIds": ["..."],
+            "excludeIds": ["..."]
+        }
     }
     
     Response:
     {
         "success": true,
         "recommendations": 10,
+        "cached": false,                 // true: inputs unchanged, nothing recomputed or written
         "message": "Recommendations generated successfully"
     }
     """
+    started = time.perf_counter()
     try:
         data = request.json
         user_id = data.get('userId')
         
         if not user_id:
+            _REQUESTS_BAD_REQUEST.inc()
             return jsonify({
                 'success': False,
                 'error': 'userId is required'
             }), 400
         
-        print(f"\n🎯 Generating recommendations for user: {user_id}")
+        try:
+            filters = filters_from_request(data.get('filters'))
+        except ValueError as e:
+            _REQUESTS_BAD_REQUEST.inc()
+            return jsonify({
+                'success': False,
+                'error': str(e)
+            }), 400
+        
+        # Use one snapshot for the whole request, even if a reload publishes meanwhile
+        snapshot = _snapshot
+        if snapshot is None:
+            _REQUESTS_UNAVAILABLE.inc()
+            return jsonify({
+                'success': False,
+                'error': 'Recommendation model not loaded'
+            }), 503
+        
+        logger.debug("🎯 Generating recommendations for user: %s", user_id)
         
         db = firestore.client()
         
-        # Get user data
-        user_doc = db.collection('users').document(user_id).get()
-        if not user_doc.exists:
+        # Get user data and progress together
+        with _STAGE_FIRESTORE_READ.time():
+            user_doc, progress_doc, recommendations_doc = get_user_documents(db, user_id)
+        if user_doc is None or not user_doc.exists:
+            _REQUESTS_NOT_FOUND.inc()
             return jsonify({
                 'success': False,
                 'error': 'User not found'
@@ -208,68 +487,103 @@ def generate_recommendations():
         learning_goals = user_data.get('learningGoals', [])
         
         # Get user progress
-        progress_doc = db.collection('userProgress').document(user_id).get()
         completed_lessons = []
-        if progress_doc.exists:
+        if progress_doc is not None and progress_doc.exists:
             progress_data = progress_doc.to_dict()
             completed_lessons = progress_data.get('completedLessons', [])
         
-        # Generate recommendations
-        recommendations = _recommender.recommend(
-            user_level=user_level,
-            learning_goals=learning_goals,
-            completed_lessons=completed_lessons,
-            n=10
+        # New completions update the co-occurrence stage incrementally (in prefork
+        # workers it stays as forked, so every worker ranks alike; the master refreshes it)
+        if not prefork.is_worker():
+            _cooccurrence.observe(user_id, completed_lessons)
+        
+        # Same level, goals, completions, filters, model and co-occurrence generation as the
+        # saved document: keep it
+        fingerprint = profile_fingerprint(
+            user_level, learning_goals, completed_lessons, snapshot.version, filters,
+            cooccurrence=_cooccurrence.generation
         )
+        saved = saved_recommendations(recommendations_doc, fingerprint)
+        if saved is not None:
+            _REQUESTS_UNCHANGED.inc()
+            logger.debug("✅ Recommendations for %s unchanged", user_id, extra={'user_id': user_id})
+            return jsonify({
+                'success': True,
+                'recommendations': saved.get('totalRecommendations', 0),
+                'cached': True,
+                'message': 'Recommendations unchanged'
+            })
         
-        # Convert to list with full details from content_df
+        # Generate recommendations
+        with _STAGE_SCORING.time():
+            recommendations = snapshot.recommender.recommend(
+                user_level=user_level,
+                learning_goals=learning_goals,
+                completed_lessons=completed_lessons,
+                n=10,
+                filters=filters
+            )
+        
+        # Recommendations already carry the full record (title, description, type, route)
+        enrich_started = time.perf_counter()
+        debug = logger.isEnabledFor(logging.DEBUG)
         recs_list = []
-        for _, row in recommendations.iterrows():
-            # Get full content info including correct route
-            content_info = _content_df[_content_df['id'] == row['id']].iloc[0]
-            
+        for rec in recommendations.to_dict('records'):
             recs_list.append({
-                'id': row['id'],
-                'title': content_info['title'],  # Use actual title from Firebase
-                'category': row['category'],
-                'level': row['level'],
-                'score': float(row['score']),
-                'description': content_info['description'],
-                'type': content_info['type'],
-                'route': content_info['route']  # Use correct route from content_df
+                'id': rec['id'],
+                'title': rec['title'],
+                'category': rec['category'],
+                'level': rec['level'],
+                'score': float(rec['score']),
+                'description': rec['description'],
+                'type': rec['type'],
+                'route': rec['route']
             })
             
-            print(f"  ✅ {content_info['title']} (score: {row['score']:.2f})")
+            if debug:
+                logger.debug("  ✅ %s (score: %.2f)", rec['title'], rec['score'], extra={'sample': True})
+        _STAGE_ENRICH.observe(time.perf_counter() - enrich_started)
         
-        # Save to Firebase
+        # Save to Firebase (queued; committed in the background)
         recommendation_data = {
             'userId': user_id,
             'recommendations': recs_list,
             'userLevel': user_level,
             'learningGoals': learning_goals,
+            'filters': data.get('filters') or None,
+            'fingerprint': fingerprint,
+            'modelVersion': snapshot.version,
             'generatedAt': firestore.SERVER_TIMESTAMP,
             'totalRecommendations': len(recs_list)
         }
         
-        db.collection('recommendations').document(user_id).set(recommendation_data)
+        with _STAGE_ENQUEUE_WRITE.time():
+            _recommendation_writer.enqueue('recommendations', user_id, recommendation_data)
+        _REQUESTS_OK.inc()
         
-        print(f"✅ Generated {len(recs_list)} recommendations for {user_id}\n")
+        logger.info(
+            "✅ Generated %d recommendations for %s", len(recs_list), user_id,
+            extra={'user_id': user_id, 'model_version': snapshot.version}
+        )
         
         return jsonify({
             'success': True,
             'recommendations': len(recs_list),
+            'cached': False,
             'message': 'Recommendations generated successfully'
         })
         
     except Exception as e:
-        print(f"❌ Error: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        _REQUESTS_ERROR.inc()
+        logger.exception("❌ Error generating recommendations: %s", e)
         
         return jsonify({
             'success': False,
             'error': str(e)
         }), 500
+    
+    finally:
+        _STAGE_TOTAL.observe(time.perf_counter() - started)
 
 
 # ========================================
@@ -279,18 +593,48 @@ def generate_recommendations():
 @app.route('/api/reload-content', methods=['POST'])
 def reload_content():
     """
-    Reload content and retrain model
+    Reload content and retrain model in the background
     Call this when you add new lessons
+    
+    Returns a job id immediately; poll GET /api/health?jobId=... for its status.
+    A reload that is already running is reused instead of starting another.
+    Under the prefork server the master builds the new generation instead
+    (no job id; watch model_version / server.generation in /api/health).
     """
+    global _reload_journal
+    
+    if prefork.is_worker():
+        return _request_generation()
+    
     try:
-        db = firestore.client()
-        load_content_and_train(db)
+        with _update_lock:
+            job = next(
+                (job for job in _reload_jobs.values() if job['status'] in ('pending', 'running')),
+                None
+            )
+            if job is None:
+                job = {
+                    'jobId': uuid.uuid4().hex[:12],
+                    'status': 'pending',
+                    'startedAt': pd.Timestamp.now().isoformat(),
+                    'finishedAt': None,
+                    'version': None,
+                    'totalItems': None,
+                    'error': None
+                }
+                _reload_jobs[job['jobId']] = job
+                while len(_reload_jobs) > MAX_RELOAD_JOBS:
+                    _reload_jobs.popitem(last=False)
+                
+                _reload_journal = []
+                threading.Thread(target=_run_reload_job, args=(job,), daemon=True).start()
         
         return jsonify({
             'success': True,
-            'message': 'Content reloaded and model retrained',
-            'totalItems': len(_content_df)
-        })
+            'message': 'Content reload started',
+            'jobId': job['jobId'],
+            'status': job['status']
+        }), 202
         
     except Exception as e:
         return jsonify({
@@ -299,18 +643,364 @@ def reload_content():
         }), 500
 
 
+def _run_reload_job(job):
+    """Build a new snapshot off the request path, then publish it with one swap"""
+    global _reload_journal, _refit_journal
+    
+    job['status'] = 'running'
+    try:
+        snapshot = build_snapshot(get_content_source())
+        if snapshot is None:
+            raise RuntimeError('No content found')
+        
+        with _update_lock:
+            # Replay upserts / deletes that landed while the reload was running
+            journal, _reload_journal = _reload_journal, None
+            if journal:
+                snapshot = make_snapshot(_replay(snapshot.recommender, journal))
+            
+            # A background refit still running would publish an older catalog
+            _refit_journal = None
+            _publish(snapshot)
+        
+        job.update(status='succeeded', version=snapshot.version, totalItems=snapshot.total_items)
+        
+    except Exception as e:
+        with _update_lock:
+            _reload_journal = None
+        job.update(status='failed', error=str(e))
+        logger.exception("❌ Reload failed: %s", e)
+    
+    finally:
+        job['finishedAt'] = pd.Timestamp.now().isoformat()
+
+
+# ========================================
+# API: Incremental content updates
+# ========================================
+
+def _request_generation():
+    """Prefork workers never reload their own copy of the model, the master reloads all of them"""
+    prefork.request_reload()
+    return jsonify({
+        'success': True,
+        'message': 'Reload requested from the master process',
+        'status': 'requested',
+        'generation': prefork.info()['generation']
+    }), 202
+
+
+def flush_worker():
+    """Commit the queued recommendation writes before a prefork worker exits (it skips atexit)"""
+    _recommendation_writer.flush(5.0)
+
+
+def _forward_edit(edit):
+    """Prefork workers hand edits to the master, which applies them and re-forks every worker"""
+    try:
+        body, generation = prefork.send_update(edit)
+    except RuntimeError as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 503
+    return jsonify({**body, 'generation': generation})
+
+
+def _publish(snapshot, persist=True):
+    """Make a snapshot visible to requests (single reference swap, caller holds _update_lock)"""
+    global _snapshot
+    _snapshot = snapshot
+    if persist:
+        _schedule_persist(snapshot)
+
+
+def _record_edit(action, payload):
+    """Remember an edit so a running reload / refit can replay it on the snapshot it builds"""
+    for journal in (_reload_journal, _refit_journal):
+        if journal is not None:
+            journal.append((action, payload))
+
+
+def _replay(recommender, journal):
+    """A copy of recommender with the journalled upserts / deletes applied"""
+    recommender = recommender.clone()
+    for action, payload in journal:
+        if action == 'upsert':
+            recommender.upsert_items(pd.DataFrame(payload))
+        else:
+            recommender.remove_items(payload)
+    return recommender
+
+
+def _maybe_start_refit():
+    """Start a background full refit once incremental drift passes the threshold"""
+    global _refit_thread
+    
+    if _snapshot.recommender.drift < REFIT_DRIFT_THRESHOLD:
+        return False
+    if _refit_thread is not None and _refit_thread.is_alive():
+        return False
+    
+    _refit_thread = threading.Thread(target=_background_refit, daemon=True)
+    _refit_thread.start()
+    return True
+
+
+def _background_refit():
+    """
+    Refit vocabulary and IDF on the current catalog, then swap the model in
+    The fit runs outside _update_lock (edits keep going and are replayed afterwards)
+    """
+    global _refit_journal
+    
+    try:
+        with _update_lock:
+            # Published models are never modified, so this one can be read without the lock
+            current = _snapshot.recommender
+            _refit_journal = []
+        
+        logger.info("🔧 Drift reached %d changes, refitting in background...", current.drift)
+        recommender = refit_model(current)
+        
+        with _update_lock:
+            journal, _refit_journal = _refit_journal, None
+            if journal is None:
+                logger.info("🔧 A reload published a newer model meanwhile, dropping the refit")
+                return
+            if journal:
+                recommender = _replay(recommender, journal)
+            _publish(make_snapshot(recommender))
+    except Exception as e:
+        with _update_lock:
+            _refit_journal = None
+        logger.exception("❌ Background refit failed: %s", e)
+
+
+def refit_model(current):
+    """A new model fitted on current's catalog (a sharded model refits only the edited shards)"""
+    if isinstance(current, ShardedRecommender):
+        return current.refit()
+    recommender = new_recommender()
+    recommender.fit(current.content_df.drop(columns='features', errors='ignore'))
+    return recommender
+
+
+def apply_upsert(collection, ids, background=True):
+    """
+    Fetch items from the content source and upsert them into a copy of the published model
+    Returns the response body; background=False leaves saving and refitting to the caller
+    """
+    records, missing = get_content_source().fetch(collection, ids)
+    
+    with _update_lock:
+        # Ids already used by the other collection are not overwritten
+        conflicts = []
+        for record in list(records):
+            existing = _snapshot.recommender.get_item(record['id'])
+            if existing is not None and existing.get('type') != record['type']:
+                conflicts.append(record['id'])
+                records.remove(record)
+        
+        # Nothing to upsert: keep the published model (and its version)
+        updated = _snapshot.recommender
+        if records:
+            updated = updated.clone()
+            updated.upsert_items(pd.DataFrame(records))
+            _record_edit('upsert', records)
+            _publish(make_snapshot(updated), persist=background)
+        refit_scheduled = _maybe_start_refit() if background else updated.drift >= REFIT_DRIFT_THRESHOLD
+    
+    logger.info("✅ Upserted %d items from %s", len(records), collection)
+    return {
+        'success': True,
+        'upserted': len(records),
+        'missing': missing,
+        'conflicts': conflicts,
+        'totalItems': updated.item_count,
+        'drift': updated.drift,
+        'refitScheduled': refit_scheduled
+    }
+
+
+def apply_delete(ids, background=True):
+    """Remove items from a copy of the published model; returns the response body"""
+    with _update_lock:
+        updated = _snapshot.recommender.clone()
+        removed = updated.remove_items(ids)
+        # A running reload may still bring these ids back, so the edit is journalled anyway
+        _record_edit('delete', ids)
+        if removed:
+            _publish(make_snapshot(updated), persist=background)
+        refit_scheduled = _maybe_start_refit() if background else updated.drift >= REFIT_DRIFT_THRESHOLD
+    
+    logger.info("✅ Removed %d items", removed)
+    return {
+        'success': True,
+        'removed': removed,
+        'totalItems': updated.item_count,
+        'drift': updated.drift,
+        'refitScheduled': refit_scheduled
+    }
+
+
+@app.route('/api/content/upsert', methods=['POST'])
+def upsert_content():
+    """
+    Add or replace catalog items without a full retrain
+    Call this after editing a lesson or video
+    
+    Request:
+    {
+        "collection": "lessonContent",   // or "videos"
+        "ids": ["grammar-1"]
+    }
+    """
+    try:
+        data = request.json or {}
+        collection = data.get('collection')
+        ids = data.get('ids') or []
+        
+        if collection not in RECORD_BUILDERS:
+            return jsonify({
+                'success': False,
+                'error': f"collection must be one of {', '.join(RECORD_BUILDERS)}"
+            }), 400
+        
+        if not ids:
+            return jsonify({
+                'success': False,
+                'error': 'ids is required'
+            }), 400
+        
+        if _snapshot is None:
+            return jsonify({
+                'success': False,
+                'error': 'Recommendation model not loaded'
+            }), 503
+        
+        if prefork.is_worker():
+            return _forward_edit({'action': 'upsert', 'collection': collection, 'ids': ids})
+        
+        return jsonify(apply_upsert(collection, ids))
+        
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+
+@app.route('/api/content/delete', methods=['POST'])
+def delete_content():
+    """
+    Remove catalog items without a full retrain
+    
+    Request:
+    {
+        "ids": ["grammar-1"]
+    }
+    """
+    try:
+        data = request.json or {}
+        ids = data.get('ids') or []
+        
+        if not ids:
+            return jsonify({
+                'success': False,
+                'error': 'ids is required'
+            }), 400
+        
+        if _snapshot is None:
+            return jsonify({
+                'success': False,
+                'error': 'Recommendation model not loaded'
+            }), 503
+        
+        if prefork.is_worker():
+            return _forward_edit({'action': 'delete', 'ids': ids})
+        
+        return jsonify(apply_delete(ids))
+        
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+
+# ========================================
+# API: Metrics
+# ========================================
+
+def _ranking_cache_lookups():
+    snapshot = _snapshot
+    if snapshot is None:
+        return None
+    info = snapshot.recommender.cache_info()
+    return {('hit',): info['hits'], ('miss',): info['misses']}
+
+
+metrics.GaugeFunction(
+    'smartlearning_ranking_cache_lookups',
+    'Ranking cache lookups of the published model',
+    _ranking_cache_lookups,
+    ['result']
+)
+metrics.GaugeFunction(
+    'smartlearning_write_behind_depth',
+    'Recommendation documents waiting to be written',
+    lambda: _recommendation_writer.stats()['depth']
+)
+metrics.GaugeFunction(
+    'smartlearning_model_items',
+    'Items in the published model',
+    lambda: _snapshot.total_items if _snapshot is not None else 0
+)
+
+
+@app.route('/api/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Latency histograms and counters in Prometheus text format"""
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+
 # ========================================
 # API: Health check
 # ========================================
 
 @app.route('/api/health', methods=['GET'])
 def health():
-    """Health check"""
+    """
+    Health check
+    Pass ?jobId=... to get the status of a specific reload job
+    """
+    snapshot = _snapshot
+    recommender = snapshot.recommender if snapshot is not None else None
+    
+    job_id = request.args.get('jobId')
+    if job_id:
+        reload_job = _reload_jobs.get(job_id)
+    else:
+        reload_job = next(reversed(_reload_jobs.values()), None)
+    
     return jsonify({
         'status': 'healthy',
-        'recommendation_model_loaded': _recommender is not None,
-        'total_content': len(_content_df) if _content_df is not None else 0,
-        'last_updated': _last_updated.isoformat() if _last_updated else None
+        'recommendation_model_loaded': snapshot is not None,
+        'model_version': snapshot.version if snapshot is not None else None,
+        'total_content': snapshot.total_items if snapshot is not None else 0,
+        'last_updated': snapshot.last_updated.isoformat() if snapshot is not None else None,
+        'ranking_cache': recommender.cache_info() if recommender is not None else None,
+        'content_drift': recommender.drift if recommender is not None else 0,
+        'model_compact': recommender.compact if recommender is not None else None,
+        'refit_running': _refit_thread is not None and _refit_thread.is_alive(),
+        'reload_job': dict(reload_job) if reload_job is not None else None,
+        'write_behind': _recommendation_writer.stats(),
+        'cooccurrence': _cooccurrence.info(),
+        'ann_index': recommender.ann_index.info() if recommender is not None and recommender.ann_index is not None else None,
+        'shards': recommender.shard_info() if isinstance(recommender, ShardedRecommender) else None,
+        'server': prefork.info(),
+        'logging': logging_setup.log_stats()
     })
 
 
@@ -331,6 +1021,9 @@ def health():
 # ========================================
 
 if __name__ == '__main__':
+    # Logs go through a queue to a background thread, so requests never wait on stdout
+    logging_setup.setup_logging()
+    
     print("="*60)
     print("🚀 Starting Combined API Server")
     print("   - Speaking API")
@@ -339,24 +1032,51 @@ if __name__ == '__main__':
     
     # Initialize Firebase
     try:
-        db = init_firebase()
-        
-        # Load content and train recommendation model
-        load_content_and_train(db)
+        init_firebase()
     except Exception as e:
         print(f"⚠️  Warning: {e}")
-        print("⚠️  Recommendation system may not work")
+    
+    if not prefork.PREFORK_WORKERS:
+        try:
+            # Use the saved model snapshot if it is fresh, otherwise load content and train
+            snapshot = load_persisted_snapshot()
+            if snapshot is not None:
+                with _update_lock:
+                    _publish(snapshot, persist=False)
+            else:
+                load_content_and_train(get_content_source())
+        except Exception as e:
+            print(f"⚠️  Warning: {e}")
+            print("⚠️  Recommendation system may not work")
+        
+        # Co-occurrence is seeded in the background; recommendations work without it meanwhile
+        threading.Thread(target=_seed_cooccurrence, daemon=True).start()
     
     print("="*60)
     print("📍 API Endpoints:")
     print("   POST /api/generate-recommendations  - Generate recommendations")
-    print("   POST /api/reload-content            - Reload content")
+    print("   POST /api/reload-content            - Reload content (background job)")
+    print("   POST /api/content/upsert            - Add/replace content items")
+    print("   POST /api/content/delete            - Remove content items")
     print("   GET  /api/health                    - Health check")
     print("   ...  (your speaking endpoints)")
     print("="*60)
-    print("✅ Server ready! Listening on http://localhost:5000")
-    print("="*60)
-    print()
     
-    # Start server
-    app.run(debug=True, port=5000, host='0.0.0.0')
\ No newline at end of file
+    if prefork.PREFORK_WORKERS:
+        # Production: the master loads / trains once (load_generation) and forks workers
+        # that share the model copy-on-write; `kill -HUP <master pid>` reloads all of them,
+        # content edits are applied by the master (apply_worker_edit) and re-fork them
+        print(f"✅ Master {os.getpid()} starting {prefork.PREFORK_WORKERS} workers on http://localhost:5000")
+        print("="*60)
+        print()
+        prefork.PreforkServer(
+            app, load_generation, update=apply_worker_edit, port=5000, workers=prefork.PREFORK_WORKERS,
+            on_worker_exit=[flush_worker, logging_setup.stop_logging]
+        ).serve_forever()
+    else:
+        print("✅ Server ready! Listening on http://localhost:5000")
+        print("="*60)
+        print()
+        
+        # Start server
+        app.run(debug=True, port=5000, host='0.0.0.0')
\ No newline at end of file
@@ -0,0 +1,299 @@
+"""
+Content sources for the recommendation catalog
+Includes:
+1. Firestore (lessonContent + videos collections)
+2. Local files (the lesson JSON bundled with the frontend in src/data, plus
+   src/data/seedCatalog.json: the seed scripts' lessons and the videos, exported
+   by src/scripts/exportSeedCatalog.mjs)
+
+Every source returns the catalog as columns:
+{'id': [...], 'title': [...], 'category': [...], 'level': [...],
+ 'description': [...], 'type': [...], 'route': [...]}
+"""
+
+import glob
+import json
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+CATALOG_COLUMNS = ['id', 'title', 'category', 'level', 'description', 'type', 'route']
+
+# Bundled lesson JSON only has a difficulty, map it onto CEFR levels
+DIFFICULTY_LEVELS = {
+    'beginner': 'A1',
+    'elementary': 'A2',
+    'intermediate': 'B1',
+    'upper-intermediate': 'B2',
+    'advanced': 'C1',
+    'proficient': 'C2',
+}
+
+DEFAULT_LOCAL_DATA_DIR = os.path.normpath(os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), '..', 'src', 'data'
+))
+
+# {"lessons": [...], "videos": [...]} exported from the TypeScript seed data; regenerate
+# with `node src/scripts/exportSeedCatalog.mjs` after editing the seed scripts or videoContent.ts
+DEFAULT_SEED_CATALOG = 'seedCatalog.json'
+
+
+# ========================================
+# Firestore document -> catalog record
+# ========================================
+
+def lesson_record(lesson_id, data):
+    """Convert a lessonContent document into a catalog record"""
+    # Get title - try multiple sources
+    title = None
+    if 'title' in data and data['title']:
+        title = data['title']
+    elif 'introduction' in data and isinstance(data['introduction'], dict):
+        intro = data['introduction']
+        if 'title' in intro and intro['title']:
+            title = intro['title']
+    
+    # If still no title, use lesson ID
+    if not title:
+        title = f"Lesson {lesson_id}"
+    
+    # Get description
+    description = ""
+    if 'introduction' in data and isinstance(data['introduction'], dict):
+        intro = data['introduction']
+        description = intro.get('summary') or intro.get('description') or ""
+    if not description and 'description' in data:
+        description = data['description']
+    if not description and 'summary' in data:
+        description = data['summary']
+    if not description:
+        description = f"Learn {title.lower()}"
+    
+    # Get module ID
+    module_id = data.get('moduleId', 'general')
+    
+    # Get level
+    level = (data.get('level', 'A1')).upper()
+    
+    # Create correct route: /lesson/{moduleId}/{lessonId}
+    route = f"/lesson/{module_id}/{lesson_id}"
+    
+    return {
+        'id': lesson_id,
+        'title': title,
+        'category': module_id.capitalize(),
+        'level': level,
+        'description': description,
+        'type': 'lesson',
+        'route': route
+    }
+
+
+def video_record(video_id, data):
+    """Convert a videos document into a catalog record"""
+    title = data.get('title', f"Video {video_id}")
+    category = data.get('category', 'general')
+    level = (data.get('level', 'A1')).upper()
+    description = data.get('description', f"Watch {title.lower()}")
+    
+    # Create route for videos
+    route = f"/videos/{video_id}"
+    
+    return {
+        'id': video_id,
+        'title': title,
+        'category': category.capitalize(),
+        'level': level,
+        'description': description,
+        'type': 'video',
+        'route': route
+    }
+
+
+# Firestore collection -> record converter
+RECORD_BUILDERS = {
+    'lessonContent': lesson_record,
+    'videos': video_record,
+}
+
+
+def _append_record(columns, record):
+    for column in CATALOG_COLUMNS:
+        columns[column].append(record[column])
+
+
+# ========================================
+# Sources
+# ========================================
+
+class ContentSource:
+    """Where the recommendation catalog is loaded from"""
+    
+    name = 'base'
+    
+    def load(self):
+        """Return the whole catalog as columns (see CATALOG_COLUMNS)"""
+        raise NotImplementedError
+    
+    def fetch(self, collection, ids):
+        """
+        Re-read single items for an incremental update
+        Returns (records, missing_ids)
+        """
+        raise NotImplementedError
+
+
+class FirestoreContentSource(ContentSource):
+    """Live catalog from the lessonContent and videos collections"""
+    
+    name = 'firestore'
+    
+    def __init__(self, db):
+        self.db = db
+    
+    def load(self):
+        columns = {column: [] for column in CATALOG_COLUMNS}
+        # Per-document lines are DEBUG and sampled; by default only the summary is logged
+        debug = logger.isEnabledFor(logging.DEBUG)
+        
+        # Read Lessons from lessonContent
+        for doc in self.db.collection('lessonContent').stream():
+            record = lesson_record(doc.id, doc.to_dict())
+            _append_record(columns, record)
+            
+            if debug:
+                logger.debug("    ✅ %s → %s", record['title'], record['route'], extra={'sample': True})
+        lesson_count = len(columns['id'])
+        
+        # Read Videos
+        for doc in self.db.collection('videos').stream():
+            record = video_record(doc.id, doc.to_dict())
+            _append_record(columns, record)
+            
+            if debug:
+                logger.debug("    ✅ %s → %s", record['title'], record['route'], extra={'sample': True})
+        
+        logger.info(
+            "  📖 Read %d lessons and %d videos from Firestore",
+            lesson_count, len(columns['id']) - lesson_count
+        )
+        return columns
+    
+    def fetch(self, collection, ids):
+        records = []
+        missing = []
+        for item_id in ids:
+            doc = self.db.collection(collection).document(item_id).get()
+            if doc.exists:
+                records.append(RECORD_BUILDERS[collection](doc.id, doc.to_dict()))
+            else:
+                missing.append(item_id)
+        return records, missing
+
+
+def _lesson_entries(data):
+    """
+    Lesson metadata from a bundled JSON file. Files are either
+    {lessonId: metadata, ...} or {"lessonMetadata": ..., "lessonContent": ...}
+    """
+    if isinstance(data, dict) and 'lessonMetadata' in data:
+        data = data['lessonMetadata']
+    if isinstance(data, dict):
+        data = [data] if 'id' in data else list(data.values())
+    return [entry for entry in data if isinstance(entry, dict) and 'id' in entry]
+
+
+def _local_level(entry):
+    level = entry.get('level') or entry.get('recommendedLevel') or entry.get('requiredLevel')
+    if not level or level.lower() in DIFFICULTY_LEVELS:
+        level = DIFFICULTY_LEVELS.get((level or entry.get('difficulty') or '').lower(), 'A1')
+    return level.upper()
+
+
+def _local_lesson_record(lesson):
+    lesson_id = lesson['id']
+    module_id = lesson.get('moduleId', 'general')
+    title = lesson.get('title') or f"Lesson {lesson_id}"
+    return {
+        'id': lesson_id,
+        'title': title,
+        'category': module_id.capitalize(),
+        'level': _local_level(lesson),
+        'description': lesson.get('description') or f"Learn {title.lower()}",
+        'type': 'lesson',
+        'route': f"/lesson/{module_id}/{lesson_id}",
+    }
+
+
+def _local_video_record(video):
+    record = video_record(video['id'], video)
+    record['level'] = _local_level(video)
+    return record
+
+
+class LocalContentSource(ContentSource):
+    """
+    Offline catalog from the data bundled with the frontend
+    
+    - lessons: the *_Lessons_Complete.json files in data_dir and the lessons of
+      the seed catalog export (seed_catalog, relative to data_dir; None skips it)
+    - videos: the seed catalog export
+    When the same id appears twice the first record wins (lesson JSON first).
+    No network needed; useful for benchmarks and load tests.
+    """
+    
+    name = 'local'
+    
+    def __init__(self, data_dir=DEFAULT_LOCAL_DATA_DIR, pattern='*_Lessons_Complete.json',
+                 seed_catalog=DEFAULT_SEED_CATALOG):
+        self.data_dir = data_dir
+        self.pattern = pattern
+        self.seed_catalog = seed_catalog
+    
+    def _paths(self):
+        return sorted(glob.glob(os.path.join(self.data_dir, self.pattern)))
+    
+    def records(self):
+        """Catalog records in load order, one per id"""
+        records = {}
+        
+        json_paths = self._paths()
+        for path in json_paths:
+            with open(path, encoding='utf-8') as f:
+                for lesson in _lesson_entries(json.load(f)):
+                    records.setdefault(lesson['id'], _local_lesson_record(lesson))
+        
+        if self.seed_catalog:
+            path = os.path.join(self.data_dir, self.seed_catalog)
+            try:
+                with open(path, encoding='utf-8') as f:
+                    seed = json.load(f)
+            except (OSError, ValueError) as e:
+                logger.warning("⚠️  Skipping the seed catalog %s: %s", path, e)
+                seed = {}
+            for lesson in seed.get('lessons', []):
+                records.setdefault(lesson['id'], _local_lesson_record(lesson))
+            for video in seed.get('videos', []):
+                records.setdefault(video['id'], _local_video_record(video))
+        
+        logger.info("  📁 Read %d items from %d lesson files and the seed catalog", len(records), len(json_paths))
+        return list(records.values())
+    
+    def load(self):
+        columns = {column: [] for column in CATALOG_COLUMNS}
+        for record in self.records():
+            _append_record(columns, record)
+        return columns
+    
+    def fetch(self, collection, ids):
+        kind = 'video' if collection == 'videos' else 'lesson'
+        rows = {record['id']: record for record in self.records() if record['type'] == kind}
+        records = []
+        missing = []
+        for item_id in ids:
+            if item_id in rows:
+                records.append(rows[item_id])
+            else:
+                missing.append(item_id)
+        return records, missing
@@ -0,0 +1,164 @@
+"""
+Non-blocking log pipeline for the API servers
+
+Request threads never write to the terminal themselves:
+- the root logger gets one QueueHandler; records are put on a bounded queue
+  (dropped and counted when it is full, instead of blocking)
+- a QueueListener thread formats them (text or JSON) and writes to stdout
+- per-item records (one per document / recommendation) are marked with
+  extra={'sample': True} and kept at LOG_SAMPLE_RATE
+- the listener is paused around os.fork() and restarted in both processes, so
+  pre-fork workers (prefork.py) keep logging
+
+Settings (environment):
+    LOG_LEVEL        DEBUG / INFO (default) / WARNING / ...
+    LOG_FORMAT       text (default) or json
+    LOG_SAMPLE_RATE  fraction of per-item records to keep, 0..1 (default 1)
+    LOG_QUEUE_SIZE   records buffered before dropping (default 10000)
+"""
+
+from logging.handlers import QueueHandler, QueueListener
+import atexit
+import copy
+import datetime
+import json
+import logging
+import os
+import queue
+import random
+import sys
+import threading
+
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'text').lower()
+LOG_SAMPLE_RATE = float(os.getenv('LOG_SAMPLE_RATE', '1'))
+LOG_QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', '10000'))
+
+TEXT_FORMAT = '%(asctime)s %(levelname)-7s %(name)s: %(message)s'
+
+# Attributes every LogRecord has; anything else was passed through extra={...}
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime', 'sample'}
+
+_listener = None
+_queue_handler = None
+_setup_lock = threading.Lock()
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line; extra={...} fields are included as keys"""
+
+    def format(self, record):
+        entry = {
+            'ts': datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'thread': record.threadName,
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES:
+                entry[key] = value
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """Keep only a fraction of the records marked with extra={'sample': True}"""
+
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        if getattr(record, 'sample', False) and self.rate < 1:
+            return self.rate > 0 and random.random() < self.rate
+        return True
+
+
+class DroppingQueueHandler(QueueHandler):
+    """QueueHandler that drops records (and counts them) instead of blocking on a full queue"""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Render message and traceback on the calling thread (arguments may change later),
+        # but keep the traceback separate so the JSON formatter can put it in its own field
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def setup_logging(level=LOG_LEVEL, fmt=LOG_FORMAT, sample_rate=LOG_SAMPLE_RATE, queue_size=LOG_QUEUE_SIZE):
+    """Route the root logger through the background queue (safe to call more than once)"""
+    global _listener, _queue_handler
+
+    with _setup_lock:
+        if _listener is not None:
+            return _queue_handler
+
+        output = logging.StreamHandler(sys.stdout)
+        output.setFormatter(JsonFormatter() if fmt == 'json' else logging.Formatter(TEXT_FORMAT))
+
+        _queue_handler = DroppingQueueHandler(queue.Queue(maxsize=queue_size))
+        _queue_handler.addFilter(SamplingFilter(sample_rate))
+
+        root = logging.getLogger()
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+        root.addHandler(_queue_handler)
+        root.setLevel(level)
+
+        _listener = QueueListener(_queue_handler.queue, output, respect_handler_level=True)
+        _listener.start()
+        atexit.register(stop_logging)
+        return _queue_handler
+
+
+def stop_logging():
+    """Flush whatever is still queued (called at exit)"""
+    global _listener
+    with _setup_lock:
+        if _listener is not None:
+            _listener.stop()
+            _listener = None
+
+
+def _pause_for_fork():
+    # The listener thread must not hold the queue's lock while the process forks
+    if _listener is not None:
+        _listener.stop()
+
+
+def _resume_after_fork():
+    # In the parent and in the child alike (threads do not survive fork)
+    if _listener is not None:
+        _listener.start()
+
+
+os.register_at_fork(
+    before=_pause_for_fork, after_in_parent=_resume_after_fork, after_in_child=_resume_after_fork
+)
+
+
+def log_stats():
+    """Queue depth and dropped records, for the health endpoints"""
+    if _queue_handler is None:
+        return None
+    return {
+        'depth': _queue_handler.queue.qsize(),
+        'dropped': _queue_handler.dropped,
+    }
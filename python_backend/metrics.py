@@ -0,0 +1,306 @@
+"""
+Low-overhead latency histograms and counters, exposed in Prometheus text format
+
+Recording is meant to stay on in production:
+- every thread accumulates into its own preallocated slot, so observe() / inc()
+  take no lock and allocate nothing (one bisect plus two list increments)
+- slots are keyed by thread id and reused when the id is reused, so per-request
+  threads (Flask's threaded dev server) don't grow the registry
+- the per-thread slots are only summed when /api/metrics is scraped
+
+Usage:
+    STAGE_SECONDS = metrics.Histogram('app_stage_seconds', 'Latency per stage', ['stage'])
+    _FIT = STAGE_SECONDS.labels('fit')       # bind children once, at import time
+
+    with _FIT.time():
+        ...
+"""
+
+from bisect import bisect_left
+import math
+import threading
+import time
+
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Request paths: 0.5 ms .. 10 s
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Loading / training: 50 ms .. 10 min
+SLOW_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0)
+
+_local = threading.local()
+
+
+class Registry:
+    """Named collection of metrics rendered together"""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f'Metric {metric.name} is already registered')
+            self._metrics[metric.name] = metric
+
+    def render(self):
+        """Prometheus text exposition format"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+
+        lines = []
+        for metric in metrics:
+            lines.append(f'# HELP {metric.name} {metric.documentation}')
+            lines.append(f'# TYPE {metric.name} {metric.type_name}')
+            lines.extend(metric.samples())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+
+def render(registry=REGISTRY):
+    return registry.render()
+
+
+# ========================================
+# Formatting
+# ========================================
+
+def _format_value(value):
+    if value is None:
+        return 'NaN'
+    if isinstance(value, float):
+        if math.isinf(value):
+            return '+Inf' if value > 0 else '-Inf'
+        return repr(value)
+    return str(value)
+
+
+def _format_labels(pairs):
+    if not pairs:
+        return ''
+    escaped = (
+        (name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in pairs
+    )
+    return '{' + ','.join(f'{name}="{value}"' for name, value in escaped) + '}'
+
+
+# ========================================
+# Per-thread accumulation
+# ========================================
+
+class _PerThread:
+    """A metric child whose samples are accumulated in per-thread slots"""
+
+    def __init__(self):
+        self._slots = {}              # thread id -> slot (list)
+        self._lock = threading.Lock()
+
+    def _new_slot(self):
+        raise NotImplementedError
+
+    def _slot(self):
+        cache = getattr(_local, 'slots', None)
+        if cache is None:
+            cache = _local.slots = {}
+
+        slot = cache.get(self)
+        if slot is None:
+            # First use on this thread: reuse the slot of a finished thread with the same id
+            ident = threading.get_ident()
+            with self._lock:
+                slot = self._slots.get(ident)
+                if slot is None:
+                    slot = self._slots[ident] = self._new_slot()
+            cache[self] = slot
+        return slot
+
+    def _all_slots(self):
+        with self._lock:
+            return list(self._slots.values())
+
+
+class _CounterChild(_PerThread):
+
+    def _new_slot(self):
+        return [0]
+
+    def inc(self, amount=1):
+        self._slot()[0] += amount
+
+    def value(self):
+        return sum(slot[0] for slot in self._all_slots())
+
+
+class _Timer:
+    __slots__ = ('_child', '_started')
+
+    def __init__(self, child):
+        self._child = child
+
+    def __enter__(self):
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self._child.observe(time.perf_counter() - self._started)
+        return False
+
+
+class _HistogramChild(_PerThread):
+
+    def __init__(self, bounds):
+        super().__init__()
+        self.bounds = bounds
+
+    def _new_slot(self):
+        # One count per bucket (the last one is +Inf), then the running sum
+        return [0] * (len(self.bounds) + 1) + [0.0]
+
+    def observe(self, value):
+        slot = self._slot()
+        slot[bisect_left(self.bounds, value)] += 1
+        slot[-1] += value
+
+    def time(self):
+        """Context manager observing the wall time of its block"""
+        return _Timer(self)
+
+    def snapshot(self):
+        """(non-cumulative bucket counts, sum) over all threads"""
+        counts = [0] * (len(self.bounds) + 1)
+        total = 0.0
+        for slot in self._all_slots():
+            for i in range(len(counts)):
+                counts[i] += slot[i]
+            total += slot[-1]
+        return counts, total
+
+
+# ========================================
+# Metric families
+# ========================================
+
+class _Family:
+    """A named metric with zero or more labels; each label combination is a child"""
+
+    type_name = None
+
+    def __init__(self, name, documentation, labelnames=(), registry=REGISTRY):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+        if not self.labelnames:
+            self._children[()] = self._new_child()
+        if registry is not None:
+            registry.register(self)
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def labels(self, *values):
+        """The child for these label values; bind it once and keep it"""
+        values = tuple(str(value) for value in values)
+        if len(values) != len(self.labelnames):
+            raise ValueError(f'{self.name} expects labels {self.labelnames}, got {values}')
+
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def _items(self):
+        with self._lock:
+            return sorted(self._children.items())
+
+    def _label_pairs(self, values):
+        return list(zip(self.labelnames, values))
+
+
+class Counter(_Family):
+    type_name = 'counter'
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount=1):
+        self._children[()].inc(amount)
+
+    def samples(self):
+        for values, child in self._items():
+            yield f'{self.name}_total{_format_labels(self._label_pairs(values))} {_format_value(child.value())}'
+
+
+class Histogram(_Family):
+    type_name = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS, registry=REGISTRY):
+        self.bounds = tuple(sorted(float(bound) for bound in buckets if not math.isinf(bound)))
+        super().__init__(name, documentation, labelnames, registry)
+
+    def _new_child(self):
+        return _HistogramChild(self.bounds)
+
+    def observe(self, value):
+        self._children[()].observe(value)
+
+    def time(self):
+        return self._children[()].time()
+
+    def samples(self):
+        for values, child in self._items():
+            pairs = self._label_pairs(values)
+            counts, total = child.snapshot()
+
+            cumulative = 0
+            for bound, count in zip(self.bounds + (math.inf,), counts):
+                cumulative += count
+                labels = _format_labels(pairs + [('le', _format_value(bound))])
+                yield f'{self.name}_bucket{labels} {cumulative}'
+            yield f'{self.name}_sum{_format_labels(pairs)} {_format_value(total)}'
+            yield f'{self.name}_count{_format_labels(pairs)} {cumulative}'
+
+
+class GaugeFunction:
+    """
+    Gauge read from a callback at scrape time (cache sizes, queue depths, ...)
+
+    The callback returns a number, or {label values tuple: number} when labelnames are set.
+    """
+
+    type_name = 'gauge'
+
+    def __init__(self, name, documentation, function, labelnames=(), registry=REGISTRY):
+        self.name = name
+        self.documentation = documentation
+        self.function = function
+        self.labelnames = tuple(labelnames)
+        if registry is not None:
+            registry.register(self)
+
+    def samples(self):
+        try:
+            value = self.function()
+        except Exception:
+            return
+
+        if not self.labelnames:
+            if value is not None:
+                yield f'{self.name} {_format_value(value)}'
+            return
+
+        for values, item in sorted((value or {}).items()):
+            if item is None:
+                continue
+            if not isinstance(values, tuple):
+                values = (values,)
+            labels = _format_labels(list(zip(self.labelnames, values)))
+            yield f'{self.name}{labels} {_format_value(item)}'
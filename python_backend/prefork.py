@@ -0,0 +1,527 @@
+"""
+Pre-fork server for the API processes
+
+The master process builds the model once, binds the listening socket and forks
+the workers. Every worker serves requests with werkzeug's threaded WSGI server on
+the inherited socket. The trained arrays are shared copy-on-write, so a worker
+only pays for the pages it writes to (interpreter state, request buffers, its
+ranking cache); see "Production server" in the README for measured numbers.
+
+Reloads are coordinated by the master, so workers never serve different models:
+- SIGHUP (from an operator, or from a worker through request_reload()) makes the
+  master call load() again while the current workers keep serving
+- when load() succeeds, a new generation of workers is forked from the new model
+  and the old workers get SIGTERM; they stop accepting connections and exit once
+  their in-flight requests are done
+- when load() fails, the current generation keeps serving
+- a worker that dies is replaced from the current generation
+Incremental edits work the same way without a rebuild: a worker hands the edit to
+the master (send_update(), over a socket pair per worker), the master applies it
+to its own model with update() and forks the next generation from the result.
+Edits that arrive within PREFORK_UPDATE_DEBOUNCE of each other share one generation;
+when none of them changed the model (failed, or nothing to do) the workers keep running.
+SIGTERM / SIGINT stop the master, which drains all workers first.
+
+Locks held by another thread at fork() stay locked in the child, so load() must
+not leave threads running in the master (logging_setup pauses its listener
+around fork() by itself).
+
+Settings (environment):
+    PREFORK_WORKERS           worker processes; 0 (default) keeps the dev server
+    PREFORK_GRACEFUL_TIMEOUT  seconds a stopping worker may take (default 30)
+    PREFORK_UPDATE_TIMEOUT    seconds a worker waits for the master to apply an update (default 60)
+    PREFORK_UPDATE_DEBOUNCE   seconds the master collects further updates before applying them (default 0.5)
+
+Usage:
+    server = PreforkServer(app, load_model, update=apply_edit, host='0.0.0.0', port=5000, workers=4,
+                           on_worker_exit=[flush_writes, logging_setup.stop_logging])
+    server.serve_forever()
+"""
+
+import gc
+import itertools
+import json
+import logging
+import os
+import select
+import signal
+import socket
+import threading
+import time
+
+from werkzeug.serving import make_server
+
+logger = logging.getLogger(__name__)
+
+PREFORK_WORKERS = int(os.getenv('PREFORK_WORKERS', '0'))
+PREFORK_GRACEFUL_TIMEOUT = float(os.getenv('PREFORK_GRACEFUL_TIMEOUT', '30'))
+PREFORK_UPDATE_TIMEOUT = float(os.getenv('PREFORK_UPDATE_TIMEOUT', '60'))
+PREFORK_UPDATE_DEBOUNCE = float(os.getenv('PREFORK_UPDATE_DEBOUNCE', '0.5'))
+
+# Firestore talks gRPC; channels the master opened while loading must survive fork().
+# These are read when grpc is imported, so this module is imported before firebase_admin.
+# The dev server (no workers) keeps gRPC's defaults.
+if PREFORK_WORKERS > 0:
+    os.environ.setdefault('GRPC_ENABLE_FORK_SUPPORT', 'true')
+    os.environ.setdefault('GRPC_POLL_STRATEGY', 'poll')
+
+# Set in worker processes only
+_master_pid = None
+_worker_info = None
+_channel = None                  # this worker's end of the socket pair to the master
+_channel_buffer = bytearray()
+_channel_send_lock = threading.Lock()
+# Several request threads may wait for replies; one of them at a time reads the channel
+_replies_condition = threading.Condition()
+_replies = {}                    # message id -> reply, for the threads still waiting
+_waiting = set()
+_receiving = False
+_message_ids = itertools.count(1)
+
+
+def is_worker():
+    """True inside a worker forked by PreforkServer"""
+    return _master_pid is not None
+
+
+def request_reload():
+    """Ask the master for a new generation; False when not running under PreforkServer"""
+    if _master_pid is None:
+        return False
+    os.kill(_master_pid, signal.SIGHUP)
+    return True
+
+
+def send_update(body, timeout=None):
+    """
+    Hand an update to the master and wait until it is applied (workers only)
+
+    Returns (result, generation): what the master's update() returned, and the
+    generation that carries the update. Raises RuntimeError when the master
+    rejects the update or does not answer within timeout seconds. Request threads
+    don't wait for each other, so the master can apply their updates together.
+    """
+    if _channel is None:
+        raise RuntimeError('Not running in a prefork worker')
+
+    deadline = time.monotonic() + (PREFORK_UPDATE_TIMEOUT if timeout is None else timeout)
+    message_id = next(_message_ids)
+    with _replies_condition:
+        _waiting.add(message_id)
+    try:
+        with _channel_send_lock:
+            _channel.sendall(json.dumps({'id': message_id, 'body': body}).encode() + b'\n')
+        reply = _wait_for_reply(message_id, deadline)
+    except OSError as e:
+        raise RuntimeError(f"No reply from the master: {e}") from e
+    finally:
+        with _replies_condition:
+            _waiting.discard(message_id)
+            _replies.pop(message_id, None)
+
+    if 'error' in reply:
+        raise RuntimeError(reply['error'])
+    return reply['result'], reply['generation']
+
+
+def _wait_for_reply(message_id, deadline):
+    global _receiving
+
+    while True:
+        with _replies_condition:
+            while message_id not in _replies and _receiving:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise TimeoutError('timed out')
+                _replies_condition.wait(remaining)
+            if message_id in _replies:
+                return _replies.pop(message_id)
+            _receiving = True
+
+        # This thread reads the next reply, whoever it is for
+        reply = None
+        try:
+            reply = json.loads(_receive_line(deadline))
+        finally:
+            with _replies_condition:
+                _receiving = False
+                # Replies to updates that timed out earlier are skipped
+                if reply is not None and reply.get('id') in _waiting:
+                    _replies[reply['id']] = reply
+                _replies_condition.notify_all()
+
+
+def _receive_line(deadline):
+    global _channel_buffer
+
+    while b'\n' not in _channel_buffer:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise TimeoutError('timed out')
+        _channel.settimeout(remaining)
+        data = _channel.recv(65536)
+        if not data:
+            raise ConnectionError('channel closed')
+        _channel_buffer += data
+
+    line, _, rest = bytes(_channel_buffer).partition(b'\n')
+    _channel_buffer = bytearray(rest)
+    return line
+
+
+def process_memory(pid='self'):
+    """RSS / PSS / shared / private memory of a process in MB (Linux only, else None)"""
+    fields = {}
+    try:
+        with open(f'/proc/{pid}/smaps_rollup') as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) == 3 and parts[2] == 'kB':
+                    fields[parts[0].rstrip(':')] = int(parts[1])
+    except OSError:
+        return None
+
+    def mb(*names):
+        return round(sum(fields.get(name, 0) for name in names) / 1024, 1)
+
+    return {
+        'rss_mb': mb('Rss'),
+        'pss_mb': mb('Pss'),
+        'shared_mb': mb('Shared_Clean', 'Shared_Dirty'),
+        'private_mb': mb('Private_Clean', 'Private_Dirty'),
+    }
+
+
+def info():
+    """Process role, generation and memory, for the health endpoints"""
+    if _worker_info is None:
+        return {'mode': 'single', 'pid': os.getpid(), 'memory': process_memory()}
+    return {
+        'mode': 'prefork',
+        'pid': os.getpid(),
+        'master_pid': _master_pid,
+        **_worker_info,
+        'memory': process_memory(),
+    }
+
+
+class PreforkServer:
+    """Master process: builds model generations and keeps one set of workers per generation"""
+
+    def __init__(self, app, load, host='0.0.0.0', port=5000, workers=None,
+                 graceful_timeout=PREFORK_GRACEFUL_TIMEOUT, update=None, update_debounce=PREFORK_UPDATE_DEBOUNCE,
+                 on_worker_exit=()):
+        # load() builds and publishes the model in this process; it is called once
+        # before the first fork and again for every reload.
+        # update(body) applies an update sent by a worker to the published model and
+        # returns (result, changed): a JSON-serialisable result and whether the model
+        # changed. Without it workers can't send updates.
+        # on_worker_exit: callables a worker runs, in order, before it exits; workers leave
+        # with os._exit(), which skips atexit (flush queued writes, stop the log listener)
+        self.app = app
+        self.load = load
+        self.update = update
+        self.host = host
+        self.port = port
+        self.workers = workers or PREFORK_WORKERS or os.cpu_count() or 1
+        self.graceful_timeout = graceful_timeout
+        self.update_debounce = update_debounce
+        self.on_worker_exit = list(on_worker_exit)
+
+        self.generation = 0
+        self._workers = {}        # pid -> (generation, index)
+        self._stopping = {}       # pid -> deadline for SIGKILL
+        self._channels = {}       # pid -> master end of the worker's socket pair
+        self._buffers = {}        # pid -> bytes received after the last complete line
+        self._socket = None
+        self._reload_requested = False
+        self._stop_requested = False
+
+    def serve_forever(self):
+        self._socket = socket.create_server((self.host, self.port), backlog=2048)
+        self.port = self._socket.getsockname()[1]
+
+        for sig, handler in (
+            (signal.SIGHUP, self._on_reload_signal),
+            (signal.SIGTERM, self._on_stop_signal),
+            (signal.SIGINT, self._on_stop_signal),
+        ):
+            signal.signal(sig, handler)
+
+        if not self._build():
+            logger.warning("⚠️  Starting workers without a model; send SIGHUP to retry")
+        self._spawn_generation()
+        logger.info(
+            "✅ Master %d serving http://%s:%d with %d workers",
+            os.getpid(), self.host, self.port, self.workers
+        )
+
+        try:
+            while not self._stop_requested:
+                self._reap()
+                if self._reload_requested:
+                    self._reload_requested = False
+                    self._roll()
+                self._kill_overdue()
+                self._serve_updates(timeout=0.2)
+        finally:
+            self._shutdown()
+
+    # ========================================
+    # Generations
+    # ========================================
+
+    def _build(self):
+        """Run load() and start a new generation if it succeeds"""
+        started = time.perf_counter()
+        try:
+            self._unfrozen(self.load)
+        except Exception as e:
+            logger.exception("❌ Could not build generation %d: %s", self.generation + 1, e)
+            return False
+
+        self.generation += 1
+        logger.info("✅ Built generation %d in %.2fs", self.generation, time.perf_counter() - started)
+        return True
+
+    @staticmethod
+    def _unfrozen(step):
+        """Run a step that changes the model, with the objects frozen for the workers collectable"""
+        gc.unfreeze()
+        try:
+            return step()
+        finally:
+            # Keep the collector from touching (and so copying) the inherited objects
+            gc.collect()
+            gc.freeze()
+
+    def _roll(self):
+        logger.info("🔄 Reload requested, building generation %d...", self.generation + 1)
+        if not self._build():
+            logger.warning("⚠️  Generation %d keeps serving", self.generation)
+            return
+        self._replace_workers()
+
+    def _replace_workers(self):
+        old = [pid for pid, (generation, _) in self._workers.items() if generation != self.generation]
+        self._spawn_generation()
+        for pid in old:
+            self._terminate(pid)
+
+    def _spawn_generation(self):
+        for index in range(self.workers):
+            self._spawn(index)
+
+    def _spawn(self, index):
+        master_end, worker_end = socket.socketpair()
+        pid = os.fork()
+        if pid:
+            worker_end.close()
+            self._workers[pid] = (self.generation, index)
+            self._channels[pid] = master_end
+            self._buffers[pid] = b''
+            return
+
+        code = 0
+        try:
+            master_end.close()
+            self._run_worker(index, worker_end)
+        except BaseException as e:
+            logger.exception("❌ Worker %d crashed: %s", index, e)
+            code = 1
+        finally:
+            self._run_exit_hooks()
+            os._exit(code)
+
+    def _run_exit_hooks(self):
+        for hook in self.on_worker_exit:
+            try:
+                hook()
+            except Exception as e:
+                logger.exception("❌ Worker exit hook %r failed: %s", hook, e)
+
+    # ========================================
+    # Worker
+    # ========================================
+
+    def _run_worker(self, index, channel):
+        global _master_pid, _worker_info, _channel
+
+        _master_pid = os.getppid()
+        _worker_info = {'worker': index, 'generation': self.generation}
+        _channel = channel
+        # The other workers' channels belong to the master
+        for other in self._channels.values():
+            other.close()
+        self._channels = {}
+
+        server = make_server(self.host, self.port, self.app, threaded=True, fd=self._socket.fileno())
+        # server_close() then waits for the request threads that are still running
+        server.daemon_threads = False
+
+        def stop(signum, frame):
+            # shutdown() blocks until serve_forever() returns, so it can't run on this thread
+            threading.Thread(target=server.shutdown, daemon=True).start()
+
+        signal.signal(signal.SIGTERM, stop)
+        # Ctrl+C reaches the whole process group; the master decides when workers stop
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.signal(signal.SIGHUP, signal.SIG_DFL)
+
+        logger.info("✅ Worker %d (pid %d) serving generation %d", index, os.getpid(), self.generation)
+        server.serve_forever()
+        server.server_close()
+
+    # ========================================
+    # Updates from workers
+    # ========================================
+
+    def _serve_updates(self, timeout):
+        """
+        Wait up to timeout for updates and apply them
+
+        Updates arriving within update_debounce of the first one are applied together;
+        a new generation is forked only when at least one of them changed the model.
+        """
+        messages = self._receive_updates(timeout)
+        if not messages:
+            return
+        deadline = time.monotonic() + self.update_debounce
+        while self._channels and not self._stop_requested:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            messages += self._receive_updates(remaining)
+
+        if self.update is None:
+            for channel, message in messages:
+                self._reply(channel, {'id': message.get('id'), 'error': 'Updates are not supported'})
+            return
+
+        started = time.perf_counter()
+        replies = []
+        changed = False
+
+        def apply():
+            nonlocal changed
+            for channel, message in messages:
+                try:
+                    result, update_changed = self.update(message.get('body'))
+                except Exception as e:
+                    logger.exception("❌ Update from a worker failed: %s", e)
+                    replies.append((channel, {'id': message.get('id'), 'error': str(e)}))
+                    continue
+                changed = changed or bool(update_changed)
+                replies.append((channel, {'id': message.get('id'), 'result': result}))
+
+        self._unfrozen(apply)
+        if changed:
+            self.generation += 1
+            logger.info(
+                "✅ Applied %d updates as generation %d in %.2fs",
+                len(messages), self.generation, time.perf_counter() - started
+            )
+        else:
+            logger.info("ℹ️  %d updates changed nothing, generation %d keeps serving", len(messages), self.generation)
+
+        for channel, reply in replies:
+            self._reply(channel, {**reply, 'generation': self.generation})
+        if changed:
+            self._replace_workers()
+
+    def _receive_updates(self, timeout):
+        """Complete messages that arrive within timeout, as (channel, message) pairs"""
+        channels = {channel: pid for pid, channel in self._channels.items()}
+        if not channels:
+            time.sleep(timeout)
+            return []
+        readable, _, _ = select.select(list(channels), [], [], timeout)
+
+        messages = []
+        for channel in readable:
+            pid = channels[channel]
+            try:
+                data = channel.recv(65536)
+            except OSError:
+                data = b''
+            if not data:
+                # The worker exited; _reap() takes care of it
+                self._close_channel(pid)
+                continue
+
+            lines = (self._buffers[pid] + data).split(b'\n')
+            self._buffers[pid] = lines.pop()
+            messages += [(channel, json.loads(line)) for line in lines]
+        return messages
+
+    @staticmethod
+    def _reply(channel, reply):
+        try:
+            channel.sendall(json.dumps(reply).encode() + b'\n')
+        except OSError:
+            pass
+
+    def _close_channel(self, pid):
+        channel = self._channels.pop(pid, None)
+        self._buffers.pop(pid, None)
+        if channel is not None:
+            channel.close()
+
+    # ========================================
+    # Supervision
+    # ========================================
+
+    def _on_reload_signal(self, signum, frame):
+        self._reload_requested = True
+
+    def _on_stop_signal(self, signum, frame):
+        self._stop_requested = True
+
+    def _reap(self):
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+
+            generation, index = self._workers.pop(pid, (None, None))
+            self._stopping.pop(pid, None)
+            self._close_channel(pid)
+            if generation == self.generation and not self._stop_requested:
+                logger.warning(
+                    "⚠️  Worker %d (pid %d) exited with status %d, restarting",
+                    index, pid, os.waitstatus_to_exitcode(status)
+                )
+                self._spawn(index)
+
+    def _terminate(self, pid):
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            return
+        self._stopping[pid] = time.monotonic() + self.graceful_timeout
+
+    def _kill_overdue(self):
+        now = time.monotonic()
+        for pid, deadline in list(self._stopping.items()):
+            if now >= deadline:
+                logger.warning("⚠️  Worker pid %d did not stop in %.0fs, killing it", pid, self.graceful_timeout)
+                try:
+                    os.kill(pid, signal.SIGKILL)
+                except ProcessLookupError:
+                    pass
+                del self._stopping[pid]
+
+    def _shutdown(self):
+        logger.info("🛑 Stopping %d workers...", len(self._workers))
+        for pid in list(self._workers):
+            if pid not in self._stopping:
+                self._terminate(pid)
+
+        while self._workers:
+            self._reap()
+            self._kill_overdue()
+            time.sleep(0.05)
+        self._socket.close()
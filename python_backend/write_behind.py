@@ -0,0 +1,306 @@
+"""
+Write-behind queue for Firestore documents
+
+Request handlers enqueue a document write and return straight away. A background
+thread commits the queued writes in batches:
+- writes to the same document are coalesced (only the newest data is written)
+- up to max_batch documents go into one WriteBatch commit
+- failed commits are retried with exponential backoff, then dropped and counted;
+  attempts are tracked per document, and a document waiting for its retry is
+  skipped (not slept on), so it doesn't hold up the rest of the queue
+"""
+
+from collections import OrderedDict
+import atexit
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class WriteBehindQueue:
+    """Coalescing, batching Firestore writer running on a background thread"""
+
+    def __init__(self, db_provider, max_batch=100, flush_interval=0.05,
+                 max_retries=5, retry_backoff=0.5, on_commit=None):
+        # db_provider is called on the worker thread, e.g. firestore.client
+        self.db_provider = db_provider
+        # on_commit(seconds, documents, ok) is called after every commit attempt (metrics)
+        self.on_commit = on_commit
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+
+        self._pending = OrderedDict()     # (collection, doc_id) -> (data, attempts, enqueued_at, not_before)
+        self._in_flight = 0
+        self._condition = threading.Condition()
+        self._thread = None
+
+        # Stats
+        self.written = 0
+        self.coalesced = 0
+        self.retries = 0
+        self.failed = 0
+        self.last_flush_ms = None
+        self.avg_flush_ms = None
+        self.last_error = None
+
+        atexit.register(self.flush, 5.0)
+
+    def enqueue(self, collection, doc_id, data):
+        """Queue a full-document set(); replaces any queued write to the same document"""
+        key = (collection, doc_id)
+        with self._condition:
+            if key in self._pending:
+                self.coalesced += 1
+                del self._pending[key]
+            self._pending[key] = (data, 0, time.monotonic(), 0.0)
+            self._ensure_worker()
+            self._condition.notify()
+
+    def flush(self, timeout=None):
+        """Block until everything queued so far is committed (or dropped)"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._condition:
+            while self._pending or self._in_flight:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._condition.wait(remaining)
+        return True
+
+    def stats(self):
+        with self._condition:
+            oldest = next(iter(self._pending.values()), None)
+            return {
+                'depth': len(self._pending),
+                'in_flight': self._in_flight,
+                'oldest_pending_ms': (
+                    round((time.monotonic() - oldest[2]) * 1000, 1) if oldest else None
+                ),
+                'written': self.written,
+                'coalesced': self.coalesced,
+                'retries': self.retries,
+                'failed': self.failed,
+                'last_flush_ms': self.last_flush_ms,
+                'avg_flush_ms': self.avg_flush_ms,
+                'last_error': self.last_error,
+            }
+
+    # ========================================
+    # Worker
+    # ========================================
+
+    def _ensure_worker(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name='write-behind', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while True:
+                    delay = self._next_ready()
+                    if delay == 0:
+                        break
+                    self._condition.wait(delay)
+
+                # Give concurrent requests a moment to join the same batch
+                if len(self._pending) < self.max_batch:
+                    self._condition.wait(self.flush_interval)
+
+                batch = self._take_ready()
+                self._in_flight = len(batch)
+
+            self._commit(batch)
+
+            with self._condition:
+                self._in_flight = 0
+                self._condition.notify_all()
+
+    def _next_ready(self):
+        """Seconds until a queued write may be committed (0: now, None: queue empty)"""
+        if not self._pending:
+            return None
+        not_before = min(entry[3] for entry in self._pending.values())
+        return max(0.0, not_before - time.monotonic())
+
+    def _take_ready(self):
+        now = time.monotonic()
+        batch = []
+        for key, entry in list(self._pending.items()):
+            if len(batch) >= self.max_batch:
+                break
+            if entry[3] <= now:
+                batch.append((key, self._pending.pop(key)))
+        return batch
+
+    def _commit(self, batch):
+        started = time.perf_counter()
+        try:
+            db = self.db_provider()
+            write_batch = db.batch()
+            for (collection, doc_id), (data, _, _, _) in batch:
+                write_batch.set(db.collection(collection).document(doc_id), data)
+            write_batch.commit()
+        except Exception as e:
+            self.last_error = str(e)
+            if self.on_commit is not None:
+                self.on_commit(time.perf_counter() - started, len(batch), False)
+            self._requeue(batch)
+            return
+
+        elapsed = time.perf_counter() - started
+        if self.on_commit is not None:
+            self.on_commit(elapsed, len(batch), True)
+        elapsed_ms = round(elapsed * 1000, 2)
+        with self._condition:
+            self.written += len(batch)
+            self.last_flush_ms = elapsed_ms
+            self.avg_flush_ms = (
+                elapsed_ms if self.avg_flush_ms is None
+                else round(self.avg_flush_ms * 0.9 + elapsed_ms * 0.1, 2)
+            )
+
+    def _requeue(self, batch):
+        """
+        Schedule each failed write for a retry after its own backoff, unless a newer
+        write for the document arrived meanwhile; drop writes that used up their retries
+        """
+        retry_at = time.monotonic()
+        dropped = 0
+        with self._condition:
+            for key, (data, attempts, enqueued_at, _) in batch:
+                if key in self._pending:
+                    continue
+                attempts += 1
+                if attempts > self.max_retries:
+                    dropped += 1
+                    continue
+                delay = min(self.retry_backoff * 2 ** (attempts - 1), 30.0)
+                self._pending[key] = (data, attempts, enqueued_at, retry_at + delay)
+                self._pending.move_to_end(key, last=False)
+                self.retries += 1
+            self.failed += dropped
+
+        if dropped:
+            logger.error("❌ Dropped %d queued writes after %d retries: %s", dropped, self.max_retries, self.last_error)
+
+
+# ========================================
+# Tests
+# ========================================
+
+class _FakeDb:
+    """collection().document() / batch().set() / commit(); commits touching a failing id raise"""
+
+    def __init__(self, failing=()):
+        self.failing = set(failing)
+        self.documents = {}
+        self.commits = []
+        self._lock = threading.Lock()
+
+    def collection(self, collection):
+        return _FakeCollection(collection)
+
+    def batch(self):
+        return _FakeBatch(self)
+
+
+class _FakeCollection:
+
+    def __init__(self, name):
+        self.name = name
+
+    def document(self, doc_id):
+        return (self.name, doc_id)
+
+
+class _FakeBatch:
+
+    def __init__(self, db):
+        self.db = db
+        self.writes = []
+
+    def set(self, reference, data):
+        self.writes.append((reference, data))
+
+    def commit(self):
+        with self.db._lock:
+            ids = [reference[1] for reference, _ in self.writes]
+            self.db.commits.append(ids)
+            if self.db.failing & set(ids):
+                raise RuntimeError(f'commit failed: {sorted(self.db.failing & set(ids))}')
+            for reference, data in self.writes:
+                self.db.documents[reference] = data
+
+
+def _wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.005)
+    return True
+
+
+def test_coalescing_and_batching():
+    """Writes to one document are coalesced and commits hold at most max_batch documents"""
+    db = _FakeDb()
+    queue = WriteBehindQueue(lambda: db, max_batch=3, flush_interval=0.05)
+    for i in range(7):
+        queue.enqueue('recommendations', f'user-{i}', {'version': 1})
+    queue.enqueue('recommendations', 'user-3', {'version': 2})
+    assert queue.flush(5)
+
+    assert len(db.documents) == 7
+    assert db.documents[('recommendations', 'user-3')] == {'version': 2}
+    assert all(len(commit) <= 3 for commit in db.commits)
+    stats = queue.stats()
+    assert stats['written'] == 7 and stats['coalesced'] == 1 and stats['failed'] == 0
+    print("✅ Write-behind queue coalesces and batches writes")
+
+
+def test_retry_attempts_per_document():
+    """A fresh write batched with a retried one keeps its own retry budget"""
+    db = _FakeDb(failing={'bad'})
+    queue = WriteBehindQueue(lambda: db, max_batch=10, flush_interval=0.2, max_retries=2, retry_backoff=0.05)
+    queue.enqueue('recommendations', 'bad', {'n': 1})
+    assert _wait_for(lambda: queue.stats()['retries'] >= 1)
+
+    # 'bad' is due again and the writer is waiting for the batch to fill:
+    # 'fresh' lands in the same batch as the retried write and fails along with it
+    time.sleep(0.1)
+    queue.enqueue('recommendations', 'fresh', {'n': 2})
+    assert queue.flush(5)
+
+    assert db.documents == {('recommendations', 'fresh'): {'n': 2}}
+    assert any(set(commit) == {'bad', 'fresh'} for commit in db.commits)
+    assert sum(commit.count('bad') for commit in db.commits) == 3     # 1 try + max_retries
+    stats = queue.stats()
+    assert stats['failed'] == 1 and stats['written'] == 1
+    print("✅ Write-behind retries are counted per document and exhausted writes are dropped")
+
+
+def test_backoff_does_not_block_queue():
+    """A write waiting for its retry doesn't hold up the other queued writes"""
+    db = _FakeDb(failing={'bad'})
+    queue = WriteBehindQueue(lambda: db, flush_interval=0.01, max_retries=5, retry_backoff=30.0)
+    queue.enqueue('recommendations', 'bad', {'n': 1})
+    assert _wait_for(lambda: queue.stats()['retries'] == 1)
+
+    started = time.monotonic()
+    queue.enqueue('recommendations', 'other', {'n': 2})
+    assert _wait_for(lambda: ('recommendations', 'other') in db.documents, timeout=2.0)
+    assert time.monotonic() - started < 2.0
+    assert queue.stats()['depth'] == 1     # 'bad' still scheduled for its retry
+    print("✅ Write-behind backoff is scheduled per document instead of sleeping the writer")
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.CRITICAL)
+    test_coalescing_and_batching()
+    test_retry_attempts_per_document()
+    test_backoff_does_not_block_queue()
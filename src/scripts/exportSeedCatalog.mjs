@@ -0,0 +1,79 @@
+// Export the catalog fields of the seed data to src/data/seedCatalog.json
+//
+// The Python backend's offline catalog (LocalContentSource) reads that JSON file,
+// so it never has to understand TypeScript. Re-run this after editing the seed data:
+//
+//     node src/scripts/exportSeedCatalog.mjs
+//
+// Needs Node 22.13+ (built-in TypeScript type stripping); no npm packages. Each source
+// file is evaluated as plain JavaScript in a sandbox: imports are replaced by inert
+// stubs (Timestamp.now() becomes null) and nothing is called, so no Firebase access.
+
+import { readFileSync, writeFileSync } from 'node:fs';
+import { stripTypeScriptTypes } from 'node:module';
+import { dirname, join } from 'node:path';
+import { fileURLToPath } from 'node:url';
+import vm from 'node:vm';
+
+const root = join(dirname(fileURLToPath(import.meta.url)), '..', '..');
+
+// [file, constant (dotted path), kind]; nested lists and objects of records are searched
+// for every object with an id. Grammar_Lessons_Complete.ts is not listed: its videos have
+// no ids, so they have no route.
+const SOURCES = [
+  ['src/scripts/completeFirebaseSeed.ts', 'COMPLETE_SEED_DATA.lessons', 'lessons'],
+  ['src/scripts/seedFirestore.ts', 'grammarLessons', 'lessons'],
+  ['src/scripts/seedFirestore.ts', 'vocabularyLessons', 'lessons'],
+  ['src/data/videoContent.ts', 'videos', 'videos'],
+];
+
+// The only fields the catalog uses
+const FIELDS = [
+  'id', 'title', 'moduleId', 'category', 'level', 'recommendedLevel', 'requiredLevel', 'difficulty', 'description',
+];
+
+const IMPORT = /^\s*import\s+(?:type\s+)?(?:\{([^}]*)\}|(\w+))?[^;]*?from\s+['"][^'"]+['"];?/gm;
+
+function stub() {
+  const inert = new Proxy(function () {}, {
+    get: (target, key) => (key === Symbol.toPrimitive || key === 'toJSON' ? () => null : inert),
+    apply: () => null,
+    construct: () => ({}),
+  });
+  return inert;
+}
+
+function evaluate(path, names) {
+  const source = readFileSync(join(root, path), 'utf-8');
+  const sandbox = {};
+  const code = stripTypeScriptTypes(source.replace(IMPORT, (statement, named, single) => {
+    for (const name of (named ? named.split(',') : [single]).filter(Boolean)) {
+      sandbox[name.split(/\s+as\s+/).pop().trim()] = stub();
+    }
+    return '';
+  })).replace(/^export\s+(default\s+)?/gm, '');
+  return vm.runInNewContext(`${code}\n;({ ${names.join(', ')} })`, sandbox, { filename: path });
+}
+
+function records(value) {
+  if (Array.isArray(value)) return value.flatMap(records);
+  if (value && typeof value === 'object') {
+    if ('id' in value) {
+      return [Object.fromEntries(FIELDS.filter((field) => value[field] != null).map((field) => [field, value[field]]))];
+    }
+    return Object.values(value).flatMap(records);
+  }
+  return [];
+}
+
+const catalog = { lessons: [], videos: [] };
+for (const [path, constant, kind] of SOURCES) {
+  const [name, ...keys] = constant.split('.');
+  const value = keys.reduce((node, key) => node[key], evaluate(path, [name])[name]);
+  const found = records(value);
+  catalog[kind].push(...found);
+  console.log(`${path} ${constant}: ${found.length} ${kind}`);
+}
+
+writeFileSync(join(root, 'src', 'data', 'seedCatalog.json'), `${JSON.stringify(catalog, null, 2)}\n`);
+console.log(`Wrote src/data/seedCatalog.json (${catalog.lessons.length} lessons, ${catalog.videos.length} videos)`);